@@ -0,0 +1,105 @@
+# benchmarks/bench_intent_batch.py
+# interpret_user_message con y sin micro-lotes (INTENT_BATCH) frente a un pico
+# de usuarios simultáneos. El modelo es simulado: su latencia crece con el
+# tamaño del prompt y con la cantidad de comandos que devuelve, y las llamadas
+# simultáneas están limitadas por LLM_CONCURRENCY como en producción.
+#
+# Uso: python -m benchmarks.bench_intent_batch [--usuarios 200] [--ventana-ms 20] [--max-lote 16]
+import argparse
+import asyncio
+import json
+import time
+
+from services import gemini, intent_cache, llm_client
+from services.intent_batch import MicroBatcher
+from services.llm_router import ModelRouter
+
+_TEXTOS = [
+    "me recomiendas algo para el pelo seco",
+    "qué sirve para quitar manchas de grasa",
+    "busco un regalo para mi mamá",
+    "algo para limpiar el baño que huela rico",
+    "necesito cosas para la cocina",
+]
+
+
+class _Resp:
+    def __init__(self, text):
+        self.text = text
+        self.candidates = []
+
+
+class _ModeloSimulado:
+    """latencia = base + costo por carácter de entrada + costo por comando de salida."""
+
+    def __init__(self, base_ms, ms_por_kchar, ms_por_comando):
+        self.base_ms, self.ms_por_kchar, self.ms_por_comando = base_ms, ms_por_kchar, ms_por_comando
+        self.llamadas = 0
+        self.chars_entrada = 0
+
+    async def generate_content_async(self, prompt, **kwargs):
+        # Las instrucciones fijas viajan como system_instruction: también son entrada
+        entrada = len(gemini._INSTRUCCIONES) + len(prompt)
+        self.llamadas += 1
+        self.chars_entrada += entrada
+        lote = prompt.find("\n[")
+        ids = [m["id"] for m in json.loads(prompt[lote + 1:])] if lote >= 0 else []
+        ms = self.base_ms + self.ms_por_kchar * entrada / 1000 + self.ms_por_comando * max(1, len(ids))
+        await asyncio.sleep(ms / 1000)
+        if not ids:
+            return _Resp("/productos")
+        return _Resp(json.dumps([{"id": i, "comando": "/productos"} for i in ids]))
+
+
+async def _ronda(usuarios: int, lote: bool, modelo: _ModeloSimulado, ronda: int):
+    gemini.INTENT_BATCH = lote
+    intent_cache._cache.clear()
+    lat = []
+
+    async def usuario(i):
+        t0 = time.perf_counter()
+        await gemini.interpret_user_message(f"{_TEXTOS[i % len(_TEXTOS)]} ({ronda}-{i})", chat_id=i)
+        lat.append((time.perf_counter() - t0) * 1000)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(usuario(i) for i in range(usuarios)))
+    total = time.perf_counter() - t0
+    lat.sort()
+    return {
+        "msg/s": usuarios / total,
+        "p50": lat[len(lat) // 2],
+        "p99": lat[max(0, int(len(lat) * 0.99) - 1)],
+        "llamadas": modelo.llamadas,
+        "kchar": modelo.chars_entrada / 1000,
+    }
+
+
+async def run(usuarios, ventana_ms, max_lote, base_ms, ms_por_kchar, ms_por_comando):
+    modelo = _ModeloSimulado(base_ms, ms_por_kchar, ms_por_comando)
+    gemini._model, gemini._model_name = modelo, "simulado"
+    gemini._router = ModelRouter(["simulado"], lambda _: modelo)
+    gemini._lote = MicroBatcher(gemini._interpretar_lote, ventana_ms, max_lote)
+    gemini.INTENT_RULES_MIN_CONF = 2.0    # todo va al modelo
+
+    print(f"{usuarios} usuarios simultáneos, LLM_CONCURRENCY={llm_client.LLM_CONCURRENCY}, "
+          f"ventana={ventana_ms} ms, lote máx={max_lote}")
+    print(f"{'modo':<10} | {'msg/s':>8} | {'p50 ms':>8} | {'p99 ms':>8} | {'llamadas':>8} | {'kchar in':>8}")
+    print("-" * 66)
+    for i, (label, lote) in enumerate((("individual", False), ("lotes", True))):
+        modelo.llamadas = modelo.chars_entrada = 0
+        r = await _ronda(usuarios, lote, modelo, i)
+        print(f"{label:<10} | {r['msg/s']:>8.1f} | {r['p50']:>8.0f} | {r['p99']:>8.0f} | "
+              f"{r['llamadas']:>8} | {r['kchar']:>8.1f}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--usuarios", type=int, default=200)
+    ap.add_argument("--ventana-ms", type=float, default=20)
+    ap.add_argument("--max-lote", type=int, default=16)
+    ap.add_argument("--base-ms", type=float, default=300, help="latencia fija por llamada")
+    ap.add_argument("--ms-por-kchar", type=float, default=40, help="costo por 1000 caracteres de entrada")
+    ap.add_argument("--ms-por-comando", type=float, default=15, help="costo por comando generado")
+    args = ap.parse_args()
+    asyncio.run(run(args.usuarios, args.ventana_ms, args.max_lote, args.base_ms, args.ms_por_kchar,
+                    args.ms_por_comando))
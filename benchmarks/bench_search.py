@@ -0,0 +1,106 @@
+# benchmarks/bench_search.py
+# Compara la cascada de LIKE '%q%' (reproducida sobre SQLite en memoria, sin
+# latencia de red) contra el índice de trigramas de services/search_index.py.
+#
+# Uso: python -m benchmarks.bench_search [--sizes 1000 10000 100000]
+import argparse
+import random
+import sqlite3
+import time
+
+from services.catalog import CatalogSnapshot
+
+_BASES = [
+    "Papel higiénico", "Jabón de baño", "Shampoo", "Toallas de mano", "Crema dental",
+    "Detergente en polvo", "Limpiador multiusos", "Suavizante", "Cepillo de dientes",
+    "Desodorante", "Acondicionador", "Servilletas", "Bolsas de basura", "Esponjas",
+    "Cloro", "Lavaloza", "Ambientador", "Pañitos húmedos", "Algodón", "Velas",
+]
+_MARCAS = ["Familia", "Protex", "Sedal", "Colgate", "Fab", "Ariel", "Fabuloso", "Nosotras", "Scott", "Axion"]
+_DESCS = ["uso diario", "doble hoja", "aroma lavanda", "con glicerina", "bolsa ahorro", "pack familiar"]
+
+_LIKE_ACC = "lower(replace(replace(replace(replace(replace({col}, 'á', 'a'), 'é', 'e'), 'í', 'i'), 'ó', 'o'), 'ú', 'u'))"
+
+QUERIES = [
+    ("nivel 1 (exacta)", "Jabón"),
+    ("nivel 2 (sin tilde)", "jabon"),
+    ("nivel 3 (plural)", "jabones"),
+    ("sin resultados", "zanahoria"),
+]
+
+
+def _catalogo(n: int, seed: int = 7):
+    rnd = random.Random(seed)
+    rows = []
+    for i in range(1, n + 1):
+        nombre = f"{rnd.choice(_BASES)} {rnd.choice(_MARCAS)} {rnd.randint(1, 999)} g"
+        desc = f"{rnd.choice(_DESCS)} ref {i}"
+        rows.append((i, nombre, desc, "Aseo", rnd.randint(1000, 50000), rnd.randint(0, 40), None))
+    return rows
+
+
+def _cascada_sqlite(cur, q: str, limit: int = 6):
+    """Misma forma de consulta que usaba dbx.search_products (hasta 3 escaneos)."""
+    from utils.text import _singularize_phrase_es, _norm
+
+    base = "SELECT inventario_id, nombre, precio_cop, stock FROM v_productos WHERE stock > 0 AND ({cond}) ORDER BY inventario_id LIMIT ?"
+    like = f"%{q}%"
+    cur.execute(base.format(cond="lower(nombre) LIKE lower(?) OR lower(descripcion) LIKE lower(?)"), (like, like, limit))
+    res = cur.fetchall()
+    if res:
+        return res
+    cond = f"{_LIKE_ACC.format(col='nombre')} LIKE lower(?) OR {_LIKE_ACC.format(col='descripcion')} LIKE lower(?)"
+    q_clean = q
+    for a, b in (("á", "a"), ("é", "e"), ("í", "i"), ("ó", "o"), ("ú", "u")):
+        q_clean = q_clean.replace(a, b)
+    like = f"%{q_clean}%"
+    cur.execute(base.format(cond=cond), (like, like, limit))
+    res = cur.fetchall()
+    if res:
+        return res
+    q_sing = _singularize_phrase_es(q)
+    if q_sing and q_sing != _norm(q):
+        like = f"%{q_sing}%"
+        cur.execute(base.format(cond=cond), (like, like, limit))
+        res = cur.fetchall()
+    return res
+
+
+def _medir(fn, reps: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(reps):
+        fn()
+    return (time.perf_counter() - t0) / reps
+
+
+def run(sizes):
+    print(f"{'SKUs':>8} | {'consulta':<20} | {'cascada':>12} | {'índice':>12} | {'x':>8}")
+    print("-" * 72)
+    for n in sizes:
+        rows = _catalogo(n)
+
+        db = sqlite3.connect(":memory:")
+        db.execute("CREATE TABLE v_productos (inventario_id INTEGER, nombre TEXT, descripcion TEXT, categoria TEXT, precio_cop INTEGER, stock INTEGER, updated_at TEXT)")
+        db.executemany("INSERT INTO v_productos VALUES (?,?,?,?,?,?,?)", rows)
+        cur = db.cursor()
+
+        t0 = time.perf_counter()
+        snap = CatalogSnapshot(lambda since: rows)
+        snap.refresh(full=True)
+        build_ms = (time.perf_counter() - t0) * 1000
+
+        reps_sql = max(3, 2000 // max(1, n // 100))
+        for label, q in QUERIES:
+            t_sql = _medir(lambda: _cascada_sqlite(cur, q), reps_sql)
+            t_idx = _medir(lambda: snap.search(q, 6), 200)
+            print(f"{n:>8} | {label:<20} | {t_sql * 1000:>9.3f} ms | {t_idx * 1e6:>9.1f} µs | {t_sql / t_idx:>7.0f}x")
+        print(f"{n:>8} | {'construcción índice':<20} | {'':>12} | {build_ms:>9.1f} ms |")
+        print("-" * 72)
+        db.close()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    args = ap.parse_args()
+    run(args.sizes)
@@ -0,0 +1,97 @@
+# benchmarks/bench_text.py
+# Compara la normalización anterior (unicodedata carácter a carácter y el bucle
+# de 15 regex de normalizar_numeros) con la de utils/text.py (tablas
+# str.translate + una sola regex + caché acotada).
+#
+# Uso: python -m benchmarks.bench_text [--n 20000]
+import argparse
+import random
+import re
+import time
+import unicodedata
+
+from utils import text as T
+
+_MENSAJES = [
+    "Hola, quiero dos papel higiénico y un jabón de baño",
+    "agrega 3 shampoo, 2 jabones y una toalla",
+    "¿Tienen cepillos de dientes? Necesito cuatro",
+    "dame diez bolsas de basura y doce esponjas por favor",
+    "ver carrito",
+    "Buenas tardes, ¿cuánto cuesta el desodorante?",
+]
+_PALABRAS = ["Papel", "higiénico", "Jabón", "baño", "Shampoo", "Toallas", "algodón", "Crema", "dental",
+             "Detergente", "Limpiador", "Suavizante", "Cepillo", "Pañitos", "húmedos", "Acondicionador"]
+
+
+# ---------- implementación anterior ----------
+def _norm_viejo(s: str) -> str:
+    if not s:
+        return ""
+    s = unicodedata.normalize("NFD", s)
+    s = "".join(ch for ch in s if unicodedata.category(ch) != "Mn")
+    return " ".join(s.lower().strip().split())
+
+
+def _sing_viejo(s: str) -> str:
+    return " ".join(T._singularize_token_es.__wrapped__(p) for p in _norm_viejo(s).split())
+
+
+def _numeros_viejo(text: str) -> str:
+    text_lower = text.lower()
+    for palabra, numero in T.NUMEROS_TEXTO.items():
+        text_lower = re.sub(rf"\b{palabra}\b", str(numero), text_lower)
+    return text_lower
+
+
+# ---------- nueva, sin caché (mide solo translate) ----------
+def _norm_nuevo_sin_cache(s: str) -> str:
+    return T._norm.__wrapped__(s)
+
+
+def _sing_nuevo_sin_cache(s: str) -> str:
+    return " ".join(T._singularize_token_es.__wrapped__(p) for p in _norm_nuevo_sin_cache(s).split())
+
+
+def _medir(fn, datos) -> float:
+    t0 = time.perf_counter()
+    for d in datos:
+        fn(d)
+    return (time.perf_counter() - t0) / len(datos) * 1e6
+
+
+def _limpiar_caches():
+    T._norm.cache_clear()
+    T._singularize_token_es.cache_clear()
+    T._singularize_phrase_es.cache_clear()
+
+
+def run(n: int):
+    rnd = random.Random(7)
+    # Mezcla realista: mensajes repetidos (frases típicas) + nombres de catálogo únicos
+    mensajes = [rnd.choice(_MENSAJES) for _ in range(n)]
+    nombres = [" ".join(rnd.sample(_PALABRAS, 3)) + f" {i} g" for i in range(n)]
+
+    casos = [
+        ("_norm mensajes", _norm_viejo, _norm_nuevo_sin_cache, T._norm, mensajes),
+        ("_norm catálogo", _norm_viejo, _norm_nuevo_sin_cache, T._norm, nombres),
+        ("singularizar frase", _sing_viejo, _sing_nuevo_sin_cache, T._singularize_phrase_es, mensajes),
+        ("números a dígitos", _numeros_viejo, T.numeros_a_digitos, T.numeros_a_digitos, mensajes),
+    ]
+    print(f"{'caso':<20} | {'anterior':>10} | {'translate':>10} | {'con caché':>10} | {'x':>6}")
+    print("-" * 68)
+    for label, viejo, nuevo, cacheado, datos in casos:
+        _limpiar_caches()
+        t_viejo = _medir(viejo, datos)
+        t_nuevo = _medir(nuevo, datos)
+        _limpiar_caches()
+        t_cache = _medir(cacheado, datos)
+        mejor = min(t_nuevo, t_cache)
+        print(f"{label:<20} | {t_viejo:>7.2f} µs | {t_nuevo:>7.2f} µs | {t_cache:>7.2f} µs | {t_viejo / mejor:>5.1f}x")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=20_000)
+    args = ap.parse_args()
+    run(args.n)
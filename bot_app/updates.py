@@ -0,0 +1,40 @@
+# bot_app/updates.py
+# Procesador de updates: chats distintos en paralelo (una llamada lenta al LLM
+# ya no congela al resto de usuarios) y, dentro de un mismo chat, en orden.
+# Un mensaje nuevo cancela la llamada al LLM que siga en curso para ese chat.
+import asyncio
+import os
+import weakref
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from services import llm_client
+
+UPDATES_CONCURRENCY = int(os.getenv("UPDATES_CONCURRENCY", "64"))
+
+
+class ChatUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates: int = UPDATES_CONCURRENCY):
+        super().__init__(max_concurrent_updates)
+        self._locks = weakref.WeakValueDictionary()   # chat_id -> Lock (se libera solo)
+
+    async def do_process_update(self, update, coroutine):
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            await coroutine
+            return
+        # Solo los mensajes nuevos reemplazan la respuesta pendiente (no los botones)
+        if update.message is not None:
+            llm_client.cancel_chat(chat.id)
+        lock = self._locks.get(chat.id)
+        if lock is None:
+            lock = self._locks[chat.id] = asyncio.Lock()
+        async with lock:
+            await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -1,5 +1,6 @@
 # bot_app/wiring.py
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, ContextTypes, filters
+import asyncio
+from telegram.ext import ApplicationBuilder, CallbackQueryHandler, CommandHandler, MessageHandler, ContextTypes, filters
 from telegram.request import HTTPXRequest
 from services.config import TELEGRAM_BOT_TOKEN
 from telegram.error import TelegramError
@@ -9,8 +10,10 @@ from handlers.commands import (
     reset,
     cmd_productos, cmd_buscar, cmd_add, cmd_carrito, cmd_vaciar, cmd_checkout
 )
+from handlers.sales import productos_pagina
 from handlers.audio import on_audio
 from handlers.photo import on_photo
+from .updates import ChatUpdateProcessor
 from telegram.constants import ParseMode
 
 async def on_error(update, context):
@@ -36,6 +39,50 @@ async def _post_init(app):
         ("checkout", "Confirmar pedido"),
         ("reset", "Reiniciar contexto"),
     ])
+    # Modelo de Gemini: se resuelve en segundo plano (caché en disco o sondeo en paralelo)
+    from services import gemini
+    app.create_task(gemini.warmup())
+
+async def _refresh_catalogo(context: ContextTypes.DEFAULT_TYPE):
+    # La consulta es bloqueante: corre en el executor de dbx, fuera del event loop
+    from services import dbx
+    try:
+        n = await dbx.arefresh_catalog()
+        if n:
+            logger.info(f"Catálogo actualizado: {n} filas nuevas/modificadas")
+    except Exception as e:
+        logger.warning(f"No se pudo refrescar el catálogo: {e}")
+
+async def _flush_outbox(context: ContextTypes.DEFAULT_TYPE):
+    from services import outbox
+    from handlers.sales import avisar_rechazados
+    try:
+        rechazados = await asyncio.to_thread(outbox.flush)
+    except Exception as e:
+        logger.warning(f"No se pudo enviar el outbox de pedidos: {e}")
+        return
+    if rechazados:
+        await avisar_rechazados(context.bot, rechazados)
+
+async def _dump_metricas(context: ContextTypes.DEFAULT_TYPE):
+    from services import metrics
+    try:
+        await asyncio.to_thread(metrics.dump)
+    except Exception as e:
+        logger.warning(f"No se pudieron volcar las métricas: {e}")
+
+async def _guardar_intent_cache(context: ContextTypes.DEFAULT_TYPE):
+    # Escribir el JSON es bloqueante: fuera del event loop
+    from services import intent_cache
+    await asyncio.to_thread(intent_cache.save, True)
+
+async def _post_shutdown(app):
+    from services import dbx, gemini_contexto, intent_cache, metrics
+    if metrics.METRICS_PATH:
+        await asyncio.to_thread(metrics.dump)
+    await asyncio.to_thread(intent_cache.save)
+    await asyncio.to_thread(gemini_contexto.cerrar)
+    dbx.close_pool()
 
 def build_app():
     request = HTTPXRequest(connect_timeout=20.0, read_timeout=60.0, write_timeout=20.0, pool_timeout=20.0)
@@ -44,6 +91,8 @@ def build_app():
         .token(TELEGRAM_BOT_TOKEN)
         .request(request)
         .post_init(_post_init)   # <- para set_my_commands
+        .post_shutdown(_post_shutdown)
+        .concurrent_updates(ChatUpdateProcessor())   # chats en paralelo, orden dentro de cada chat
         .build()
     )
 
@@ -56,6 +105,7 @@ def build_app():
     app.add_handler(CommandHandler("carrito", cmd_carrito))
     app.add_handler(CommandHandler("vaciar", cmd_vaciar))
     app.add_handler(CommandHandler("checkout", cmd_checkout))
+    app.add_handler(CallbackQueryHandler(productos_pagina, pattern=r"^prod:"))
 
     # Otros manejadores
     app.add_handler(MessageHandler(filters.PHOTO | filters.Document.IMAGE, on_photo))
@@ -65,4 +115,21 @@ def build_app():
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, on_message))
 
     app.add_error_handler(on_error)
+
+    # Snapshot del catálogo: primera carga al arrancar y luego refresco incremental
+    # Outbox de pedidos: envío en lotes a Databricks con reintentos
+    # Métricas: volcado periódico a METRICS_PATH (si está definido)
+    # Caché de intenciones: guardado periódico en INTENT_CACHE_PATH (si está definido)
+    from services import dbx, intent_cache, metrics, outbox
+    if app.job_queue:
+        app.job_queue.run_repeating(_refresh_catalogo, interval=dbx.CATALOG_REFRESH_S, first=1)
+        if outbox.OUTBOX_ENABLED:
+            app.job_queue.run_repeating(_flush_outbox, interval=outbox.OUTBOX_FLUSH_S, first=5)
+        if metrics.METRICS_PATH:
+            app.job_queue.run_repeating(_dump_metricas, interval=metrics.METRICS_DUMP_S, first=metrics.METRICS_DUMP_S)
+        if intent_cache.INTENT_CACHE_PATH:
+            app.job_queue.run_repeating(_guardar_intent_cache, interval=intent_cache.INTENT_CACHE_SAVE_S,
+                                        first=intent_cache.INTENT_CACHE_SAVE_S)
+    else:
+        logger.warning("JobQueue no disponible: instala python-telegram-bot[job-queue] para refrescar el catálogo")
     return app
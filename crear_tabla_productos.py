@@ -1,9 +1,15 @@
 # crear_tabla_productos.py
 # Tablas relacionales sin imágenes, con FK simbólicas (sin ON DELETE)
 
+import argparse
+import csv
+import json
 import os
+import re
+import time
 from databricks import sql as dbsql
 from dotenv import load_dotenv
+from utils.text import search_columns
 
 load_dotenv()
 
@@ -47,14 +53,19 @@ CREATE TABLE IF NOT EXISTS clientes (
 
 CREATE TABLE IF NOT EXISTS descripcion_productos (
   id            BIGINT GENERATED BY DEFAULT AS IDENTITY,
+  sku           STRING,   -- clave natural para importaciones idempotentes
   nombre        STRING NOT NULL,
   descripcion   STRING,
   categoria     STRING,
   unidad        STRING,
   activo        BOOLEAN,
   created_at    TIMESTAMP,
+  -- columnas de búsqueda precalculadas (sin tildes, minúsculas, tokens en singular)
+  nombre_norm       STRING,
+  descripcion_norm  STRING,
+  tokens            ARRAY<STRING>,
   CONSTRAINT pk_desc PRIMARY KEY (id)
-);
+) CLUSTER BY (nombre_norm);
 
 CREATE TABLE IF NOT EXISTS inventario (
   id            BIGINT GENERATED BY DEFAULT AS IDENTITY,
@@ -64,6 +75,7 @@ CREATE TABLE IF NOT EXISTS inventario (
   stock         INT NOT NULL,
   ubicacion     STRING,
   updated_at    TIMESTAMP,
+  claves_stock  ARRAY<STRING>,   -- últimos pedidos del outbox descontados (idempotencia)
   CONSTRAINT pk_inv PRIMARY KEY (id)
   -- FOREIGN KEY (producto_id) REFERENCES descripcion_productos(id)  ← simbólica
 );
@@ -80,11 +92,30 @@ CREATE TABLE IF NOT EXISTS pedidos (
                  nombre        STRING
                >>,
   notas       STRING,
+  idempotency_key STRING,   -- evita duplicados al reintentar el envío desde el outbox
   created_at  TIMESTAMP,
   CONSTRAINT pk_pedidos PRIMARY KEY (id)
   -- FOREIGN KEY (cliente_id) REFERENCES clientes(id)  ← simbólica
 );
+"""
+
+# Tablas creadas con versiones anteriores del esquema
+SQL_MIGRATIONS = [
+    "ALTER TABLE pedidos ADD COLUMNS (idempotency_key STRING)",
+    "ALTER TABLE descripcion_productos ADD COLUMNS (nombre_norm STRING, descripcion_norm STRING, tokens ARRAY<STRING>)",
+    "ALTER TABLE descripcion_productos CLUSTER BY (nombre_norm)",
+    "ALTER TABLE descripcion_productos ADD COLUMNS (sku STRING)",
+    "ALTER TABLE inventario ADD COLUMNS (claves_stock ARRAY<STRING>)",
+    # productos existentes: toman el sku de su fila de inventario
+    "MERGE INTO descripcion_productos AS dp USING inventario AS inv "
+    "ON dp.id = inv.producto_id AND dp.sku IS NULL WHEN MATCHED THEN UPDATE SET sku = inv.sku",
+]
+
+# Errores de Databricks que indican que la migración ya estaba aplicada
+_YA_EXISTE = ("FIELDS_ALREADY_EXISTS", "already exists")
 
+# La vista usa columnas que agregan las migraciones: se crea después de ellas
+SQL_CREATE_VIEWS = """
 CREATE OR REPLACE VIEW v_productos AS
 SELECT
   inv.id            AS inventario_id,
@@ -94,28 +125,44 @@ SELECT
   dp.categoria,
   dp.unidad,
   inv.precio_cop,
-  inv.stock
+  inv.stock,
+  inv.updated_at,
+  dp.nombre_norm,
+  dp.descripcion_norm,
+  dp.tokens
 FROM inventario inv
 JOIN descripcion_productos dp
   ON inv.producto_id = dp.id
 WHERE dp.activo = TRUE OR dp.activo IS NULL;
 """
 
+# Actualiza las columnas de búsqueda de un lote de productos (un parámetro JSON por lote)
+SQL_MERGE_NORM = """
+MERGE INTO descripcion_productos AS t
+USING (SELECT inline(from_json(:filas,
+  'ARRAY<STRUCT<id: BIGINT, nombre_norm: STRING, descripcion_norm: STRING, tokens: ARRAY<STRING>>>'))) AS s
+ON t.id = s.id
+WHEN MATCHED THEN UPDATE SET
+  nombre_norm = s.nombre_norm,
+  descripcion_norm = s.descripcion_norm,
+  tokens = s.tokens
+"""
+
 SQL_SEEDS = """
-INSERT INTO descripcion_productos (nombre, descripcion, categoria, unidad, activo)
+INSERT INTO descripcion_productos (sku, nombre, descripcion, categoria, unidad, activo)
 VALUES
-('Papel higiénico 4 rollos', 'Papel doble hoja suave', 'Aseo', 'paquete', TRUE),
-('Shampoo 400 ml', 'Shampoo para uso diario', 'Aseo personal', 'unidad', TRUE),
-('Jabón de baño 90 g', 'Jabón en barra neutro', 'Aseo personal', 'unidad', TRUE),
-('Toallas de mano (par)', 'Toallas 100% algodón', 'Hogar', 'par', TRUE)
+('PAP-4R', 'Papel higiénico 4 rollos', 'Papel doble hoja suave', 'Aseo', 'paquete', TRUE),
+('SHP-400', 'Shampoo 400 ml', 'Shampoo para uso diario', 'Aseo personal', 'unidad', TRUE),
+('JBN-090', 'Jabón de baño 90 g', 'Jabón en barra neutro', 'Aseo personal', 'unidad', TRUE),
+('TLL-PAR', 'Toallas de mano (par)', 'Toallas 100% algodón', 'Hogar', 'par', TRUE)
 ;
 
-INSERT INTO inventario (producto_id, sku, precio_cop, stock, ubicacion)
+INSERT INTO inventario (producto_id, sku, precio_cop, stock, ubicacion, updated_at)
 VALUES
-(1, 'PAP-4R', 12000, 30, 'B1-E1'),
-(2, 'SHP-400', 18000, 25, 'B1-E2'),
-(3, 'JBN-090', 3500,  50, 'B1-E3'),
-(4, 'TLL-PAR', 22000, 15, 'B2-E1')
+(1, 'PAP-4R', 12000, 30, 'B1-E1', current_timestamp()),
+(2, 'SHP-400', 18000, 25, 'B1-E2', current_timestamp()),
+(3, 'JBN-090', 3500,  50, 'B1-E3', current_timestamp()),
+(4, 'TLL-PAR', 22000, 15, 'B2-E1', current_timestamp())
 ;
 
 INSERT INTO clientes (telegram_user_id, nombre, telefono, email, direccion)
@@ -126,17 +173,210 @@ VALUES
 ;
 """
 
+def backfill_norm(cur, todos: bool = False, lote: int = 1000) -> int:
+    """Calcula nombre_norm/descripcion_norm/tokens en Python (misma normalización que el bot)."""
+    where = "" if todos else " WHERE nombre_norm IS NULL"
+    cur.execute(f"SELECT id, nombre, descripcion FROM descripcion_productos{where}")
+    rows = cur.fetchall()
+    for i in range(0, len(rows), lote):
+        filas = []
+        for pid, nombre, descripcion in rows[i:i + lote]:
+            nombre_norm, descripcion_norm, tokens = search_columns(nombre or "", descripcion or "")
+            filas.append({"id": int(pid), "nombre_norm": nombre_norm,
+                          "descripcion_norm": descripcion_norm, "tokens": tokens})
+        cur.execute(SQL_MERGE_NORM, {"filas": json.dumps(filas, ensure_ascii=False)})
+    return len(rows)
+
+# ===== Importación masiva (CSV / Parquet) =====
+# Cada lote viaja como un único parámetro JSON y se aplica con dos MERGE por sku:
+# reimportar el mismo archivo no duplica productos, solo actualiza lo que cambió.
+IMPORT_COLS = ("sku", "nombre", "descripcion", "categoria", "unidad", "precio_cop", "stock", "ubicacion")
+_IMPORT_SCHEMA = (
+    "ARRAY<STRUCT<sku: STRING, nombre: STRING, descripcion: STRING, categoria: STRING, unidad: STRING, "
+    "precio_cop: INT, stock: INT, ubicacion: STRING, "
+    "nombre_norm: STRING, descripcion_norm: STRING, tokens: ARRAY<STRING>>>"
+)
+
+SQL_MERGE_DESCRIPCION = f"""
+MERGE INTO descripcion_productos AS t
+USING (SELECT inline(from_json(:filas, '{_IMPORT_SCHEMA}'))) AS s
+ON t.sku = s.sku
+WHEN MATCHED AND (t.nombre <> s.nombre OR t.descripcion IS DISTINCT FROM s.descripcion
+                  OR t.categoria IS DISTINCT FROM s.categoria OR t.unidad IS DISTINCT FROM s.unidad
+                  OR t.nombre_norm IS NULL) THEN UPDATE SET
+  nombre = s.nombre, descripcion = s.descripcion, categoria = s.categoria, unidad = s.unidad,
+  nombre_norm = s.nombre_norm, descripcion_norm = s.descripcion_norm, tokens = s.tokens
+WHEN NOT MATCHED THEN INSERT
+  (sku, nombre, descripcion, categoria, unidad, activo, created_at, nombre_norm, descripcion_norm, tokens)
+VALUES
+  (s.sku, s.nombre, s.descripcion, s.categoria, s.unidad, TRUE, current_timestamp(),
+   s.nombre_norm, s.descripcion_norm, s.tokens)
+"""
+
+# Solo toca updated_at cuando cambia precio/stock/ubicación: el refresco
+# incremental del catálogo del bot no recarga filas idénticas
+SQL_MERGE_INVENTARIO = f"""
+MERGE INTO inventario AS t
+USING (
+  SELECT s.sku, dp.id AS producto_id, s.precio_cop, s.stock, s.ubicacion
+  FROM (SELECT inline(from_json(:filas, '{_IMPORT_SCHEMA}'))) AS s
+  JOIN descripcion_productos dp ON dp.sku = s.sku
+) AS s
+ON t.sku = s.sku
+WHEN MATCHED AND (t.precio_cop <> s.precio_cop OR t.stock <> s.stock
+                  OR t.ubicacion IS DISTINCT FROM s.ubicacion OR t.producto_id <> s.producto_id) THEN UPDATE SET
+  producto_id = s.producto_id, precio_cop = s.precio_cop, stock = s.stock,
+  ubicacion = s.ubicacion, updated_at = current_timestamp()
+WHEN NOT MATCHED THEN INSERT (producto_id, sku, precio_cop, stock, ubicacion, updated_at)
+VALUES (s.producto_id, s.sku, s.precio_cop, s.stock, s.ubicacion, current_timestamp())
+"""
+
+def _leer_csv(ruta: str, lote: int):
+    with open(ruta, newline="", encoding="utf-8-sig") as f:
+        chunk = []
+        for row in csv.DictReader(f):
+            chunk.append(row)
+            if len(chunk) >= lote:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+def _leer_parquet(ruta: str, lote: int):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Para importar Parquet instala pyarrow (pip install pyarrow)")
+    pf = pq.ParquetFile(ruta)
+    cols = [c for c in IMPORT_COLS if c in pf.schema_arrow.names]
+    for batch in pf.iter_batches(batch_size=lote, columns=cols):
+        yield batch.to_pylist()
+
+def leer_catalogo(ruta: str, lote: int):
+    """Lee el archivo por lotes de dicts (CSV o Parquet según la extensión)."""
+    if ruta.lower().endswith((".parquet", ".pq")):
+        return _leer_parquet(ruta, lote)
+    return _leer_csv(ruta, lote)
+
+_MILES = re.compile(r"-?\d{1,3}(?:([.,])\d{3})(?:\1\d{3})*")
+_ENTERO = re.compile(r"-?\d+(?:[.,]0+)?")
+
+
+def _entero(v) -> int:
+    """
+    Precio/stock del archivo como entero. Acepta separadores de miles
+    ("12.000", "1,250,000") y decimales en cero ("12000.0"); cualquier otra
+    cosa ("12.5", "1.2.3", "") lanza ValueError para descartar la fila.
+    """
+    if isinstance(v, bool):
+        raise ValueError(v)
+    if isinstance(v, int):
+        return v
+    if isinstance(v, float):
+        if not v.is_integer():
+            raise ValueError(v)
+        return int(v)
+    t = str(v).strip().replace(" ", "")
+    if _MILES.fullmatch(t):
+        return int(t.replace(".", "").replace(",", ""))
+    if _ENTERO.fullmatch(t):
+        return int(re.split(r"[.,]", t)[0])
+    raise ValueError(v)
+
+
+def _fila_import(row: dict):
+    """Limpia una fila del archivo; None si le faltan sku/nombre/precio/stock."""
+    sku = str(row.get("sku") or "").strip()
+    nombre = str(row.get("nombre") or "").strip()
+    try:
+        precio = _entero(row.get("precio_cop"))
+        stock = _entero(row.get("stock"))
+    except (TypeError, ValueError):
+        return None
+    if not sku or not nombre:
+        return None
+
+    def texto(k):
+        v = row.get(k)
+        return (str(v).strip() or None) if v is not None else None
+
+    descripcion = texto("descripcion")
+    nombre_norm, descripcion_norm, tokens = search_columns(nombre, descripcion or "")
+    return {
+        "sku": sku, "nombre": nombre, "descripcion": descripcion,
+        "categoria": texto("categoria"), "unidad": texto("unidad"),
+        "precio_cop": precio, "stock": stock, "ubicacion": texto("ubicacion"),
+        "nombre_norm": nombre_norm, "descripcion_norm": descripcion_norm, "tokens": tokens,
+    }
+
+def importar_catalogo(cur, ruta: str, lote: int = 1000):
+    """
+    Importa un catálogo por lotes: dos MERGE por lote (descripcion_productos
+    e inventario), idempotentes por sku. Devuelve (importadas, descartadas).
+    """
+    t0 = time.perf_counter()
+    total = descartadas = 0
+    for n, chunk in enumerate(leer_catalogo(ruta, lote), 1):
+        filas = {}
+        for row in chunk:
+            fila = _fila_import(row)
+            if fila is None:
+                descartadas += 1
+            else:
+                filas[fila["sku"]] = fila   # sku repetido en el lote: gana la última
+        if not filas:
+            continue
+        payload = {"filas": json.dumps(list(filas.values()), ensure_ascii=False)}
+        cur.execute(SQL_MERGE_DESCRIPCION, payload)
+        cur.execute(SQL_MERGE_INVENTARIO, payload)
+        total += len(filas)
+        dt = time.perf_counter() - t0
+        print(f"   lote {n}: {total} filas ({total / dt:,.0f} filas/s)".replace(",", "."))
+    dt = time.perf_counter() - t0
+    velocidad = f"{total / (dt or 1):,.0f}".replace(",", ".")
+    print(f"   {total} filas importadas en {dt:.1f} s ({velocidad} filas/s), {descartadas} descartadas")
+    return total, descartadas
+
 def main():
+    ap = argparse.ArgumentParser(description="Crea el esquema del bot en Databricks")
+    ap.add_argument("--renormalizar", action="store_true",
+                    help="recalcula las columnas de búsqueda de todos los productos")
+    ap.add_argument("--importar", metavar="RUTA",
+                    help="importa un catálogo CSV o Parquet (columnas: " + ", ".join(IMPORT_COLS) + ")")
+    ap.add_argument("--lote", type=int, default=1000, help="filas por lote al importar (default 1000)")
+    args = ap.parse_args()
+
     print(f"Conectando a Databricks SQL ({DATABRICKS_HOST})...")
     with connect() as conn, conn.cursor() as cur:
         print("→ Creando/seleccionando catálogo y esquema…")
         run(cur, SQL_BOOTSTRAP)
 
-        print("→ Creando tablas y vista (FK simbólicas)…")
+        print("→ Creando tablas (FK simbólicas)…")
         run(cur, SQL_CREATE_TABLES)
 
-        print("→ Insertando datos mínimos…")
-        run(cur, SQL_SEEDS)
+        print("→ Migrando columnas nuevas…")
+        for stmt in SQL_MIGRATIONS:
+            try:
+                cur.execute(stmt)
+            except Exception as e:
+                # Solo se omite si la columna ya existe (tabla creada con el esquema nuevo)
+                if not any(m in str(e) for m in _YA_EXISTE):
+                    raise
+                print(f"   (omitido) {e}".splitlines()[0])
+
+        print("→ Creando vista v_productos…")
+        run(cur, SQL_CREATE_VIEWS)
+
+        if args.importar:
+            print(f"→ Importando catálogo desde {args.importar}…")
+            importar_catalogo(cur, args.importar, lote=args.lote)
+        else:
+            print("→ Insertando datos mínimos…")
+            run(cur, SQL_SEEDS)
+
+        print("→ Calculando columnas de búsqueda normalizadas…")
+        n = backfill_norm(cur, todos=args.renormalizar)
+        print(f"   {n} productos normalizados")
 
         print("→ Verificando v_productos…")
         cur.execute("SELECT inventario_id, nombre, precio_cop, stock FROM v_productos ORDER BY inventario_id LIMIT 10")
@@ -3,6 +3,7 @@ from telegram.ext import ContextTypes
 from telegram.constants import ChatAction
 from services.asr import transcribe_bytes
 from services.llm import chat as llm_chat
+from services.llm_client import LLMSuperseded
 from services.n8n import call_n8n
 from domain.state import chats
 from services.config import ASR_PROMPT
@@ -47,8 +48,10 @@ async def on_audio(update: Update, context: ContextTypes.DEFAULT_TYPE):
         contenido_usuario = f"{instruccion}\n\n[AUDIO TRANSCRITO]:\n{text}\n\nResponde con 1 a 2 oraciones, sin preámbulos."
         chats[chat_id].append({"role":"user","content":contenido_usuario})
         await context.bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
-        reply = llm_chat(chat_id, temperature=0.15)
+        reply = await llm_chat(chat_id=chat_id, temperature=0.15)
         chats[chat_id].append({"role":"assistant","content":reply})
         await msg.reply_text(reply if reply else "(Respuesta vacía)")
+    except LLMSuperseded:
+        return  # llegó un mensaje más nuevo de este chat
     except Exception as e:
         await msg.reply_text(f"Error procesando audio/video: {e}")
@@ -1,6 +1,7 @@
 from telegram import Update
 from telegram.ext import ContextTypes
 from domain.state import chats, carts
+from services import reservations
 from handlers.sales import productos, buscar, carrito, vaciar, checkout
 from handlers.text import _resolver_y_agregar
 
@@ -18,11 +19,13 @@ async def reset(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     chats[chat_id].clear()
     carts[chat_id].clear()
+    await reservations.arelease(chat_id)
     await update.message.reply_text("Contexto y carrito borrados. ¡Empecemos de cero!")
 
 
 async def cmd_productos(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await productos(update, context)
+    # /productos [categoría]
+    await productos(update, context, " ".join(context.args or []))
 
 async def cmd_buscar(update: Update, context: ContextTypes.DEFAULT_TYPE):
     term = " ".join(context.args).strip()
@@ -49,7 +52,7 @@ async def cmd_checkout(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
 MENU_TEXT = (
     "Comandos disponibles:\n"
-    "• /productos – ver catálogo\n"
+    "• /productos [categoría] – ver catálogo\n"
     "• /buscar <texto> – buscar productos\n"
     "• /add <id> [cantidad] – agregar al carrito\n"
     "• /carrito – ver carrito actual\n"
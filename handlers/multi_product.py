@@ -4,33 +4,12 @@ from telegram import Update
 from telegram.ext import ContextTypes
 from services import dbx
 from handlers.sales import add
-
-
-# Mapeo de números en texto a dígitos
-NUMEROS_TEXTO = {
-    'un': 1, 'uno': 1, 'una': 1,
-    'dos': 2,
-    'tres': 3,
-    'cuatro': 4,
-    'cinco': 5,
-    'seis': 6,
-    'siete': 7,
-    'ocho': 8,
-    'nueve': 9,
-    'diez': 10,
-    'once': 11,
-    'doce': 12,
-    'quince': 15,
-    'veinte': 20
-}
+from utils.text import NUMEROS_TEXTO, numeros_a_digitos
 
 
 def normalizar_numeros(text: str) -> str:
     """Convierte números en texto a dígitos"""
-    text_lower = text.lower()
-    for palabra, numero in NUMEROS_TEXTO.items():
-        text_lower = re.sub(rf'\b{palabra}\b', str(numero), text_lower)
-    return text_lower
+    return numeros_a_digitos(text)
 
 
 async def parse_and_add_multiple_products(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str):
@@ -62,8 +41,8 @@ async def parse_and_add_multiple_products(update: Update, context: ContextTypes.
         print("[PARSER] No se encontraron matches")
         return False
     
-    productos_encontrados = []
-    
+    # Limpiar nombres y resolverlos todos de una vez
+    items = []
     for qty_str, producto_nombre in matches:
         qty = int(qty_str)
         
@@ -78,9 +57,13 @@ async def parse_and_add_multiple_products(update: Update, context: ContextTypes.
             print(f"[PARSER] Nombre muy corto, saltando")
             continue
         
-        # Buscar el producto en la base de datos
-        result = dbx.find_best_by_name(producto_nombre)
-        
+        items.append((producto_nombre, qty))
+    
+    # Buscar todos los productos en una sola pasada
+    resultados = await dbx.afind_best_by_names([nombre for nombre, _ in items]) if items else []
+    
+    productos_encontrados = []
+    for (producto_nombre, qty), result in zip(items, resultados):
         if result:
             pid, nombre_real = result
             print(f"[PARSER] ✅ Encontrado: {nombre_real} (ID: {pid})")
@@ -3,6 +3,7 @@ from telegram import Update
 from telegram.ext import ContextTypes
 from services.vision import describe_image
 from services.llm import chat as llm_chat
+from services.llm_client import LLMSuperseded
 from services.n8n import call_n8n
 from services.config import SYSTEM_PROMPT
 from domain.state import chats
@@ -31,6 +32,9 @@ async def on_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Si vino en inglés, traduce rápido con el LLM de texto
     if final_reply and any(ch in final_reply for ch in "abcdefghijklmnopqrstuvwxyz") and not any(ch in final_reply for ch in "áéíóúñÁÉÍÓÚÑ"):
         chats[chat_id].append({"role":"user","content":f"Traduce al español, conciso: {final_reply}"})
-        final_reply = llm_chat(chat_id, temperature=0.2) or final_reply
+        try:
+            final_reply = await llm_chat(chat_id=chat_id, temperature=0.2) or final_reply
+        except LLMSuperseded:
+            return  # llegó un mensaje más nuevo de este chat
 
     await update.message.reply_text(final_reply or "(sin respuesta)")
@@ -1,7 +1,9 @@
 # handlers/sales.py
-from telegram import Update
+import asyncio
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes
-from services import dbx
+from services import dbx, outbox, reservations
 from utils.money import fmt_money
 from utils.text import _norm, to_qty
 from domain.state import carts
@@ -30,27 +32,80 @@ async def cmd_menu(update: Update):
 
 
 # ===== Listar catálogo =====
-async def productos(update: Update, context: ContextTypes.DEFAULT_TYPE):
+# Una sola página por mensaje; los botones ⬅️/➡️ editan ese mismo mensaje.
+# callback_data: "prod:<n|p>:<id de referencia>:<categoría>" (máx. 64 bytes)
+PAGE_SIZE = 6
+
+
+def _pagina_catalogo(rows, prev: bool, nxt: bool, categoria: str = ""):
+    titulo = f"🛒 Catálogo — {categoria}" if categoria else "🛒 Catálogo"
+    texto = titulo + "\n\n" + "\n\n".join(_texto_producto(*r) for r in rows)
+
+    cat = categoria.encode("utf-8")[:40].decode("utf-8", "ignore")
+    botones = []
+    if prev:
+        botones.append(InlineKeyboardButton("⬅️ Anterior", callback_data=f"prod:p:{rows[0][0]}:{cat}"))
+    if nxt:
+        botones.append(InlineKeyboardButton("Siguiente ➡️", callback_data=f"prod:n:{rows[-1][0]}:{cat}"))
+    return texto, (InlineKeyboardMarkup([botones]) if botones else None)
+
+
+async def productos(update: Update, context: ContextTypes.DEFAULT_TYPE, categoria: Optional[str] = None):
+    categoria = (categoria or "").strip()
     try:
-        rows = dbx.list_products(limit=6)  # (id, nombre, precio, stock)
+        rows, prev, nxt = await dbx.alist_products_page(limit=PAGE_SIZE, categoria=categoria or None)
     except Exception as e:
         await update.message.reply_text(f"Error consultando catálogo: {e}")
         return
     
     if not rows:
-        await update.message.reply_text("No hay productos disponibles.")
+        await update.message.reply_text(
+            f"No hay productos disponibles en «{categoria}»." if categoria else "No hay productos disponibles."
+        )
         return
     
-    for (pid, nombre, precio, stock) in rows:
-        await update.message.reply_text(_texto_producto(pid, nombre, precio, stock))
-    
+    texto, teclado = _pagina_catalogo(rows, prev, nxt, categoria)
+    await update.message.reply_text(texto, reply_markup=teclado)
     await update.message.reply_text(_mensaje_instrucciones_pedido(),parse_mode="Markdown")
 
 
+async def productos_pagina(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Botones ⬅️/➡️ del catálogo: edita el mensaje con la página anterior/siguiente."""
+    query = update.callback_query
+    try:
+        _, sentido, ref, categoria = query.data.split(":", 3)
+        ref = int(ref)
+    except ValueError:
+        await query.answer()
+        return
+    
+    try:
+        if sentido == "p":
+            rows, prev, nxt = await dbx.alist_products_page(before_id=ref, limit=PAGE_SIZE, categoria=categoria or None)
+        else:
+            rows, prev, nxt = await dbx.alist_products_page(after_id=ref, limit=PAGE_SIZE, categoria=categoria or None)
+    except Exception as e:
+        await query.answer(f"Error consultando catálogo: {e}"[:200], show_alert=True)
+        return
+    
+    if not rows:
+        await query.answer("No hay más productos.")
+        return
+    
+    await query.answer()
+    texto, teclado = _pagina_catalogo(rows, prev, nxt, categoria)
+    try:
+        await query.edit_message_text(texto, reply_markup=teclado)
+    except BadRequest as e:
+        # "Message is not modified": doble toque sobre el mismo botón
+        if "not modified" not in str(e).lower():
+            raise
+
+
 # ===== Buscar =====
 async def buscar(update: Update, context: ContextTypes.DEFAULT_TYPE, term: str):
     try:
-        rows = dbx.search_products(term, limit=6)  # (id, nombre, precio, stock)
+        rows = await dbx.asearch_products(term, limit=6)  # (id, nombre, precio, stock)
     except Exception as e:
         await update.message.reply_text(f"Error buscando: {e}")
         return
@@ -68,7 +123,7 @@ async def buscar(update: Update, context: ContextTypes.DEFAULT_TYPE, term: str):
 # ===== Agregar al carrito =====
 async def add(update: Update, context: ContextTypes.DEFAULT_TYPE, pid: int, qty: int):
     try:
-        row = dbx.get_product(pid)  # (id, nombre, precio, stock)
+        row = await dbx.aget_product(pid)  # (id, nombre, precio, stock)
     except Exception as e:
         await update.message.reply_text(f"Error consultando producto: {e}")
         return
@@ -79,8 +134,10 @@ async def add(update: Update, context: ContextTypes.DEFAULT_TYPE, pid: int, qty:
     
     _, nombre, precio, stock = row
     
-    if stock < qty:
-        await update.message.reply_text(f"Stock insuficiente. Disponible: {stock}")
+    # Reserva en memoria (con TTL): evita que dos carritos se lleven la última unidad
+    ok, disponible = await reservations.areserve(update.effective_chat.id, pid, qty)
+    if not ok:
+        await update.message.reply_text(f"Stock insuficiente. Disponible: {disponible}")
         return
     
     carts[update.effective_chat.id][pid] += qty
@@ -97,9 +154,15 @@ async def carrito(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Tu carrito está vacío.")
         return
     
+    try:
+        productos_cart = await dbx.aget_products(cart.keys())  # {id: (id, nombre, precio, stock)}
+    except Exception as e:
+        await update.message.reply_text(f"Error consultando carrito: {e}")
+        return
+    
     lines, total = [], 0.0
     for pid, qty in cart.items():
-        row = dbx.get_product(pid)  # (id, nombre, precio, stock)
+        row = productos_cart.get(int(pid))
         if not row:
             continue
         _, nombre, precio, _ = row
@@ -115,6 +178,7 @@ async def carrito(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ===== Vaciar =====
 async def vaciar(update: Update, context: ContextTypes.DEFAULT_TYPE):
     carts[update.effective_chat.id].clear()
+    await reservations.arelease(update.effective_chat.id)
     await update.message.reply_text("Carrito vaciado.")
 
 
@@ -130,40 +194,63 @@ async def checkout(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     user_name = user.first_name or user.username or f"Usuario_{user.id}"
     
+    chat_id = update.effective_chat.id
+    lineas = dict(cart)
+    
     try:
-        # Guardar el pedido ANTES de descontar stock
-        if not dbx.save_order(update.effective_chat.id, user_name, dict(cart)):
-            await update.message.reply_text(
-                "⚠️ Hubo un error al guardar tu pedido. Intenta nuevamente."
-            )
-            return
-        
-        print(f"✅ Pedido guardado exitosamente para {user_name}")
-        
-        # Ahora descontar stock
-        fallos = []
-        for pid, qty in cart.items():
+        # Reconciliación en memoria: la sobreventa se detecta antes de cualquier escritura
+        fallos = await reservations.acommit(chat_id, lineas)
+        ok = False
+        if not fallos:
             try:
-                if not dbx.decrease_stock(pid, qty):
-                    fallos.append(pid)
-            except Exception as e:
-                print(f"Error descontando stock para producto {pid}: {e}")
-                fallos.append(pid)
+                if outbox.OUTBOX_ENABLED:
+                    # Escritura local durable; el envío a Databricks lo hace el JobQueue
+                    pedido = await dbx.abuild_order(chat_id, user_name, lineas)
+                    if pedido:
+                        await asyncio.to_thread(outbox.enqueue, chat_id, user_name, lineas, pedido)
+                        ok = True
+                else:
+                    # Descuento de stock y pedido en una sola unidad de trabajo (todo o nada)
+                    ok, fallos = await dbx.acheckout_order(chat_id, user_name, lineas)
+                    if ok:
+                        await reservations.asettle(lineas)
+            finally:
+                if not ok:
+                    await reservations.acancel(lineas)
         
         if fallos:
+            nombres = await dbx.aget_products(pid for pid, _, _ in fallos)
+            detalle = []
+            for pid, pedido, disponible in fallos:
+                nombre = (nombres.get(pid) or (pid, f"#{pid}"))[1]
+                detalle.append(f"• {nombre}: pediste {pedido}, disponible {disponible}")
             await update.message.reply_text(
-                f"⚠️ Pedido guardado, pero no se pudo actualizar stock de algunos ítems: {fallos}. "
-                "Contacta al administrador."
+                "⚠️ No hay stock suficiente para:\n" + "\n".join(detalle) +
+                "\n\nAjusta tu carrito y vuelve a intentar. No se registró el pedido."
             )
             # No vaciamos el carrito en caso de fallo
             return
         
+        if not ok:
+            await update.message.reply_text(
+                "⚠️ Hubo un error al guardar tu pedido. Intenta nuevamente."
+            )
+            return
+        
+        print(f"✅ Pedido guardado exitosamente para {user_name}")
+        
         cart.clear()
         await update.message.reply_text(
             "✅ ¡Pedido confirmado y guardado! Te contactaremos por este chat para coordinar entrega y pago. 🙌\n\n"
             f"📦 Tu pedido ha sido registrado como: {user_name}"
         )
         
+    except asyncio.TimeoutError:
+        print(f"⏳ Timeout en checkout para {user_name}")
+        await update.message.reply_text(
+            "⏳ Tu pedido está tardando más de lo normal. No lo repitas todavía: "
+            "revisa tu /carrito en unos minutos."
+        )
     except Exception as e:
         print(f"Error en checkout: {e}")
         import traceback
@@ -173,10 +260,27 @@ async def checkout(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
+async def avisar_rechazados(bot, rechazados):
+    """Avisa a los usuarios cuyos pedidos del outbox no tuvieron stock al enviarse."""
+    for chat_id, pedido, fallos in rechazados:
+        nombres = {it["inventario_id"]: it["nombre"] for it in pedido.get("items", [])}
+        detalle = "\n".join(
+            f"• {nombres.get(pid, f'#{pid}')}: pediste {pedido_qty}, disponible {disponible}"
+            for pid, pedido_qty, disponible in fallos
+        )
+        try:
+            await bot.send_message(
+                chat_id=chat_id,
+                text="⚠️ Lo sentimos, tu pedido no pudo completarse por falta de stock:\n" + detalle,
+            )
+        except Exception as e:
+            print(f"No se pudo avisar a {chat_id}: {e}")
+
+
 # ---------- Reglas NLP para mapear texto libre a comandos ----------
-def map_text_to_command(text: str) -> Optional[str]:
+async def map_text_to_command(text: str, chat_id=None) -> Optional[str]:
     """Usa IA (Gemini) para entender la intención del usuario."""
-    command = interpret_user_message(text)
+    command = await interpret_user_message(text, chat_id=chat_id)
     print(f"[Gemini interpretó]: '{text}' → {command}")  # 👈 depuración temporal
     
     if command.lower() in ("ninguno", "none", ""):
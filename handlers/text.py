@@ -1,15 +1,26 @@
 # handlers/text.py
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
+from telegram.error import BadRequest, RetryAfter, TelegramError
 from telegram.ext import ContextTypes
 from handlers.sales import (
     productos, buscar, add, carrito, vaciar, checkout, map_text_to_command
 )
 from handlers.multi_product import parse_and_add_multiple_products, parece_lista_productos
 from services.gemini_chat import chat_natural
+from services.llm_client import LLMSuperseded
 from services import dbx
 from handlers.sales import _mensaje_instrucciones_pedido
 
+import asyncio
+import os
 import re
+import time
+
+# Chat natural en vivo: la respuesta se va escribiendo sobre un solo mensaje
+CHAT_STREAM = os.getenv("CHAT_STREAM", "1") == "1"
+CHAT_STREAM_EDIT_S = float(os.getenv("CHAT_STREAM_EDIT_S", "1.0"))   # mín. entre ediciones (límite de Telegram)
+_TG_MAX = 4096
+_SIN_RESPUESTA = "Disculpa, no supe qué responderte 🙏 ¿Me lo dices de otra forma?"
 
 # ---------- UI: teclado rápido ----------
 def _menu_teclado():
@@ -52,7 +63,7 @@ async def _resolver_y_agregar(update: Update, context: ContextTypes.DEFAULT_TYPE
         pid = int(arg_tokens[0])
     else:
         nombre = " ".join(arg_tokens)
-        match = dbx.find_best_by_name(nombre)
+        match = await dbx.afind_best_by_name(nombre)
         if not match:
             await update.message.reply_text(
                 f"No encontré un producto parecido a '{nombre}'. "
@@ -64,6 +75,86 @@ async def _resolver_y_agregar(update: Update, context: ContextTypes.DEFAULT_TYPE
     await add(update, context, pid, qty)
 
 # ---------- manejador principal ----------
+async def _chat_en_vivo(update: Update, user_text: str, user_name: str):
+    """Chat natural en modo stream: un mensaje provisional que se edita a medida que llega el texto."""
+    # Sin teclado: un mensaje con ReplyKeyboardMarkup no se puede editar
+    msg = await update.message.reply_text("✍️ …")
+    mostrado = "✍️ …"
+    proxima = 0.0   # monotonic a partir del cual se permite la siguiente edición
+    fallida = False
+    ultimo = ""
+    hay_texto = asyncio.Event()
+
+    async def editar(texto: str, final: bool = False) -> bool:
+        """Edita el mensaje provisional. False si Telegram rechazó la edición."""
+        nonlocal mostrado, proxima, fallida
+        texto = (texto or "").strip()
+        if not texto:
+            return True
+        texto = texto[:_TG_MAX] if final else texto[:_TG_MAX - 2] + " …"
+        if fallida or texto == mostrado or (not final and time.monotonic() < proxima):
+            return not fallida
+        # La edición final se reintenta tras RetryAfter; si no entra, el llamador responde aparte
+        for _ in range(3 if final else 1):
+            try:
+                await msg.edit_text(texto)
+            except RetryAfter as e:
+                if not final:
+                    proxima = time.monotonic() + float(e.retry_after)
+                    return True
+                await asyncio.sleep(float(e.retry_after))
+                continue
+            except BadRequest as e:
+                if "not modified" not in str(e).lower():
+                    print(f"[CHAT NATURAL] ⚠️ No se pudo editar el mensaje: {e}")
+                    fallida = True
+                    return False
+            mostrado, proxima = texto, time.monotonic() + CHAT_STREAM_EDIT_S
+            return True
+        return False
+
+    async def on_texto(texto: str):
+        # Corre dentro del plazo y del semáforo del LLM: solo guarda el texto
+        nonlocal ultimo
+        ultimo = texto
+        hay_texto.set()
+
+    async def editor():
+        # Las ediciones (y las esperas por RetryAfter) van en su propia tarea
+        while True:
+            await hay_texto.wait()
+            hay_texto.clear()
+            try:
+                await editar(ultimo)
+            except TelegramError as e:
+                print(f"[CHAT NATURAL] ⚠️ Error editando el mensaje: {e}")
+            espera = proxima - time.monotonic()
+            if espera > 0:
+                await asyncio.sleep(espera)
+
+    tarea = asyncio.create_task(editor())
+    try:
+        respuesta = await chat_natural(user_text, user_name, chat_id=update.effective_chat.id, on_texto=on_texto)
+    except LLMSuperseded:
+        # Llegó otro mensaje: el borrador a medias sobra
+        try:
+            await msg.delete()
+        except TelegramError:
+            pass
+        return
+    finally:
+        tarea.cancel()
+    # Respuesta vacía: el provisional no puede quedar como "✍️ …"
+    respuesta = (respuesta or "").strip() or _SIN_RESPUESTA
+    try:
+        editado = await editar(respuesta, final=True)
+    except TelegramError as e:
+        print(f"[CHAT NATURAL] ⚠️ Error en la edición final: {e}")
+        editado = False
+    if not editado:
+        await update.message.reply_text(respuesta[:_TG_MAX], reply_markup=_menu_teclado())
+
+
 async def on_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message or not update.message.text:
         return
@@ -126,7 +217,10 @@ async def on_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     es_solicitud_compra = any(palabra in user_text_l for palabra in palabras_compra)
     
     if es_solicitud_compra:
-        mapped = map_text_to_command(user_text)
+        try:
+            mapped = await map_text_to_command(user_text, chat_id=update.effective_chat.id)
+        except LLMSuperseded:
+            return  # el usuario ya envió otro mensaje; ese es el que se responde
         
         if mapped:
             lower = mapped.lower()
@@ -174,7 +268,7 @@ async def on_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     pid = int(args[0])
                 else:
                     nombre = " ".join(args)
-                    match = dbx.find_best_by_name(nombre)
+                    match = await dbx.afind_best_by_name(nombre)
                     if not match:
                         await update.message.reply_text(
                             f"No encontré un producto parecido a '{nombre}'. Prueba con /buscar <texto>."
@@ -200,7 +294,13 @@ async def on_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_name = user.first_name or user.username or "Usuario"
         
         print(f"[CHAT NATURAL] Usuario: {user_name} - Mensaje: {user_text}")
-        respuesta = chat_natural(user_text, user_name)
+        if CHAT_STREAM:
+            await _chat_en_vivo(update, user_text, user_name)
+            return
+        try:
+            respuesta = await chat_natural(user_text, user_name, chat_id=update.effective_chat.id)
+        except LLMSuperseded:
+            return
         await update.message.reply_text(respuesta, reply_markup=_menu_teclado())
         return
 
@@ -0,0 +1,245 @@
+# services/catalog.py
+# Snapshot en memoria de v_productos con refresco incremental por updated_at.
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+
+from services.search_index import SearchIndex
+from utils.text import _norm
+
+
+class Producto(NamedTuple):
+    id: int
+    nombre: str
+    descripcion: str
+    categoria: str
+    precio_cop: int
+    stock: int
+    updated_at: object
+    nombre_norm: str
+    desc_norm: str
+
+    def row(self):
+        """Tupla compatible con lo que devolvían las consultas: (id, nombre, precio, stock)."""
+        return (self.id, self.nombre, self.precio_cop, self.stock)
+
+
+def _to_producto(r) -> Producto:
+    pid, nombre, descripcion, categoria, precio, stock, updated_at = r[:7]
+    # nombre_norm / descripcion_norm precalculados en la tabla (si vienen)
+    nombre_norm, desc_norm = (r[7], r[8]) if len(r) >= 9 else (None, None)
+    nombre = nombre or ""
+    descripcion = descripcion or ""
+    return Producto(
+        int(pid), nombre, descripcion, categoria or "",
+        int(precio or 0), int(stock or 0), updated_at,
+        nombre_norm if nombre_norm is not None else _norm(nombre),
+        desc_norm if desc_norm is not None else _norm(descripcion),
+    )
+
+
+class CatalogSnapshot:
+    """
+    Copia local del catálogo. Las lecturas nunca bloquean: cada refresco arma
+    un dict nuevo y lo publica con una sola asignación (copy-on-write).
+
+    fetch(since) debe devolver filas
+    (inventario_id, nombre, descripcion, categoria, precio_cop, stock, updated_at
+     [, nombre_norm, descripcion_norm]),
+    todas si since es None o solo las modificadas desde `since`.
+    """
+
+    def __init__(self, fetch: Callable[[Optional[object]], Iterable[tuple]], full_every_s: float = 3600.0):
+        self._fetch = fetch
+        self.full_every_s = float(full_every_s)
+        self._items: Dict[int, Producto] = {}
+        self._ids: List[int] = []            # ordenados por inventario_id
+        self._cat_cache: Dict[str, List[int]] = {}   # categoría buscada → ids ordenados
+        self._watermark = None
+        self.index = SearchIndex()
+        self._last_full = 0.0
+        self._refresh_lock = threading.Lock()
+        self._items_lock = threading.Lock()   # publicar _items (refresh / adjust_stock)
+        self._ajustes = None                  # (pid, delta, stock previo) durante un refresco
+        self.loaded = False
+        self.last_refresh_ms = 0.0
+        self.refreshes = 0
+
+    # ---------- carga / refresco ----------
+    def ensure_loaded(self):
+        if not self.loaded:
+            self.refresh()
+
+    def refresh(self, full: bool = False) -> int:
+        """Trae cambios desde la última marca de agua. Devuelve filas recibidas."""
+        with self._refresh_lock:
+            t0 = time.perf_counter()
+            full = full or not self.loaded or (time.monotonic() - self._last_full >= self.full_every_s)
+            with self._items_lock:
+                self._ajustes = []
+            try:
+                rows = list(self._fetch(None if full else self._watermark))
+            except BaseException:
+                with self._items_lock:
+                    self._ajustes = None
+                raise
+
+            with self._items_lock:
+                return self._aplicar(rows, full, t0)
+
+    def _aplicar(self, rows, full: bool, t0: float) -> int:
+        """Publica las filas traídas. Se llama con `_items_lock` tomado."""
+        items = {} if full else dict(self._items)
+        watermark = None if full else self._watermark
+        changed = []
+        traidos = set()
+        recat = full
+        for r in rows:
+            p = _to_producto(r)
+            old = items.get(p.id)
+            items[p.id] = p
+            traidos.add(p.id)
+            if old is None or (old.nombre, old.descripcion) != (p.nombre, p.descripcion):
+                changed.append(p)
+            if old is None or old.categoria != p.categoria:
+                recat = True
+            if p.updated_at is not None and (watermark is None or p.updated_at > watermark):
+                watermark = p.updated_at
+
+        if full:
+            index = SearchIndex()
+            index.rebuild(items.values())
+            self.index = index
+        else:
+            self.index.upsert_many(changed)
+
+        # Ajustes de stock hechos mientras se leía la base: si la fila traída
+        # todavía muestra el stock previo al ajuste, la lectura es anterior a él
+        for pid, delta, previo in self._ajustes or ():
+            p = items.get(pid) if pid in traidos else None
+            if p is not None and p.stock == previo:
+                items[pid] = p._replace(stock=max(0, p.stock + delta))
+        self._ajustes = None
+
+        if full or any(r[0] not in self._items for r in rows):
+            self._ids = sorted(items)
+        self._items = items
+        if recat:
+            self._cat_cache = {}
+        self._watermark = watermark
+        if full:
+            self._last_full = time.monotonic()
+        self.loaded = True
+        self.refreshes += 1
+        self.last_refresh_ms = (time.perf_counter() - t0) * 1000
+        return len(rows)
+
+    def adjust_stock(self, pid: int, delta: int):
+        """Aplica localmente un cambio de stock ya confirmado en la base."""
+        with self._items_lock:
+            p = self._items.get(int(pid))
+            if p is None:
+                return
+            items = dict(self._items)
+            items[p.id] = p._replace(stock=max(0, p.stock + int(delta)))
+            self._items = items
+            if self._ajustes is not None:
+                self._ajustes.append((p.id, int(delta), p.stock))
+
+    # ---------- lecturas ----------
+    def get(self, pid) -> Optional[Producto]:
+        self.ensure_loaded()
+        return self._items.get(int(pid))
+
+    def in_stock(self) -> List[Producto]:
+        """Productos con stock > 0 en orden de inventario_id."""
+        self.ensure_loaded()
+        items = self._items
+        out = []
+        for pid in self._ids:
+            p = items.get(pid)
+            if p is not None and p.stock > 0:
+                out.append(p)
+        return out
+
+    def _ids_categoria(self, categoria: Optional[str]) -> List[int]:
+        """Ids ordenados (todos o de las categorías que contienen `categoria`), cacheados hasta que cambien."""
+        if not categoria:
+            return self._ids
+        key = _norm(categoria)
+        cache = self._cat_cache   # si un refresco lo reemplaza, este cálculo no lo contamina
+        ids = cache.get(key)
+        if ids is None:
+            items = self._items
+            ids = [pid for pid in self._ids if pid in items and key in _norm(items[pid].categoria)]
+            cache[key] = ids
+        return ids
+
+    def _con_stock(self, ids: List[int], rango, limit: int) -> List[Producto]:
+        items = self._items
+        out = []
+        for i in rango:
+            p = items.get(ids[i])
+            if p is not None and p.stock > 0:
+                out.append(p)
+                if len(out) >= limit:
+                    break
+        return out
+
+    def page(self, after_id: Optional[int] = None, before_id: Optional[int] = None,
+             limit: int = 6, categoria: Optional[str] = None):
+        """
+        Paginación por clave (keyset) sobre inventario_id, solo productos con stock:
+          after_id  → los `limit` siguientes a ese id (inventario_id > after_id)
+          before_id → los `limit` anteriores (inventario_id < before_id)
+        Ubica el punto de partida con bisect, así una página profunda cuesta
+        lo mismo que la primera. Devuelve (productos, hay_anterior, hay_siguiente).
+        """
+        self.ensure_loaded()
+        ids = self._ids_categoria(categoria)
+        if before_id is not None:
+            end = bisect_left(ids, int(before_id))
+            prev = self._con_stock(ids, range(end - 1, -1, -1), limit + 1)
+            out = prev[:limit][::-1]
+            if not out:
+                return [], False, False
+            return out, len(prev) > limit, bool(self._con_stock(ids, range(end, len(ids)), 1))
+
+        start = bisect_right(ids, int(after_id)) if after_id is not None else 0
+        nxt = self._con_stock(ids, range(start, len(ids)), limit + 1)
+        out = nxt[:limit]
+        if not out:
+            return [], False, False
+        return out, bool(self._con_stock(ids, range(start - 1, -1, -1), 1)), len(nxt) > limit
+
+    def _available(self, pid: int) -> bool:
+        p = self._items.get(pid)
+        return p is not None and p.stock > 0
+
+    def search(self, q: str, limit: int) -> List[Producto]:
+        """Búsqueda por subcadena (con acentos → sin acentos → singular) sobre el índice."""
+        self.ensure_loaded()
+        items = self._items
+        found = (items.get(pid) for pid in self.index.search(q, limit, self._available))
+        return [p for p in found if p is not None]
+
+    def best_match(self, term: str) -> Optional[Producto]:
+        return self.best_matches([term])[0]
+
+    def best_matches(self, terms: List[str]) -> List[Optional[Producto]]:
+        """Resuelve varios nombres en una sola pasada por el índice."""
+        self.ensure_loaded()
+        items = self._items
+        return [
+            items.get(pid) if pid is not None else None
+            for pid in self.index.best_matches(list(terms), self._available)
+        ]
+
+    def stats(self) -> dict:
+        return {
+            "productos": len(self._items),
+            "refrescos": self.refreshes,
+            "ultimo_refresco_ms": round(self.last_refresh_ms, 2),
+            "watermark": str(self._watermark) if self._watermark is not None else None,
+        }
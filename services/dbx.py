@@ -1,7 +1,18 @@
 # services/dbx.py
+import asyncio
+import functools
+import json
 import os
-import unicodedata
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from databricks import sql as dbsql
+from services.dbx_pool import ConnectionPool
+from services.catalog import CatalogSnapshot
+from services import metrics, replica
+from utils.text import _norm, _singularize_token_es, _singularize_phrase_es  # noqa: F401 (re-export)
 
 
 DATABRICKS_HOST = (os.getenv("DATABRICKS_HOST") or "").replace("https://", "").replace("http://", "")
@@ -14,10 +25,26 @@ V_CATALOG = f"{DBX_CATALOG}.{DBX_SCHEMA}.v_productos"
 INV_TABLE = f"{DBX_CATALOG}.{DBX_SCHEMA}.inventario"
 PEDIDOS_TABLE = f"{DBX_CATALOG}.{DBX_SCHEMA}.pedidos"
 
+# Backend de lectura del catálogo:
+#   databricks → el snapshot en memoria se carga directo desde el warehouse
+#   sqlite     → se carga desde una réplica local (services/replica.py) que se
+#                sincroniza desde Databricks; sin credenciales funciona offline
+#                y el stock y los pedidos también se escriben en la réplica
+DBX_BACKEND = os.getenv("DBX_BACKEND", "databricks").strip().lower()
+_HAS_CREDS = bool(DATABRICKS_HOST and DBSQL_HTTP_PATH and DATABRICKS_TOKEN)
+_OFFLINE = DBX_BACKEND == "sqlite" and not _HAS_CREDS
 
-def _conn():
+# Pool de conexiones (evita TLS + apertura de sesión en cada consulta)
+DBX_POOL_SIZE = int(os.getenv("DBX_POOL_SIZE", "4"))
+DBX_POOL_TIMEOUT_S = float(os.getenv("DBX_POOL_TIMEOUT_S", "15"))
+DBX_POOL_IDLE_S = float(os.getenv("DBX_POOL_IDLE_S", "300"))
+DBX_POOL_MAX_LIFETIME_S = float(os.getenv("DBX_POOL_MAX_LIFETIME_S", "3600"))
+DBX_POOL_CHECK_AFTER_S = float(os.getenv("DBX_POOL_CHECK_AFTER_S", "30"))
+
+
+def _connect():
     """Crea conexión a Databricks SQL"""
-    if not (DATABRICKS_HOST and DBSQL_HTTP_PATH and DATABRICKS_TOKEN):
+    if not _HAS_CREDS:
         raise RuntimeError("Faltan credenciales de Databricks (.env)")
     
     return dbsql.connect(
@@ -27,226 +54,294 @@ def _conn():
     )
 
 
-def _norm(s: str) -> str:
-    """Normaliza texto removiendo acentos y convirtiendo a minúsculas"""
-    if not s:
-        return ""
-    s = unicodedata.normalize("NFD", s)
-    s = "".join(ch for ch in s if unicodedata.category(ch) != "Mn")
-    return s.lower().strip()
+_pool = ConnectionPool(
+    _connect,
+    max_size=DBX_POOL_SIZE,
+    timeout=DBX_POOL_TIMEOUT_S,
+    idle_timeout=DBX_POOL_IDLE_S,
+    max_lifetime=DBX_POOL_MAX_LIFETIME_S,
+    check_after=DBX_POOL_CHECK_AFTER_S,
+)
+
+
+def _conn():
+    """Presta una conexión del pool; se devuelve al salir del `with`."""
+    return _pool.connection()
+
+
+# ===== Instrumentación =====
+# Cada consulta registra por operación (`op`): préstamo/conexión, execute,
+# fetch, filas y errores; cada función pública su latencia total. Así se ve si
+# un /buscar lento viene del pool, del warehouse o del procesamiento local.
+DBX_SLOW_MS = float(os.getenv("DBX_SLOW_MS", "2000"))
+
+
+class _TimedCursor:
+    """Envuelve un cursor DB-API midiendo execute/fetch y contando filas."""
+
+    def __init__(self, cur, op: str):
+        self._cur = cur
+        self._op = op
+
+    def execute(self, query, *args):
+        t0 = time.perf_counter()
+        try:
+            return self._cur.execute(query, *args)
+        finally:
+            ms = (time.perf_counter() - t0) * 1000
+            metrics.observe("dbx_execute_ms", ms, op=self._op)
+            if ms >= DBX_SLOW_MS:
+                print(f"[DBX] 🐢 {self._op}: execute {ms:.0f} ms\n{' '.join(str(query).split())[:500]}")
+
+    def _fetch(self, fn, count):
+        t0 = time.perf_counter()
+        out = fn()
+        metrics.observe("dbx_fetch_ms", (time.perf_counter() - t0) * 1000, op=self._op)
+        metrics.observe("dbx_rows", count(out), buckets=metrics.BUCKETS_ROWS, op=self._op)
+        return out
+
+    def fetchall(self):
+        return self._fetch(self._cur.fetchall, len)
+
+    def fetchone(self):
+        return self._fetch(self._cur.fetchone, lambda r: 0 if r is None else 1)
+
+    def __getattr__(self, name):
+        attr = getattr(self._cur, name)
+        if name == "fetchall_arrow":
+            return lambda: self._fetch(attr, lambda t: t.num_rows)
+        return attr
+
+
+@contextmanager
+def _query(op: str):
+    """Conexión del pool + cursor instrumentado para la operación `op`."""
+    t0 = time.perf_counter()
+    try:
+        with _conn() as c:
+            metrics.observe("dbx_connect_ms", (time.perf_counter() - t0) * 1000, op=op)
+            with c.cursor() as cur:
+                yield _TimedCursor(cur, op)
+    except Exception as e:
+        metrics.inc("dbx_errors", op=op, error=type(e).__name__)
+        raise
+
+
+def _timed(fn):
+    """Latencia total de una función pública de dbx (snapshot en memoria incluido)."""
+    op = fn.__name__.lstrip("_")
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            metrics.observe("dbx_call_ms", (time.perf_counter() - t0) * 1000, op=op)
+    return wrapper
+
+
+def pool_stats() -> dict:
+    """Métricas del pool: tamaño, tiempo de espera y latencia de préstamo."""
+    return _pool.stats()
 
-def _singularize_token_es(t: str) -> str:
-    """Singulariza muy básico para español: papeles->papel, jabones->jabon, luces->luz, toallas->toalla."""
-    t = t.strip()
-    if not t:
-        return t
 
-    # luces -> luz, arroces -> arroz
-    if t.endswith("ces") and len(t) > 3:
-        return t[:-3] + "z"
+def close_pool():
+    """Cierra las conexiones libres del pool (al apagar el bot)."""
+    _pool.close_all()
+    _executor.shutdown(wait=False, cancel_futures=True)
+
+
+# False si v_productos es anterior a la migración de columnas de búsqueda
+# (crear_tabla_productos.py): el snapshot las calcula con utils.text._norm
+_vista_con_norm = True
+
+
+@_timed
+def _fetch_catalog(since=None):
+    """
+    Lee v_productos completo (o solo lo modificado desde `since`).
+    Usa fetch columnar (Arrow) cuando el conector lo ofrece.
+    """
+    global _vista_con_norm
+    params = {"since": str(since)} if since is not None else None
+
+    def consulta():
+        query = (
+            f"SELECT inventario_id, nombre, descripcion, categoria, precio_cop, "
+            f"CAST(COALESCE(stock,0) AS BIGINT) AS stock, updated_at"
+            f"{', nombre_norm, descripcion_norm' if _vista_con_norm else ''} FROM {V_CATALOG}"
+        )
+        if since is not None:
+            # >= para no perder filas con el mismo timestamp que la marca de agua
+            query += " WHERE updated_at >= CAST(:since AS TIMESTAMP)"
+        return query
+
+    with _query("fetch_catalog") as cur:
+        try:
+            cur.execute(consulta(), params)
+        except Exception as e:
+            if not (_vista_con_norm and "nombre_norm" in str(e)):
+                raise
+            print("[DBX] ⚠️ v_productos sin nombre_norm/descripcion_norm (falta correr "
+                  "crear_tabla_productos.py): se normaliza en memoria")
+            _vista_con_norm = False
+            cur.execute(consulta(), params)
+        fetch_arrow = getattr(cur, "fetchall_arrow", None)
+        if fetch_arrow is None:
+            return cur.fetchall()
+        cols = fetch_arrow().to_pydict()
+        return list(zip(*cols.values()))
+
+
+CATALOG_REFRESH_S = float(os.getenv("CATALOG_REFRESH_S", "60"))
+CATALOG_FULL_REFRESH_S = float(os.getenv("CATALOG_FULL_REFRESH_S", "3600"))
+
+
+def _fetch_replica(since=None):
+    return replica.get_replica().fetch(since)
+
+
+_catalog = CatalogSnapshot(
+    _fetch_replica if DBX_BACKEND == "sqlite" else _fetch_catalog,
+    full_every_s=CATALOG_FULL_REFRESH_S,
+)
+
+
+@_timed
+def sync_replica() -> int:
+    """Trae a la réplica local lo modificado en Databricks. Si el warehouse no responde se sigue con la réplica."""
+    if DBX_BACKEND != "sqlite" or _OFFLINE:
+        return 0
+    try:
+        return replica.get_replica().sync(_fetch_catalog, full_every_s=CATALOG_FULL_REFRESH_S)
+    except Exception as e:
+        print(f"⚠️ No se pudo sincronizar la réplica desde Databricks: {e}")
+        return 0
 
-    # palabras acabadas en 'es' con consonante antes: papeles->papel, jabones->jabon, flores->flor
-    if t.endswith("es") and len(t) > 3:
-        # si antes de 'es' hay consonante o 'n/r/l/z', suele quitarse 'es'
-        if t[-3] not in "aeiou":
-            return t[:-2]
 
-    # acabadas en 's' (toallas->toalla, cepillos->cepillo). Evita días de la semana, etc.
-    if t.endswith("s") and len(t) > 3:
-        return t[:-1]
+@_timed
+def refresh_catalog(full: bool = False) -> int:
+    """Refresca el snapshot del catálogo (lo llama el JobQueue periódicamente)."""
+    sync_replica()
+    return _catalog.refresh(full=full)
 
-    return t
 
+def catalog_loaded() -> bool:
+    """True si el snapshot ya está cargado (las lecturas son en memoria)."""
+    return _catalog.loaded
 
-def _singularize_phrase_es(s: str) -> str:
-    """Singulariza cada token de una frase normalizada (sin acentos)."""
-    parts = [p for p in _norm(s).split() if p]
-    return " ".join(_singularize_token_es(p) for p in parts)
 
+def catalog_stats() -> dict:
+    stats = {**_catalog.stats(), "backend": DBX_BACKEND, "offline": _OFFLINE}
+    if DBX_BACKEND == "sqlite":
+        stats["replica"] = replica.get_replica().stats()
+    return stats
 
+
+metrics.register_collector("dbx_pool", pool_stats)
+metrics.register_collector("catalogo", catalog_stats)
+
+
+@_timed
 def list_products(limit=6):
     """Lista productos disponibles con stock"""
     limit = int(limit)
-    with _conn() as c, c.cursor() as cur:
-        cur.execute(f"""
-            SELECT inventario_id AS id, nombre, precio_cop, stock
-            FROM {V_CATALOG}
-            WHERE stock > 0
-            ORDER BY inventario_id
-            LIMIT {limit}
-        """)
-        return cur.fetchall()
+    return [p.row() for p in _catalog.in_stock()[:limit]]
+
+
+@_timed
+def list_products_page(after_id=None, before_id=None, limit=6, categoria=None):
+    """
+    Página del catálogo por keyset sobre inventario_id (ver CatalogSnapshot.page).
+    Devuelve (rows, hay_anterior, hay_siguiente) con rows = [(id, nombre, precio, stock)].
+    """
+    prods, prev, nxt = _catalog.page(after_id, before_id, int(limit), categoria)
+    return [p.row() for p in prods], prev, nxt
 
 
+@_timed
 def search_products(q, limit=6):
     limit = int(limit)
-    like_pattern = f"%{q}%"
-
-    with _conn() as c, c.cursor() as cur:
-        cur.execute(f"""
-            SELECT inventario_id AS id, nombre, precio_cop, stock
-            FROM {V_CATALOG}
-            WHERE stock > 0
-              AND (
-                lower(nombre) LIKE lower(%s)
-                OR lower(descripcion) LIKE lower(%s)
-              )
-            ORDER BY inventario_id
-            LIMIT {limit}
-        """, (like_pattern, like_pattern))
-        results = cur.fetchall()
-
-        if results:
-            return results
-
-        # 1) Intento sin acentos (ya lo tenías)
-        q_clean = (q or "")
-        for a,b in (("á","a"),("é","e"),("í","i"),("ó","o"),("ú","u")):
-            q_clean = q_clean.replace(a,b)
-        like_clean = f"%{q_clean}%"
-        cur.execute(f"""
-            SELECT inventario_id AS id, nombre, precio_cop, stock
-            FROM {V_CATALOG}
-            WHERE stock > 0
-              AND (
-                lower(replace(replace(replace(replace(replace(nombre, 'á', 'a'), 'é', 'e'), 'í', 'i'), 'ó', 'o'), 'ú', 'u')) LIKE lower(%s)
-                OR lower(replace(replace(replace(replace(replace(descripcion, 'á', 'a'), 'é', 'e'), 'í', 'i'), 'ó', 'o'), 'ú', 'u')) LIKE lower(%s)
-              )
-            ORDER BY inventario_id
-            LIMIT {limit}
-        """, (like_clean, like_clean))
-        results = cur.fetchall()
-        if results:
-            return results
-
-        # 2) Intento singularizado (clave para "papeles", "jabones", etc.)
-        q_sing = _singularize_phrase_es(q)
-        if q_sing and q_sing != _norm(q):
-            like_sing = f"%{q_sing}%"
-            cur.execute(f"""
-                SELECT inventario_id AS id, nombre, precio_cop, stock
-                FROM {V_CATALOG}
-                WHERE stock > 0
-                  AND (
-                    lower(replace(replace(replace(replace(replace(nombre, 'á', 'a'), 'é', 'e'), 'í', 'i'), 'ó', 'o'), 'ú', 'u')) LIKE lower(%s)
-                    OR lower(replace(replace(replace(replace(replace(descripcion, 'á', 'a'), 'é', 'e'), 'í', 'i'), 'ó', 'o'), 'ú', 'u')) LIKE lower(%s)
-                  )
-                ORDER BY inventario_id
-                LIMIT {limit}
-            """, (like_sing, like_sing))
-            results = cur.fetchall()
-
-        return results
-
+    return [p.row() for p in _catalog.search(q, limit)]
 
 
+@_timed
 def get_product(pid):
     """Obtiene un producto específico por ID"""
-    with _conn() as c, c.cursor() as cur:
-        cur.execute(
-            f"SELECT inventario_id AS id, nombre, precio_cop, CAST(COALESCE(stock,0) AS BIGINT) AS stock "
-            f"FROM {V_CATALOG} WHERE inventario_id = %s",
-            (pid,)
-        )
-        return cur.fetchone()
+    p = _catalog.get(pid)
+    return p.row() if p else None
+
+
+def _fetch_products(cur, pids) -> dict:
+    """Trae varios productos con un solo IN (...) sobre un cursor ya abierto."""
+    ids = sorted({int(p) for p in pids})
+    if not ids:
+        return {}
+    cur.execute(
+        f"SELECT inventario_id AS id, nombre, precio_cop, CAST(COALESCE(stock,0) AS BIGINT) AS stock "
+        f"FROM {V_CATALOG} WHERE inventario_id IN ({', '.join(str(i) for i in ids)})"
+    )
+    return {int(r[0]): tuple(r) for r in cur.fetchall()}
 
 
+@_timed
+def get_products(pids, fresh: bool = False) -> dict:
+    """
+    Obtiene varios productos de una vez: {id: (id, nombre, precio, stock)}.
+    Los ids inexistentes no aparecen en el dict.
+    Con fresh=True consulta la base (una sola consulta) en vez del snapshot.
+    """
+    if fresh:
+        if _OFFLINE:
+            return replica.get_replica().fetch_products(pids)
+        with _query("get_products") as cur:
+            return _fetch_products(cur, pids)
+    out = {}
+    for pid in set(pids):
+        p = _catalog.get(pid)
+        if p:
+            out[p.id] = p.row()
+    return out
+
+
+@_timed
 def find_best_by_name(term: str):
-    if not term or len(term.strip()) < 2:
-        return None
+    p = _catalog.best_match(term)
+    return (p.id, p.nombre) if p else None
 
-    # Normaliza y crea variantes singularizadas
-    term_norm = _norm(term)
-    term_sing = _singularize_phrase_es(term_norm)
-
-    # Usa ambas versiones para construir palabras
-    palabras = [p for p in term_norm.split() if len(p) > 1]
-    palabras_sing = [p for p in term_sing.split() if len(p) > 1]
-
-    # Mezcla única de tokens (normales + sing.)
-    tokens = []
-    seen = set()
-    for lst in (palabras, palabras_sing):
-        for t in lst:
-            if t not in seen:
-                tokens.append(t); seen.add(t)
-
-    # Si no quedaron tokens, intenta contra frase completa
-    if not tokens:
-        like_pattern = f"%{term_sing or term_norm}%"
-        with _conn() as c, c.cursor() as cur:
-            cur.execute(f"""
-                SELECT inventario_id AS id, nombre, precio_cop, stock
-                FROM {V_CATALOG}
-                WHERE stock > 0
-                  AND (
-                    lower(replace(replace(replace(replace(replace(nombre, 'á', 'a'), 'é', 'e'), 'í', 'i'), 'ó', 'o'), 'ú', 'u')) LIKE %s
-                    OR lower(replace(replace(replace(replace(replace(descripcion, 'á', 'a'), 'é', 'e'), 'í', 'i'), 'ó', 'o'), 'ú', 'u')) LIKE %s
-                  )
-                ORDER BY LENGTH(nombre) ASC
-                LIMIT 5
-            """, (like_pattern, like_pattern))
-            row = cur.fetchone()
-            return (row[0], row[1]) if row else None
-
-    like_patterns = [f"%{p}%" for p in tokens]
-
-    or_conditions_nombre = " OR ".join([
-        "lower(replace(replace(replace(replace(replace(nombre, 'á', 'a'), 'é', 'e'), 'í', 'i'), 'ó', 'o'), 'ú', 'u')) LIKE %s"
-        for _ in like_patterns
-    ])
-    or_conditions_desc = " OR ".join([
-        "lower(replace(replace(replace(replace(replace(descripcion, 'á', 'a'), 'é', 'e'), 'í', 'i'), 'ó', 'o'), 'ú', 'u')) LIKE %s"
-        for _ in like_patterns
-    ])
 
-    query = f"""
-        SELECT inventario_id AS id, nombre, precio_cop, stock
-        FROM {V_CATALOG}
-        WHERE stock > 0
-          AND ({or_conditions_nombre} OR {or_conditions_desc})
-        ORDER BY LENGTH(nombre) ASC
-        LIMIT 15
+@_timed
+def find_best_by_names(terms):
     """
-    params = tuple(like_patterns + like_patterns)
-
-    with _conn() as c, c.cursor() as cur:
-        cur.execute(query, params)
-        rows = cur.fetchall()
-
-    if not rows:
-        return None
-
-    # Scoring: cuántos tokens (incluida la versión singular) aparecen en el nombre normalizado
-    best, score = None, -1
-    for r in rows:
-        _, nombre, *_ = r
-        nombre_norm = _norm(nombre)
-        s = sum(1 for w in tokens if w in nombre_norm)
-        if s > score:
-            best, score = r, s
-
-    return (best[0], best[1]) if best else None
+    Versión en lote de find_best_by_name: una sola pasada por el índice.
+    Devuelve una lista alineada con `terms` de (id, nombre) o None.
+    """
+    return [(p.id, p.nombre) if p else None for p in _catalog.best_matches(terms)]
 
 
 
+@_timed
 def decrease_stock(pid, qty):
     """
     Baja de stock segura aun si hay NULLs.
     Retorna True si se pudo descontar, False si no hay stock suficiente.
     """
-    with _conn() as c, c.cursor() as cur:
+    if _OFFLINE:
+        ok, _ = apply_stock({pid: qty})
+        return ok
+
+    with _query("decrease_stock") as cur:
         try:
             # Estrategia: Hacer UPDATE directo con condición de stock suficiente
             # Si el UPDATE afecta 0 filas, significa que no hay stock o no existe
             query = f"""
                 UPDATE {INV_TABLE}
-                SET stock = CAST(COALESCE(stock, 0) AS BIGINT) - {int(qty)}
+                SET stock = CAST(COALESCE(stock, 0) AS BIGINT) - {int(qty)},
+                    updated_at = current_timestamp()
                 WHERE id = {int(pid)}
                   AND CAST(COALESCE(stock, 0) AS BIGINT) >= {int(qty)}
             """
-            
-            print(f"[DEBUG] Ejecutando: {query}")
             cur.execute(query)
             
             # Verificar cuántas filas fueron afectadas
@@ -258,6 +353,7 @@ def decrease_stock(pid, qty):
                 return False
             
             print(f"✅ Stock descontado exitosamente: producto {pid}, cantidad {qty}, filas afectadas: {affected}")
+            _catalog.adjust_stock(pid, -int(qty))
             return True
             
         except Exception as e:
@@ -267,6 +363,85 @@ def decrease_stock(pid, qty):
             return False
 
 
+# Forma fija del INSERT de pedidos: el lote llega como un único parámetro JSON,
+# así el texto SQL es siempre el mismo (1 pedido o 500) y el warehouse reusa el plan.
+# Es un MERGE por idempotency_key: reintentar el mismo lote no duplica pedidos.
+_PEDIDOS_SCHEMA = (
+    "ARRAY<STRUCT<cliente_id: BIGINT, estado: STRING, total_cop: INT, "
+    "items: ARRAY<STRUCT<inventario_id: BIGINT, cantidad: INT, precio_cop: INT, nombre: STRING>>, "
+    "notas: STRING, idempotency_key: STRING, created_at: TIMESTAMP>>"
+)
+_INSERT_PEDIDOS = f"""
+    MERGE INTO {PEDIDOS_TABLE} AS t
+    USING (SELECT inline(from_json(:pedidos, '{_PEDIDOS_SCHEMA}'))) AS s
+    ON t.idempotency_key = s.idempotency_key
+    WHEN NOT MATCHED THEN INSERT (cliente_id, estado, total_cop, items, notas, idempotency_key, created_at)
+    VALUES (s.cliente_id, s.estado, s.total_cop, s.items, s.notas, s.idempotency_key,
+            COALESCE(s.created_at, current_timestamp()))
+"""
+
+
+def _order_payload(chat_id: int, user_name: str, cart: dict, productos: dict):
+    """Arma el pedido (dict serializable) con precios/nombres de `productos`. None si no hay ítems válidos."""
+    total = 0
+    items = []
+    for pid, qty in cart.items():
+        row = productos.get(int(pid))
+        if not row:
+            continue
+        _, nombre, precio, _ = row
+        total += float(precio) * qty
+        items.append({
+            "inventario_id": int(pid),
+            "cantidad": int(qty),
+            "precio_cop": int(precio),
+            "nombre": str(nombre),
+        })
+    if not items:
+        return None
+    return {
+        "cliente_id": int(chat_id),
+        "estado": "pendiente",
+        "total_cop": int(total),
+        "items": items,
+        "notas": f"Pedido de {user_name} (Telegram ID: {chat_id})",
+        "idempotency_key": uuid.uuid4().hex,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+    }
+
+
+def _insert_orders(cur, pedidos: list) -> int:
+    """Inserta un lote de pedidos con una sola sentencia parametrizada."""
+    if not pedidos:
+        return 0
+    cur.execute(_INSERT_PEDIDOS, {"pedidos": json.dumps(pedidos, ensure_ascii=False)})
+    return len(pedidos)
+
+
+def build_order(chat_id: int, user_name: str, cart: dict):
+    """Arma el pedido con precios del snapshot (sin ir a la base). None si no hay ítems válidos."""
+    return _order_payload(chat_id, user_name, cart, get_products(cart.keys()))
+
+
+@_timed
+def save_order_payloads(pedidos: list) -> int:
+    """Inserta pedidos ya armados (build_order) en un solo MERGE idempotente."""
+    if _OFFLINE:
+        return replica.get_replica().insert_orders(pedidos)
+    with _query("save_order_payloads") as cur:
+        return _insert_orders(cur, pedidos)
+
+
+def _insert_order(cur, chat_id: int, user_name: str, cart: dict, productos: dict) -> bool:
+    """Inserta la fila de pedidos usando precios/nombres de `productos`. False si no hay ítems válidos."""
+    pedido = _order_payload(chat_id, user_name, cart, productos)
+    if not pedido:
+        return False
+    _insert_orders(cur, [pedido])
+    return True
+
+
+@_timed
 def save_order(chat_id: int, user_name: str, cart: dict) -> bool:
     """
     Guarda un pedido en la tabla pedidos.
@@ -283,59 +458,315 @@ def save_order(chat_id: int, user_name: str, cart: dict) -> bool:
         return False
     
     try:
-        with _conn() as c, c.cursor() as cur:
-            # Calcular total del pedido y preparar items
-            total = 0
-            items_list = []
-            
-            for pid, qty in cart.items():
-                row = get_product(pid)
-                if not row:
-                    continue
-                _, nombre, precio, _ = row
-                subtotal = float(precio) * qty
-                total += subtotal
-                
-                # Escapar comillas simples en el nombre
-                nombre_escaped = str(nombre).replace("'", "''")
-                
-                # Crear STRUCT para cada item
-                items_list.append(
-                    f"STRUCT({int(pid)} AS inventario_id, {int(qty)} AS cantidad, "
-                    f"{int(precio)} AS precio_cop, '{nombre_escaped}' AS nombre)"
-                )
-            
-            if not items_list:
-                return False
-            
-            # Construir el ARRAY de structs
-            items_array = f"ARRAY({', '.join(items_list)})"
-            
-            # Escapar comillas en las notas
-            notas = f"Pedido de {user_name} (Telegram ID: {chat_id})"
-            notas_escaped = notas.replace("'", "''")
+        if _OFFLINE:
+            pedido = _order_payload(chat_id, user_name, cart, get_products(cart.keys(), fresh=True))
+            return bool(pedido) and save_order_payloads([pedido]) == 1
+
+        with _query("save_order") as cur:
+            return _insert_order(cur, chat_id, user_name, cart, _fetch_products(cur, cart.keys()))
             
-            # Construir query completo sin parámetros para items
-            query = f"""
-                INSERT INTO {PEDIDOS_TABLE} 
-                (cliente_id, estado, total_cop, items, notas, created_at)
-                VALUES (
-                    {int(chat_id)}, 
-                    'pendiente', 
-                    {int(total)}, 
-                    {items_array},
-                    '{notas_escaped}', 
-                    current_timestamp()
-                )
-            """
+    except Exception as e:
+        print(f"Error guardando pedido: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+@_timed
+def save_orders(orders: list) -> int:
+    """
+    Guarda muchos pedidos de una vez (ráfagas, ventas flash).
+
+    Args:
+        orders: lista de (chat_id, user_name, cart)
+
+    Returns:
+        Cantidad de pedidos insertados (una consulta de precios + un INSERT).
+    """
+    orders = [o for o in orders if o[2]]
+    if not orders:
+        return 0
+    
+    if _OFFLINE:
+        productos = get_products({pid for _, _, cart in orders for pid in cart}, fresh=True)
+        pedidos = [_order_payload(chat_id, user_name, cart, productos) for chat_id, user_name, cart in orders]
+        return save_order_payloads([p for p in pedidos if p])
+
+    with _query("save_orders") as cur:
+        pids = {pid for _, _, cart in orders for pid in cart}
+        productos = _fetch_products(cur, pids)
+        pedidos = [_order_payload(chat_id, user_name, cart, productos) for chat_id, user_name, cart in orders]
+        return _insert_orders(cur, [p for p in pedidos if p])
+
+
+def _affected_rows(cur) -> int:
+    """Filas afectadas por UPDATE/MERGE (Databricks las devuelve como fila de resultado)."""
+    try:
+        row = cur.fetchone()
+        if row is not None:
+            return int(row[0])
+    except Exception:
+        pass
+    rc = getattr(cur, "rowcount", None)
+    return int(rc) if rc is not None and rc >= 0 else 0
+
+
+def stock_faltante(cart: dict, productos: dict) -> list:
+    """Líneas sin stock suficiente: [(pid, pedido, disponible)]."""
+    fallos = []
+    for pid, qty in cart.items():
+        row = productos.get(int(pid))
+        disponible = int(row[3] or 0) if row else 0
+        if disponible < int(qty):
+            fallos.append((int(pid), int(qty), disponible))
+    return fallos
+
+
+# Claves de pedido recientes guardadas en cada fila de inventario: el descuento
+# del outbox es idempotente aunque el proceso caiga antes de marcarlo enviado.
+STOCK_CLAVES_MAX = int(os.getenv("STOCK_CLAVES_MAX", "256"))
+_CLAVES_STOCK = "COALESCE(t.claves_stock, CAST(array() AS ARRAY<STRING>))"
+
+
+def _merge_stock(cur, cart: dict, signo: int, guard: bool, clave: str = None) -> int:
+    """
+    Aplica todos los cambios de stock del carrito en un único MERGE.
+    Con guard=True solo actualiza si TODAS las líneas tienen stock suficiente
+    (el MERGE es atómico: o se descuentan todas o ninguna).
+    Con `clave` (idempotency_key del pedido) no toca las filas que ya la tienen
+    y la registra en la misma sentencia. Devuelve 0 con el carrito vacío.
+    """
+    cart = {int(pid): int(qty) for pid, qty in cart.items() if int(qty) > 0}
+    if not cart:
+        return 0
+    values = ", ".join(f"({int(pid)}, {int(qty)})" for pid, qty in cart.items())
+    cond = ""
+    if guard:
+        cond = f"""
+            WHERE (
+                SELECT count(*)
+                FROM (VALUES {values}) AS v(id, qty)
+                JOIN {INV_TABLE} i ON i.id = v.id
+                WHERE CAST(COALESCE(i.stock, 0) AS BIGINT) >= v.qty
+            ) = {len(cart)}
+        """
+    on_clave = set_clave = ""
+    if clave is not None:
+        on_clave = f"AND NOT array_contains({_CLAVES_STOCK}, :clave)"
+        set_clave = f"claves_stock = slice(concat(array(:clave), {_CLAVES_STOCK}), 1, {STOCK_CLAVES_MAX}),"
+    query = f"""
+        MERGE INTO {INV_TABLE} AS t
+        USING (
+            SELECT s.id, s.qty
+            FROM (VALUES {values}) AS s(id, qty)
+            {cond}
+        ) AS src
+        ON t.id = src.id {on_clave}
+        WHEN MATCHED THEN UPDATE SET
+            stock = CAST(COALESCE(t.stock, 0) AS BIGINT) {'-' if signo < 0 else '+'} src.qty,
+            {set_clave}
+            updated_at = current_timestamp()
+    """
+    if clave is not None:
+        cur.execute(query, {"clave": clave})
+    else:
+        cur.execute(query)
+    return _affected_rows(cur)
+
+
+def _stock_ya_aplicado(cur, cart: dict, clave: str) -> bool:
+    """True si el descuento del pedido `clave` ya se hizo (el MERGE es todo o nada)."""
+    ids = ", ".join(str(int(pid)) for pid in cart)
+    cur.execute(
+        f"SELECT count(*) FROM {INV_TABLE} t WHERE t.id IN ({ids}) AND array_contains({_CLAVES_STOCK}, :clave)",
+        {"clave": clave},
+    )
+    row = cur.fetchone()
+    return bool(row) and int(row[0]) == len(cart)
+
+
+def _apply_stock(cur, cart: dict, clave: str = None):
+    """Chequeo + MERGE con guarda. Devuelve (ok, fallos, productos)."""
+    productos = _fetch_products(cur, cart.keys())
+    fallos = stock_faltante(cart, productos)
+    if fallos:
+        return False, fallos, productos
+    if _merge_stock(cur, cart, signo=-1, guard=True, clave=clave) != len(cart):
+        # Otro pedido ganó la carrera entre la lectura y el MERGE
+        return False, stock_faltante(cart, _fetch_products(cur, cart.keys())), productos
+    return True, [], productos
+
+
+@_timed
+def apply_stock(cart: dict, clave: str = None):
+    """
+    Descuenta el stock de todo el carrito en un solo MERGE (todo o nada).
+    Con `clave` (idempotency_key) es idempotente: si ese pedido ya descontó su
+    stock, devuelve ok sin volver a descontar.
+    Returns (ok, fallos). Los errores de conexión se propagan para reintentar.
+    """
+    cart = {int(pid): int(qty) for pid, qty in cart.items() if int(qty) > 0}
+    if not cart:
+        return True, []
+    if _OFFLINE:
+        ok, fallos, repetido = replica.get_replica().apply_stock(cart, clave)
+    else:
+        with _query("apply_stock") as cur:
+            repetido = clave is not None and _stock_ya_aplicado(cur, cart, clave)
+            if repetido:
+                ok, fallos = True, []
+            else:
+                ok, fallos, _ = _apply_stock(cur, cart, clave)
+    if repetido:
+        print(f"[DBX] Stock del pedido {clave} ya descontado, no se repite")
+    elif ok:
+        for pid, qty in cart.items():
+            _catalog.adjust_stock(pid, -qty)
+    return ok, fallos
+
+
+@_timed
+def checkout_order(chat_id: int, user_name: str, cart: dict):
+    """
+    Checkout todo-o-nada: descuenta el stock de todas las líneas en un solo
+    MERGE con guarda de stock suficiente y registra el pedido con la misma
+    conexión. Si el INSERT falla, el stock se devuelve con un MERGE compensatorio.
+
+    Returns:
+        (ok, fallos) donde fallos = [(pid, pedido, disponible)] de las líneas
+        sin stock suficiente (vacío si el fallo fue otro error).
+    """
+    cart = {int(pid): int(qty) for pid, qty in (cart or {}).items() if int(qty) > 0}
+    if not cart:
+        # Sin líneas con cantidad positiva: no hay nada que descontar (VALUES vacío no es SQL válido)
+        return False, []
+
+    try:
+        if _OFFLINE:
+            # En la réplica local stock + pedido van en una sola transacción
+            pedido = _order_payload(chat_id, user_name, cart, get_products(cart.keys(), fresh=True))
+            if not pedido:
+                return False, stock_faltante(cart, {})
+            ok, fallos = replica.get_replica().checkout(cart, pedido)
+            if ok:
+                for pid, qty in cart.items():
+                    _catalog.adjust_stock(pid, -qty)
+            return ok, fallos
+
+        with _query("checkout_order") as cur:
+            ok, fallos, productos = _apply_stock(cur, cart)
+            if not ok:
+                return False, fallos
             
-            print(f"[DEBUG] Ejecutando query: {query}")  # Para debug
-            cur.execute(query)
+            try:
+                if not _insert_order(cur, chat_id, user_name, cart, productos):
+                    raise RuntimeError("Pedido sin ítems válidos")
+            except Exception:
+                _merge_stock(cur, cart, signo=+1, guard=False)
+                raise
             
-            return True
+            for pid, qty in cart.items():
+                _catalog.adjust_stock(pid, -qty)
+            print(f"✅ Checkout confirmado: {len(cart)} líneas para {user_name}")
+            return True, []
             
     except Exception as e:
-        print(f"Error guardando pedido: {e}")
+        print(f"❌ Error en checkout_order: {e}")
         import traceback
         traceback.print_exc()
-        return False
\ No newline at end of file
+        return False, []
+
+
+# ===== API asíncrona =====
+# Las consultas del conector son bloqueantes: desde los handlers se llaman con
+# `await dbx.a<función>(...)`, que las corre en un executor acotado con timeout
+# para no congelar el event loop de PTB mientras un usuario espera al warehouse.
+DBX_ASYNC_WORKERS = int(os.getenv("DBX_ASYNC_WORKERS", str(DBX_POOL_SIZE)))
+DBX_TIMEOUT_S = float(os.getenv("DBX_TIMEOUT_S", "30"))
+DBX_WRITE_TIMEOUT_S = float(os.getenv("DBX_WRITE_TIMEOUT_S", "60"))
+
+_executor = ThreadPoolExecutor(max_workers=max(1, DBX_ASYNC_WORKERS), thread_name_prefix="dbx")
+
+
+async def _run(fn, *args, timeout: float = None, **kwargs):
+    """
+    Ejecuta fn en el executor de dbx. Si vence el timeout o se cancela la
+    tarea que espera, la llamada se cancela si aún no empezó; si ya estaba
+    corriendo termina en segundo plano y su conexión vuelve al pool.
+    """
+    op = fn.__name__
+    submitted = time.perf_counter()
+
+    def call():
+        # Espera en la cola del executor (todos los hilos ocupados)
+        metrics.observe("dbx_queue_ms", (time.perf_counter() - submitted) * 1000, op=op)
+        return fn(*args, **kwargs)
+
+    loop = asyncio.get_running_loop()
+    fut = loop.run_in_executor(_executor, call)
+    try:
+        return await asyncio.wait_for(fut, timeout or DBX_TIMEOUT_S)
+    except asyncio.TimeoutError:
+        metrics.inc("dbx_timeouts", op=op)
+        raise
+
+
+async def _read(fn, *args, **kwargs):
+    # Con el snapshot cargado la lectura es en memoria: no vale la pena saltar de hilo
+    if _catalog.loaded:
+        return fn(*args, **kwargs)
+    return await _run(fn, *args, **kwargs)
+
+
+async def alist_products(limit=6):
+    return await _read(list_products, limit)
+
+
+async def alist_products_page(after_id=None, before_id=None, limit=6, categoria=None):
+    return await _read(list_products_page, after_id, before_id, limit, categoria)
+
+
+async def asearch_products(q, limit=6):
+    return await _read(search_products, q, limit)
+
+
+async def aget_product(pid):
+    return await _read(get_product, pid)
+
+
+async def aget_products(pids, fresh: bool = False):
+    if fresh:
+        return await _run(get_products, list(pids), fresh=True)
+    return await _read(get_products, list(pids))
+
+
+async def afind_best_by_name(term: str):
+    return await _read(find_best_by_name, term)
+
+
+async def afind_best_by_names(terms):
+    return await _read(find_best_by_names, list(terms))
+
+
+async def abuild_order(chat_id: int, user_name: str, cart: dict):
+    return await _read(build_order, chat_id, user_name, dict(cart))
+
+
+async def arefresh_catalog(full: bool = False) -> int:
+    return await _run(refresh_catalog, full, timeout=DBX_WRITE_TIMEOUT_S)
+
+
+async def adecrease_stock(pid, qty):
+    return await _run(decrease_stock, pid, qty, timeout=DBX_WRITE_TIMEOUT_S)
+
+
+async def asave_order(chat_id: int, user_name: str, cart: dict) -> bool:
+    return await _run(save_order, chat_id, user_name, dict(cart), timeout=DBX_WRITE_TIMEOUT_S)
+
+
+async def asave_orders(orders: list) -> int:
+    return await _run(save_orders, list(orders), timeout=DBX_WRITE_TIMEOUT_S)
+
+
+async def acheckout_order(chat_id: int, user_name: str, cart: dict):
+    return await _run(checkout_order, chat_id, user_name, dict(cart), timeout=DBX_WRITE_TIMEOUT_S)
@@ -0,0 +1,213 @@
+# services/dbx_pool.py
+# Pool acotado de conexiones reutilizables (Databricks SQL u otra DB-API).
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class _Pooled:
+    __slots__ = ("raw", "created", "last_used", "suspect")
+
+    def __init__(self, raw):
+        now = time.monotonic()
+        self.raw = raw
+        self.created = now
+        self.last_used = now
+        self.suspect = False
+
+
+class ConnectionPool:
+    """
+    Pool de conexiones con tamaño máximo, chequeo de salud, desalojo por
+    inactividad y reciclaje por tiempo de vida máximo.
+
+    Uso:
+        with pool.connection() as c, c.cursor() as cur:
+            cur.execute(...)
+    """
+
+    def __init__(self, factory, max_size=4, timeout=15.0, idle_timeout=300.0,
+                 max_lifetime=3600.0, check_after=30.0):
+        self._factory = factory
+        self.max_size = max(1, int(max_size))
+        self.timeout = float(timeout)
+        self.idle_timeout = float(idle_timeout)
+        self.max_lifetime = float(max_lifetime)
+        self.check_after = float(check_after)
+
+        self._idle = deque()          # libres; se reutiliza la más reciente (LIFO)
+        self._cond = threading.Condition()
+        self._size = 0                # abiertas = prestadas + libres
+        self._in_use = 0
+
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._checkout_total = 0.0
+        self._checkout_max = 0.0
+        self._timeouts = 0
+        self._opened = 0
+        self._closed = {"idle": 0, "lifetime": 0, "unhealthy": 0, "shutdown": 0}
+
+    # ---------- ciclo de vida ----------
+    def _close(self, pc: _Pooled, reason: str):
+        try:
+            pc.raw.close()
+        except Exception:
+            pass
+        self._closed[reason] = self._closed.get(reason, 0) + 1
+
+    def _expired(self, pc: _Pooled, now: float) -> str:
+        if self.max_lifetime > 0 and now - pc.created >= self.max_lifetime:
+            return "lifetime"
+        if self.idle_timeout > 0 and now - pc.last_used >= self.idle_timeout:
+            return "idle"
+        return ""
+
+    def _evict_locked(self, now: float) -> list:
+        """Saca de la cola las conexiones vencidas. Devuelve [(pc, motivo)] para cerrar fuera del lock."""
+        out = []
+        keep = deque()
+        while self._idle:
+            pc = self._idle.popleft()
+            reason = self._expired(pc, now)
+            if reason:
+                out.append((pc, reason))
+                self._size -= 1
+            else:
+                keep.append(pc)
+        self._idle = keep
+        return out
+
+    def _healthy(self, pc: _Pooled) -> bool:
+        try:
+            with pc.raw.cursor() as cur:
+                cur.execute("SELECT 1")
+                cur.fetchall()
+            return True
+        except Exception:
+            return False
+
+    def _open(self) -> _Pooled:
+        pc = _Pooled(self._factory())
+        self._opened += 1
+        return pc
+
+    # ---------- préstamo ----------
+    def _acquire(self) -> _Pooled:
+        t0 = time.perf_counter()
+        deadline = time.monotonic() + self.timeout
+        waited = 0.0
+
+        with self._cond:
+            stale = self._evict_locked(time.monotonic())
+            pc, create = None, False
+            while not self._idle and self._size >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    for old, reason in stale:
+                        self._close(old, reason)
+                    raise RuntimeError(
+                        f"Pool de Databricks agotado ({self.max_size} conexiones en uso, "
+                        f"esperó {self.timeout:.0f}s)"
+                    )
+                w0 = time.perf_counter()
+                self._cond.wait(remaining)
+                waited += time.perf_counter() - w0
+            if self._idle:
+                pc = self._idle.pop()
+            else:
+                self._size += 1
+                create = True
+            self._in_use += 1
+
+        for old, reason in stale:
+            self._close(old, reason)
+
+        try:
+            if create:
+                pc = self._open()
+            else:
+                now = time.monotonic()
+                reason = self._expired(pc, now)
+                if reason:
+                    self._close(pc, reason)
+                    pc = self._open()
+                elif (pc.suspect or now - pc.last_used >= self.check_after) and not self._healthy(pc):
+                    self._close(pc, "unhealthy")
+                    pc = self._open()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        elapsed = time.perf_counter() - t0
+        with self._cond:
+            self._checkouts += 1
+            self._checkout_total += elapsed
+            self._checkout_max = max(self._checkout_max, elapsed)
+            if waited > 0:
+                self._waits += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+        return pc
+
+    def _release(self, pc: _Pooled, failed: bool):
+        pc.last_used = time.monotonic()
+        # Tras un error no sabemos si la sesión sigue viva: se verifica en el próximo préstamo
+        pc.suspect = failed
+        with self._cond:
+            self._in_use -= 1
+            if self._expired(pc, pc.last_used):
+                self._size -= 1
+                drop = True
+            else:
+                self._idle.append(pc)
+                drop = False
+            self._cond.notify()
+        if drop:
+            self._close(pc, "lifetime")
+
+    @contextmanager
+    def connection(self):
+        pc = self._acquire()
+        failed = True
+        try:
+            yield pc.raw
+            failed = False
+        finally:
+            self._release(pc, failed)
+
+    def close_all(self):
+        """Cierra las conexiones libres (las prestadas se cierran al devolverse si ya vencieron)."""
+        with self._cond:
+            idle, self._idle = list(self._idle), deque()
+            self._size -= len(idle)
+        for pc in idle:
+            self._close(pc, "shutdown")
+
+    # ---------- métricas ----------
+    def stats(self) -> dict:
+        """Tamaño, esperas y latencia de préstamo para dimensionar el pool."""
+        with self._cond:
+            n = self._checkouts or 1
+            return {
+                "max_size": self.max_size,
+                "size": self._size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "checkouts": self._checkouts,
+                "checkout_avg_ms": round(self._checkout_total / n * 1000, 2),
+                "checkout_max_ms": round(self._checkout_max * 1000, 2),
+                "waits": self._waits,
+                "wait_avg_ms": round(self._wait_total / (self._waits or 1) * 1000, 2),
+                "wait_max_ms": round(self._wait_max * 1000, 2),
+                "timeouts": self._timeouts,
+                "opened": self._opened,
+                "closed": dict(self._closed),
+            }
@@ -1,6 +1,12 @@
 # services/gemini.py
+import asyncio
+import json
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import TypedDict
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -11,6 +17,11 @@ if env_path.is_file():
 else:
     print(f"[WARN] .env no encontrado en: {env_path}")
 import google.generativeai as genai
+from services import intent_cache, llm_client, metrics
+from services.gemini_contexto import ModeloGemini
+from services.intent_batch import INTENT_BATCH, MicroBatcher
+from services.llm_router import ModelRouter, SinModelos
+from services.intent_rules import INTENT_RULES_MIN_CONF, _ALLOWED, _sanitize_command, parse_intent  # noqa: F401
 
 
 ENV_CANDIDATES = [
@@ -54,6 +65,44 @@ except Exception:
     _SAFETY = None
 
 
+# Instrucciones fijas del intérprete: van como system_instruction (en caché de
+# contexto si la API lo admite) y cada llamada solo envía el mensaje del usuario.
+_INSTRUCCIONES = """
+Actúa como un bot VENDEDOR. Devuelve exactamente UN comando entre:
+  /productos
+  /buscar <palabra>
+  /add <id> <cantidad>
+  /add <nombre> <cantidad>   # si no sabes el id, usa el nombre del producto
+  /carrito
+  /checkout
+
+Reglas:
+- Si el usuario saluda o pide ver/mostrar/enséñame/quiero el catálogo o los productos → /productos
+- Si el usuario quiere agregar pero no da ID, usa /add <nombre> <cantidad>
+- Si no estás seguro → /productos
+- SOLO devuelve el comando, sin explicaciones.
+
+Ejemplos:
+Usuario: "quiero agregar 2 de papel higiénico"
+Comando: /add papel higienico 2
+
+Usuario: "ponme 3 jabones"
+Comando: /add jabon 3
+
+Usuario: "agrega 1 shampoo"
+Comando: /add shampoo 1
+
+Usuario: "pagar"
+Comando: /checkout
+
+Usuario: "finalizar la compra"
+Comando: /checkout
+
+Usuario: "confirmar el pedido"
+Comando: /checkout
+""".strip()
+
+
 def _extract_text(resp) -> str:
     """Evita resp.text; rescata texto recorriendo candidates/parts."""
     try:
@@ -78,156 +127,265 @@ def _extract_text(resp) -> str:
         return ""
 
 
-def _load_model():
+# Modelo elegido: se resuelve una vez en segundo plano (warmup) y se guarda en
+# disco con expiración; los reinicios lo reutilizan sin llamadas de prueba.
+GEMINI_MODEL_CACHE_PATH = os.getenv("GEMINI_MODEL_CACHE_PATH", "gemini_modelo.json")
+GEMINI_MODEL_CACHE_TTL_S = float(os.getenv("GEMINI_MODEL_CACHE_TTL_S", "86400"))
+
+
+def _configure():
     api_key = os.getenv("GOOGLE_API_KEY", "").strip()
     if not api_key:
         raise RuntimeError("Falta GOOGLE_API_KEY en .env")
     genai.configure(api_key=api_key)
 
+
+def _build(name: str):
+    return ModeloGemini(name, _INSTRUCCIONES, op="intent", generation_config=_GEN_CFG, safety_settings=_SAFETY)
+
+
+def _probe(name: str) -> bool:
+    # Ping corto para validar (modelo simple: sin instrucciones ni caché de contexto)
+    model = genai.GenerativeModel(name, generation_config=_GEN_CFG, safety_settings=_SAFETY)
+    return bool(_extract_text(model.generate_content("ok")))
+
+
+def _leer_modelo_cache():
+    """Nombre del modelo guardado si sigue vigente y en la lista de candidatos."""
+    if not GEMINI_MODEL_CACHE_PATH:
+        return None
+    try:
+        with open(GEMINI_MODEL_CACHE_PATH, encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"[Gemini] ⚠️ No se pudo leer {GEMINI_MODEL_CACHE_PATH}: {e}")
+        return None
+    if data.get("expira", 0) <= time.time() or data.get("modelo") not in _FALLBACK_MODELS:
+        return None
+    return data["modelo"]
+
+
+def _guardar_modelo_cache(name: str):
+    if not GEMINI_MODEL_CACHE_PATH:
+        return
+    tmp = f"{GEMINI_MODEL_CACHE_PATH}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"modelo": name, "expira": time.time() + GEMINI_MODEL_CACHE_TTL_S}, f)
+        os.replace(tmp, GEMINI_MODEL_CACHE_PATH)
+    except Exception as e:
+        print(f"[Gemini] ⚠️ No se pudo guardar {GEMINI_MODEL_CACHE_PATH}: {e}")
+
+
+def _borrar_modelo_cache():
+    try:
+        os.remove(GEMINI_MODEL_CACHE_PATH)
+    except (FileNotFoundError, TypeError):
+        pass
+    except Exception as e:
+        print(f"[Gemini] ⚠️ No se pudo borrar {GEMINI_MODEL_CACHE_PATH}: {e}")
+
+
+def _load_model():
+    """
+    Sondea todos los candidatos en paralelo y se queda con el primero de la
+    lista (orden de preferencia) que responde. Tarda lo que el más lento de
+    los preferidos, no la suma de todos.
+    """
+    _configure()
+    candidatos = [m for m in dict.fromkeys(_FALLBACK_MODELS) if m]
+    t0 = time.perf_counter()
     last_err = None
-    for m in _FALLBACK_MODELS:
-        try:
-            if not m:
-                continue
-            model = genai.GenerativeModel(
-                m,
-                generation_config=_GEN_CFG,
-                safety_settings=_SAFETY,
-            )
-            # Ping corto para validar
-            probe = model.generate_content("ok")
-            if _extract_text(probe):
-                return model, m
-        except Exception as e:
-            last_err = e
+    ex = ThreadPoolExecutor(max_workers=len(candidatos), thread_name_prefix="gemini-probe")
+    try:
+        futuros = [(m, ex.submit(_probe, m)) for m in candidatos]
+        for m, fut in futuros:
+            try:
+                if fut.result():
+                    metrics.observe("gemini_probe_ms", (time.perf_counter() - t0) * 1000)
+                    return _build(m), m
+            except Exception as e:
+                last_err = e
+    finally:
+        # No se espera a los sondeos de modelos menos preferidos
+        ex.shutdown(wait=False, cancel_futures=True)
     raise RuntimeError(f"No se pudo cargar Gemini. Último error: {last_err}")
 
 
 _model = None
 _model_name = None
+_model_lock = threading.Lock()
 
 def _get_model():
     global _model, _model_name
-    if _model is None:
-        _model, _model_name = _load_model()
-        print(f"[Gemini] usando modelo: {_model_name}")
+    with _model_lock:
+        if _model is None:
+            cached = _leer_modelo_cache()
+            if cached:
+                # Sin llamada de prueba: si resulta no estar disponible, _modelo_fallo re-sondea
+                _configure()
+                _model, _model_name = _build(cached), cached
+                print(f"[Gemini] usando modelo (caché): {_model_name}")
+            else:
+                _model, _model_name = _load_model()
+                _guardar_modelo_cache(_model_name)
+                print(f"[Gemini] usando modelo: {_model_name}")
     return _model
 
 
-_ALLOWED = ("/productos", "/carrito", "/checkout", "/add", "/buscar")
+async def warmup():
+    """Resuelve el modelo al arrancar, en segundo plano, para que el primer usuario no pague el sondeo."""
+    try:
+        await _aget_model()
+    except Exception as e:
+        print(f"[Gemini] ⚠️ Warmup sin modelo disponible: {e}")
 
-def _sanitize_command(s: str) -> str:
-    s = (s or "").strip().splitlines()[0].strip()
-    s = " ".join(s.split())
-    lower = s.lower()
 
-    if not lower:
-        return "/productos"
+def _modelo_fallo(err: Exception):
+    """Error del modelo (no timeout): se descarta la elección y se re-sondea en segundo plano."""
+    global _model, _model_name
+    with _model_lock:
+        if _model is None:
+            return
+        print(f"[Gemini] ⚠️ Modelo {_model_name} falló ({type(err).__name__}); se vuelve a sondear")
+        _model = _model_name = None
+        _borrar_modelo_cache()
+    try:
+        asyncio.get_running_loop().create_task(warmup())
+    except RuntimeError:
+        pass
 
-    if lower.startswith("/add"):
-        # Aceptar: /add <id> <qty> | /add <nombre...> <qty>
-        # Y también variantes como: /add <qty> <nombre...> | "/add <qty> de <nombre...>"
-        tokens = lower.split()
-        args = tokens[1:]
-
-        # quitar stop-words típicas
-        stop = {"de", "del", "la", "el", "los", "las"}
-        args = [t for t in args if t not in stop]
-
-        if not args:
-            return "/productos"
-
-        # casos: qty primero o qty al final
-        qty = None
-        if args and args[-1].isdigit():
-            qty = int(args[-1]); name_or_id = args[:-1]
-        elif args and args[0].isdigit():
-            qty = int(args[0]); name_or_id = args[1:]
-        else:
-            # sin cantidad explícita
-            qty = 1; name_or_id = args
-
-        if not name_or_id:
-            return f"/add {qty} 1"  # fallback raro pero válido
-
-        # si es un único token y es número, tratamos como id
-        if len(name_or_id) == 1 and name_or_id[0].isdigit():
-            return f"/add {name_or_id[0]} {qty}"
-
-        # singulariza para mejorar el match con catálogo
-        try:
-            from services.dbx import _singularize_phrase_es, _norm
-            nombre = _singularize_phrase_es(nombre)
-            nombre = _norm(nombre)
-        except Exception:
-            pass
-        return f"/add {nombre} {qty}"
 
-    if lower.startswith("/buscar"):
-        parts = lower.split(maxsplit=1)
-        return parts[0] if len(parts) == 1 else f"/buscar {parts[1]}"
+# Origen de cada intención resuelta (para ver cuánto tráfico evita el LLM)
+_fuentes = {"cache": 0, "reglas": 0, "gemini": 0, "error": 0}
 
-    if any(lower.startswith(x) for x in ("/productos", "/carrito", "/checkout")):
-        return lower.split()[0]
+def _contar(fuente: str):
+    _fuentes[fuente] += 1
+    metrics.inc("intent_fuente", fuente=fuente)
 
-    return "/productos"
+def intent_stats() -> dict:
+    """Qué fracción de las intenciones se resolvió sin llamar al LLM."""
+    total = sum(_fuentes.values())
+    sin_llm = _fuentes["cache"] + _fuentes["reglas"]
+    return {**_fuentes, "total": total, "sin_llm": round(sin_llm / total, 4) if total else 0.0}
 
+metrics.register_collector("intenciones", intent_stats)
 
 
+async def _aget_model():
+    # La primera carga puede sondear modelos (llamadas bloqueantes): fuera del event loop
+    if _model is not None:
+        return _model
+    return await llm_client.run_blocking(_get_model, op="gemini_load")
 
-def interpret_user_message(text: str) -> str:
-    """
-    Convierte el mensaje en uno de:
-      /productos | /buscar <palabra> | /add <id> <cantidad> | /carrito | /checkout
-    En duda → /productos.
-    """
-    prompt = f"""
-Actúa como un bot VENDEDOR. Devuelve exactamente UN comando entre:
-  /productos
-  /buscar <palabra>
-  /add <id> <cantidad>
-  /add <nombre> <cantidad>   # si no sabes el id, usa el nombre del producto
-  /carrito
-  /checkout
 
-Reglas:
-- Si el usuario saluda o pide ver/mostrar/enséñame/quiero el catálogo o los productos → /productos
-- Si el usuario quiere agregar pero no da ID, usa /add <nombre> <cantidad>
-- Si no estás seguro → /productos
-- SOLO devuelve el comando, sin explicaciones.
+# En tiempo de ejecución las llamadas recorren _FALLBACK_MODELS con circuit
+# breaker y hedging; el modelo elegido en el arranque va primero.
+_router = ModelRouter(_FALLBACK_MODELS, _build)
+metrics.register_collector("gemini_router", _router.stats)
 
-Ejemplos:
-Usuario: "quiero agregar 2 de papel higiénico"
-Comando: /add papel higienico 2
 
-Usuario: "ponme 3 jabones"
-Comando: /add jabon 3
 
-Usuario: "agrega 1 shampoo"
-Comando: /add shampoo 1
+# Micro-lotes (INTENT_BATCH=1): los mensajes viajan como JSON con un id cada
+# uno y las respuestas se emparejan por id, no por posición. Así un texto con
+# saltos de línea o con "2." adentro no corre los índices del lote.
+_INSTRUCCIONES_LOTE = """
+Ahora recibirás un arreglo JSON con VARIOS mensajes de usuarios distintos, cada
+uno con su "id" y su "texto".
+Devuelve un arreglo JSON con exactamente un objeto {"id": <id>, "comando": <comando>}
+por mensaje, usando el mismo id.
+"""
 
-Usuario: "pagar"
-Comando: /checkout
 
-Usuario: "finalizar la compra"
-Comando: /checkout
+class _ComandoLote(TypedDict):
+    id: int
+    comando: str
 
-Usuario: "confirmar el pedido"
-Comando: /checkout
 
+_GEN_CFG_LOTE = dict(response_mime_type="application/json", response_schema=list[_ComandoLote])
 
-Usuario: "{text}"
-Comando:
-""".strip()
 
+async def _interpretar_lote(textos):
+    """Un comando (texto crudo del modelo) por cada texto, con una sola llamada."""
+    mensajes = json.dumps([{"id": i, "texto": t} for i, t in enumerate(textos, 1)], ensure_ascii=False)
+    prompt = _INSTRUCCIONES_LOTE.strip() + "\n\n" + mensajes
+    resp, _ = await _router.generate(prompt, preferido=_model_name, op="intent_lote", generation_config=_GEN_CFG_LOTE)
+    respuestas = json.loads(_extract_text(resp) or "[]")
+    try:
+        por_id = {int(r["id"]): str(r["comando"]) for r in respuestas}
+    except (TypeError, KeyError, ValueError):
+        raise ValueError(f"Lote de {len(textos)} mensajes devolvió {respuestas!r}") from None
+    if sorted(por_id) != list(range(1, len(textos) + 1)):
+        raise ValueError(f"Lote de {len(textos)} mensajes devolvió ids {sorted(por_id)}")
+    return [por_id[i] for i in range(1, len(textos) + 1)]
+
+
+_lote = MicroBatcher(_interpretar_lote)
+metrics.register_collector("intent_lotes", _lote.stats)
+
+
+async def interpret_user_message(text: str, chat_id=None) -> str:
+    """
+    Convierte el mensaje en uno de:
+      /productos | /buscar <palabra> | /add <id> <cantidad> | /carrito | /checkout
+    En duda → /productos. Con `chat_id`, un mensaje más nuevo del mismo chat
+    cancela la llamada en curso (lanza llm_client.LLMSuperseded).
+    """
+    cached = intent_cache.get(text)
+    if cached is not None:
+        print(f"[Gemini caché]: {text!r} → {cached}")
+        _contar("cache")
+        return cached
+
+    # Reglas deterministas: solo se llama al modelo si no alcanzan la confianza mínima
+    cmd, conf = parse_intent(text)
+    if cmd and conf >= INTENT_RULES_MIN_CONF:
+        print(f"[Reglas interpretó]: {text!r} → {cmd} (confianza {conf:.2f})")
+        _contar("reglas")
+        return cmd
+
+    prompt = f'Usuario: "{text}"\nComando:'
 
     try:
-        model = _get_model()
-        resp = model.generate_content(prompt)
-        cmd_raw = _extract_text(resp)
+        await _aget_model()
+        cmd_raw = None
+        if INTENT_BATCH:
+            # Se espera el lote con la cancelación por chat; el lote sigue para los demás
+            try:
+                cmd_raw = await llm_client.esperar_por_chat(_lote.pedir(text, intent_cache.key(text)), chat_id)
+                usado = "lote"
+            except ValueError as e:
+                # JSON inválido o con otro largo: este mensaje se resuelve solo
+                print(f"[Gemini] ⚠️ Lote inválido, llamada individual: {e}")
+        if cmd_raw is None:
+            # Mensajes idénticos simultáneos comparten la misma llamada (single-flight)
+            resp, usado = await _router.generate(
+                prompt, preferido=_model_name, chat_id=chat_id, op="intent",
+                clave=llm_client.clave_prompt(_model_name, prompt),
+            )
+            cmd_raw = _extract_text(resp)
         cmd = _sanitize_command(cmd_raw)
-        print(f"[Gemini interpretó]: {text!r} → {cmd}")
+        print(f"[Gemini interpretó]: {text!r} → {cmd} ({usado})")
+        # Solo se cachean respuestas reales del modelo (no el fallback por error)
+        if cmd_raw:
+            intent_cache.put(text, cmd)
+        _contar("gemini")
         return cmd
+    except llm_client.LLMSuperseded:
+        raise
+    except asyncio.TimeoutError:
+        print(f"[Gemini] ⏳ Timeout interpretando {text!r}")
+        _contar("error")
+        return "/productos"
+    except SinModelos as e:
+        print(f"[Gemini] ⚠️ {e}")
+        _contar("error")
+        return "/productos"
     except Exception as e:
+        # Fallaron todos los modelos disponibles: se vuelve a sondear cuál usar
         print("Error llamando a Gemini:", e)
+        _modelo_fallo(e)
+        _contar("error")
         return "/productos"
@@ -1,31 +1,20 @@
 # services/gemini_chat.py
+import asyncio
 import os
 from datetime import datetime
 import google.generativeai as genai
+from services import llm_client
+from services.gemini_contexto import ModeloGemini
 
 # Configurar Gemini
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 genai.configure(api_key=GEMINI_API_KEY)
 
-model = genai.GenerativeModel('gemini-2.5-flash')
+MODELO = 'gemini-2.5-flash'
 
-
-def chat_natural(text: str, user_name: str = "Usuario") -> str:
-    """
-    Mantiene una conversación natural con el usuario usando Gemini.
-    
-    Args:
-        text: Mensaje del usuario
-        user_name: Nombre del usuario para personalizar
-    
-    Returns:
-        Respuesta natural del bot
-    """
-    
-    # Obtener fecha actual
-    fecha_actual = datetime.now().strftime('%A, %d de %B')
-    
-    prompt = f"""
+# Persona, reglas y ejemplos: fijos, como system_instruction (en caché de
+# contexto si la API lo admite). Cada llamada solo envía fecha, nombre y mensaje.
+_SISTEMA = """
 Eres Damon, un asistente virtual amigable y servicial de una tienda. 
 Tu personalidad es cálida, profesional y útil.
 
@@ -43,36 +32,76 @@ INSTRUCCIONES:
 - Mantén respuestas cortas (máximo 2-3 líneas)
 - NO inventes información sobre productos o precios
 - Si te hacen preguntas existenciales o complejas, responde brevemente y redirige sutilmente al catálogo
+- Cada mensaje trae la fecha de hoy; úsala solo si te la preguntan
 
 EJEMPLOS:
 Usuario: "hola como estas"
 Damon: "¡Hola! 😊 Estoy muy bien, gracias por preguntar. ¿En qué puedo ayudarte hoy? Puedo mostrarte nuestro catálogo o ayudarte a buscar algo específico."
 
 Usuario: "que dia es hoy"
-Damon: "Hoy es {fecha_actual}. ¿Necesitas algo de la tienda?"
+Damon: "Hoy es <la fecha que viene con el mensaje>. ¿Necesitas algo de la tienda?"
 
 Usuario: "cuentame un chiste"
 Damon: "¿Por qué el libro de matemáticas está triste? Porque tiene muchos problemas 😄 ¿Puedo ayudarte con algo más? ¡Tenemos buenos productos!"
 
 Usuario: "estoy aburrido"
 Damon: "Entiendo 😊 ¿Qué tal si echas un vistazo a nuestros productos? Tal vez encuentres algo interesante. ¿Quieres que te muestre el catálogo?"
+""".strip()
+
+model = ModeloGemini(MODELO, _SISTEMA, op="chat")
+
 
-AHORA RESPONDE A ESTE MENSAJE:
+def _limpiar(respuesta: str) -> str:
+    # Limpiar si viene con prefijos
+    respuesta = (respuesta or "").strip()
+    prefijos = ["damon:", "respuesta:", "asistente:"]
+    for prefijo in prefijos:
+        if respuesta.lower().startswith(prefijo):
+            respuesta = respuesta[len(prefijo):].strip()
+    return respuesta
+
+
+async def chat_natural(text: str, user_name: str = "Usuario", chat_id=None, on_texto=None) -> str:
+    """
+    Mantiene una conversación natural con el usuario usando Gemini.
+    
+    Args:
+        text: Mensaje del usuario
+        user_name: Nombre del usuario para personalizar
+        chat_id: Si se indica, un mensaje más nuevo del mismo chat cancela
+                 esta llamada (lanza llm_client.LLMSuperseded)
+        on_texto: Si se indica, la respuesta se pide en modo stream y se
+                  llama `await on_texto(texto_parcial)` con cada fragmento
+    
+    Returns:
+        Respuesta natural del bot
+    """
+    
+    # Obtener fecha actual
+    fecha_actual = datetime.now().strftime('%A, %d de %B')
+    
+    prompt = f"""Fecha de hoy: {fecha_actual}
 Usuario ({user_name}): {text}
 Damon:"""
 
     try:
-        response = model.generate_content(prompt)
-        respuesta = response.text.strip()
-        
-        # Limpiar si viene con prefijos
-        prefijos = ["damon:", "respuesta:", "asistente:"]
-        for prefijo in prefijos:
-            if respuesta.lower().startswith(prefijo):
-                respuesta = respuesta[len(prefijo):].strip()
+        if on_texto is not None:
+            async def _parcial(acumulado):
+                await on_texto(_limpiar(acumulado))
+            respuesta = await llm_client.stream(model, prompt, _parcial, chat_id=chat_id, op="chat")
+        else:
+            response = await llm_client.generate(
+                model, prompt, chat_id=chat_id, op="chat", clave=llm_client.clave_prompt(MODELO, prompt),
+            )
+            respuesta = response.text
         
-        return respuesta
+        return _limpiar(respuesta)
         
+    except llm_client.LLMSuperseded:
+        raise
+    except asyncio.TimeoutError:
+        print(f"[CHAT NATURAL] ⏳ Timeout respondiendo a {user_name}")
+        return "Disculpa, estoy tardando más de lo normal 🙏 ¿Me lo repites en un momento?"
     except Exception as e:
         print(f"Error en chat natural: {e}")
         import traceback
@@ -0,0 +1,146 @@
+# services/gemini_contexto.py
+# Modelos de Gemini con el prompt fijo (reglas, persona, ejemplos) como
+# system_instruction, en lugar de repetirlo en cada mensaje:
+#   - con GEMINI_CONTEXT_CACHE=1 la instrucción va a una caché de contexto
+#     (CachedContent) que se renueva antes de vencer; si la API la rechaza
+#     (p. ej. por debajo del mínimo de tokens del modelo) ese modelo usa
+#     system_instruction normal hasta que el proceso reinicie
+#   - cada llamada registra sus tokens (usage_metadata): entrada, de ellos
+#     cuántos salieron de caché, y salida
+import asyncio
+import os
+import threading
+import time
+from datetime import timedelta
+
+import google.generativeai as genai
+
+from services import metrics
+
+GEMINI_CONTEXT_CACHE = os.getenv("GEMINI_CONTEXT_CACHE", "0") == "1"
+GEMINI_CONTEXT_CACHE_TTL_S = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL_S", "3600"))
+
+BUCKETS_TOKENS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000)
+
+_sin_cache = set()    # modelos cuya caché de contexto falló: no se reintenta en este proceso
+_caches = []          # CachedContent creados (se borran al cerrar)
+_tokens = {}          # op -> {"llamadas", "entrada", "cacheados", "salida"}
+_tokens_lock = threading.Lock()
+
+
+def registrar_uso(resp, op: str):
+    """Tokens de una respuesta (usage_metadata) → métricas por llamada y totales por op."""
+    um = getattr(resp, "usage_metadata", None)
+    if um is None:
+        return
+    entrada = getattr(um, "prompt_token_count", 0) or 0
+    cacheados = getattr(um, "cached_content_token_count", 0) or 0
+    salida = getattr(um, "candidates_token_count", 0) or 0
+    metrics.observe("llm_tokens_entrada", entrada, buckets=BUCKETS_TOKENS, op=op)
+    metrics.observe("llm_tokens_cacheados", cacheados, buckets=BUCKETS_TOKENS, op=op)
+    metrics.observe("llm_tokens_salida", salida, buckets=BUCKETS_TOKENS, op=op)
+    with _tokens_lock:
+        t = _tokens.setdefault(op, {"llamadas": 0, "entrada": 0, "cacheados": 0, "salida": 0})
+        t["llamadas"] += 1
+        t["entrada"] += entrada
+        t["cacheados"] += cacheados
+        t["salida"] += salida
+
+
+class _StreamContado:
+    """Envuelve una respuesta en stream y registra sus tokens al terminar."""
+
+    def __init__(self, resp, op):
+        self._resp = resp
+        self._op = op
+
+    def __aiter__(self):
+        return self._iter()
+
+    async def _iter(self):
+        async for chunk in self._resp:
+            yield chunk
+        registrar_uso(self._resp, self._op)
+
+
+class ModeloGemini:
+    """
+    Sustituto de genai.GenerativeModel (generate_content / generate_content_async)
+    con `system_instruction` fija, en caché de contexto cuando se puede, y
+    conteo de tokens por llamada. El modelo real se crea en la primera llamada.
+    """
+
+    def __init__(self, nombre: str, system_instruction: str, op: str = "gemini", **kwargs):
+        self.nombre = nombre
+        self.op = op
+        self._instr = system_instruction
+        self._kwargs = kwargs          # generation_config, safety_settings
+        self._lock = threading.Lock()
+        self._modelo = None
+        self._vence = None             # epoch de renovación si usa caché de contexto
+
+    def _vigente(self) -> bool:
+        return self._modelo is not None and (self._vence is None or time.time() < self._vence)
+
+    def _crear(self):
+        if GEMINI_CONTEXT_CACHE and self.nombre not in _sin_cache:
+            try:
+                cache = genai.caching.CachedContent.create(
+                    model=self.nombre,
+                    system_instruction=self._instr,
+                    ttl=timedelta(seconds=GEMINI_CONTEXT_CACHE_TTL_S),
+                )
+                _caches.append(cache)
+                # Se renueva un minuto antes de que venza
+                self._vence = time.time() + max(60, GEMINI_CONTEXT_CACHE_TTL_S - 60)
+                print(f"[Gemini] 🧊 Caché de contexto para {self.nombre} ({self.op})")
+                return genai.GenerativeModel.from_cached_content(cache, **self._kwargs)
+            except Exception as e:
+                _sin_cache.add(self.nombre)
+                print(f"[Gemini] Caché de contexto no disponible para {self.nombre}, se usa "
+                      f"system_instruction: {e}")
+        self._vence = None
+        return genai.GenerativeModel(self.nombre, system_instruction=self._instr, **self._kwargs)
+
+    def _actual(self):
+        with self._lock:
+            if not self._vigente():
+                self._modelo = self._crear()
+            return self._modelo
+
+    def generate_content(self, contents, **kwargs):
+        resp = self._actual().generate_content(contents, **kwargs)
+        if not kwargs.get("stream"):
+            registrar_uso(resp, self.op)
+        return resp
+
+    async def generate_content_async(self, contents, **kwargs):
+        # Crear la caché de contexto es una llamada bloqueante: fuera del event loop
+        modelo = self._modelo if self._vigente() else await asyncio.to_thread(self._actual)
+        resp = await modelo.generate_content_async(contents, **kwargs)
+        if kwargs.get("stream"):
+            return _StreamContado(resp, self.op)
+        registrar_uso(resp, self.op)
+        return resp
+
+
+def tokens_stats() -> dict:
+    with _tokens_lock:
+        out = {}
+        for op, t in _tokens.items():
+            n = t["llamadas"] or 1
+            out[op] = {**t, "entrada_media": round(t["entrada"] / n, 1), "cacheados_media": round(t["cacheados"] / n, 1)}
+        return out
+
+
+def cerrar():
+    """Borra las cachés de contexto creadas (cobran almacenamiento mientras existan)."""
+    while _caches:
+        cache = _caches.pop()
+        try:
+            cache.delete()
+        except Exception as e:
+            print(f"[Gemini] ⚠️ No se pudo borrar la caché de contexto: {e}")
+
+
+metrics.register_collector("gemini_tokens", tokens_stats)
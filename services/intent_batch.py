@@ -0,0 +1,92 @@
+# services/intent_batch.py
+# Micro-lotes para interpret_user_message (opcional, INTENT_BATCH=1): junta las
+# peticiones que llegan dentro de una ventana corta y las resuelve con UNA
+# llamada al modelo que devuelve un comando por mensaje. El prompt fijo de
+# instrucciones (~1 KB) se envía una vez por lote en lugar de una por usuario.
+#
+# El lote se despacha al vencer la ventana o al llegar al tamaño máximo, lo
+# que ocurra primero. Textos repetidos dentro del mismo lote van una sola vez.
+import asyncio
+import os
+
+from services import metrics
+
+INTENT_BATCH = os.getenv("INTENT_BATCH", "0") == "1"
+INTENT_BATCH_WINDOW_MS = float(os.getenv("INTENT_BATCH_WINDOW_MS", "20"))
+INTENT_BATCH_MAX = int(os.getenv("INTENT_BATCH_MAX", "16"))
+
+_BUCKETS_LOTE = (1, 2, 4, 8, 16, 32, 64)
+
+
+class MicroBatcher:
+    """
+    `procesar(textos) -> lista de resultados` (mismo orden y largo) se llama una
+    vez por lote. `pedir(texto)` espera el resultado de su texto.
+    """
+
+    def __init__(self, procesar, ventana_ms: float = INTENT_BATCH_WINDOW_MS, max_lote: int = INTENT_BATCH_MAX):
+        self._procesar = procesar
+        self.ventana_s = max(0.0, ventana_ms) / 1000
+        self.max_lote = max(1, max_lote)
+        self._pend = {}        # clave -> (texto, Future)
+        self._timer = None
+        self._tareas = set()   # lotes en curso (el loop solo guarda referencias débiles)
+        self.lotes = 0
+        self.mensajes = 0
+        self.repetidos = 0
+
+    async def pedir(self, texto: str, clave=None):
+        clave = texto if clave is None else clave
+        hit = self._pend.get(clave)
+        if hit is not None:
+            fut = hit[1]
+            self.repetidos += 1
+        else:
+            fut = asyncio.get_running_loop().create_future()
+            self._pend[clave] = (texto, fut)
+            if len(self._pend) >= self.max_lote:
+                self._despachar()
+            elif self._timer is None:
+                self._timer = asyncio.get_running_loop().call_later(self.ventana_s, self._despachar)
+        # shield: si un usuario deja de esperar, el resto del lote sigue
+        return await asyncio.shield(fut)
+
+    def _despachar(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        lote, self._pend = self._pend, {}
+        if lote:
+            tarea = asyncio.ensure_future(self._correr(list(lote.values())))
+            self._tareas.add(tarea)
+            tarea.add_done_callback(self._tareas.discard)
+
+    async def _correr(self, lote):
+        self.lotes += 1
+        self.mensajes += len(lote)
+        metrics.observe("intent_lote_tamano", len(lote), buckets=_BUCKETS_LOTE)
+        try:
+            resultados = await self._procesar([texto for texto, _ in lote])
+        except asyncio.CancelledError:
+            for _, fut in lote:
+                fut.cancel()
+            raise
+        except Exception as e:
+            for _, fut in lote:
+                if not fut.done():
+                    fut.set_exception(e)
+                    fut.exception()   # leída aunque nadie quede esperando
+            return
+        for (_, fut), r in zip(lote, resultados):
+            if not fut.done():
+                fut.set_result(r)
+
+    def stats(self) -> dict:
+        return {
+            "lotes": self.lotes,
+            "mensajes": self.mensajes,
+            "repetidos": self.repetidos,
+            "tamano_medio": round(self.mensajes / self.lotes, 2) if self.lotes else 0.0,
+            "ventana_ms": self.ventana_s * 1000,
+            "max_lote": self.max_lote,
+        }
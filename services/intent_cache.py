@@ -0,0 +1,140 @@
+# services/intent_cache.py
+# Caché LRU + TTL de texto normalizado → comando ya sanitizado, delante de la
+# llamada a Gemini en interpret_user_message. Las frases típicas ("ver
+# carrito", "pagar", "agrega 2 jabones") se resuelven sin ir al modelo.
+#
+# INTENT_CACHE_PATH (opcional): archivo JSON para que sobreviva reinicios. Se
+# guarda desde un job periódico (INTENT_CACHE_SAVE_S) y al apagar, en un hilo:
+# put() nunca escribe a disco desde el event loop.
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from services import metrics
+from utils.text import _norm
+
+INTENT_CACHE_SIZE = int(os.getenv("INTENT_CACHE_SIZE", "2048"))
+INTENT_CACHE_TTL_S = float(os.getenv("INTENT_CACHE_TTL_S", "86400"))
+INTENT_CACHE_PATH = os.getenv("INTENT_CACHE_PATH", "")
+INTENT_CACHE_SAVE_S = float(os.getenv("INTENT_CACHE_SAVE_S", "60"))   # intervalo entre guardados
+
+
+class IntentCache:
+    def __init__(self, maxsize: int = INTENT_CACHE_SIZE, ttl_s: float = INTENT_CACHE_TTL_S,
+                 path: str = INTENT_CACHE_PATH):
+        self.maxsize = max(1, int(maxsize))
+        self.ttl_s = float(ttl_s)
+        self.path = path
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()   # clave -> (comando, expira epoch)
+        self._dirty = 0
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        if path:
+            self.load()
+
+    @staticmethod
+    def key(text: str) -> str:
+        return _norm(text)
+
+    def get(self, text: str):
+        """Comando cacheado para `text` o None."""
+        k = self.key(text)
+        now = time.time()
+        with self._lock:
+            hit = self._data.get(k)
+            if hit is not None and hit[1] <= now:
+                del self._data[k]
+                self.expired += 1
+                hit = None
+            if hit is None:
+                self.misses += 1
+                metrics.inc("intent_cache", resultado="miss")
+                return None
+            self._data.move_to_end(k)
+            self.hits += 1
+        metrics.inc("intent_cache", resultado="hit")
+        return hit[0]
+
+    def put(self, text: str, command: str):
+        k = self.key(text)
+        if not k or not command:
+            return
+        with self._lock:
+            self._data[k] = (command, time.time() + self.ttl_s)
+            self._data.move_to_end(k)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            self._dirty += 1
+
+    # ---------- persistencia ----------
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                rows = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"[INTENT] ⚠️ No se pudo leer {self.path}: {e}")
+            return
+        now = time.time()
+        with self._lock:
+            for k, cmd, exp in rows[-self.maxsize:]:
+                if exp > now:
+                    self._data[k] = (cmd, exp)
+
+    def save(self, solo_si_cambio: bool = False):
+        """Escribe el caché (del menos al más reciente) de forma atómica. Bloqueante."""
+        if not self.path or (solo_si_cambio and not self._dirty):
+            return
+        with self._lock:
+            rows = [[k, cmd, exp] for k, (cmd, exp) in self._data.items()]
+            self._dirty = 0
+        tmp = f"{self.path}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(rows, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            print(f"[INTENT] ⚠️ No se pudo guardar {self.path}: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "tamaño": len(self._data),
+            "aciertos": self.hits,
+            "fallos": self.misses,
+            "vencidos": self.expired,
+            "tasa_aciertos": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+_cache = IntentCache()
+metrics.register_collector("intent_cache", _cache.stats)
+
+
+def key(text: str) -> str:
+    return IntentCache.key(text)
+
+
+def get(text: str):
+    return _cache.get(text)
+
+
+def put(text: str, command: str):
+    _cache.put(text, command)
+
+
+def save(solo_si_cambio: bool = False):
+    _cache.save(solo_si_cambio)
+
+
+def stats() -> dict:
+    return _cache.stats()
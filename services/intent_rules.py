@@ -0,0 +1,162 @@
+# services/intent_rules.py
+# Intérprete por reglas (sin LLM) para los comandos de compra más comunes.
+# parse_intent devuelve (comando, confianza); interpret_user_message solo
+# llama a Gemini cuando la confianza queda por debajo de INTENT_RULES_MIN_CONF.
+import os
+import re
+from typing import Optional, Tuple
+
+from utils.text import _norm, _singularize_phrase_es, numeros_a_digitos, to_qty
+
+INTENT_RULES_MIN_CONF = float(os.getenv("INTENT_RULES_MIN_CONF", "0.8"))
+
+_ALLOWED = ("/productos", "/carrito", "/checkout", "/add", "/buscar")
+
+def _sanitize_command(s: str) -> str:
+    s = (s or "").strip().splitlines()[0].strip()
+    s = " ".join(s.split())
+    lower = s.lower()
+
+    if not lower:
+        return "/productos"
+
+    if lower.startswith("/add"):
+        # Aceptar: /add <id> <qty> | /add <nombre...> <qty>
+        # Y también variantes como: /add <qty> <nombre...> | "/add <qty> de <nombre...>"
+        tokens = lower.split()
+        args = tokens[1:]
+
+        # quitar stop-words típicas
+        stop = {"de", "del", "la", "el", "los", "las"}
+        args = [t for t in args if t not in stop]
+
+        if not args:
+            return "/productos"
+
+        # casos: qty primero o qty al final
+        qty = None
+        if args and args[-1].isdigit():
+            qty = int(args[-1]); name_or_id = args[:-1]
+        elif args and args[0].isdigit():
+            qty = int(args[0]); name_or_id = args[1:]
+        else:
+            # sin cantidad explícita
+            qty = 1; name_or_id = args
+
+        if not name_or_id:
+            return f"/add {qty} 1"  # fallback raro pero válido
+
+        # si es un único token y es número, tratamos como id
+        if len(name_or_id) == 1 and name_or_id[0].isdigit():
+            return f"/add {name_or_id[0]} {qty}"
+
+        # singulariza para mejorar el match con catálogo
+        nombre = " ".join(name_or_id)
+        try:
+            nombre = _singularize_phrase_es(nombre)
+            nombre = _norm(nombre)
+        except Exception:
+            pass
+        return f"/add {nombre} {qty}"
+
+    if lower.startswith("/buscar"):
+        parts = lower.split(maxsplit=1)
+        return parts[0] if len(parts) == 1 else f"/buscar {parts[1]}"
+
+    if any(lower.startswith(x) for x in ("/productos", "/carrito", "/checkout")):
+        return lower.split()[0]
+
+    return "/productos"
+
+
+# ---------- reglas ----------
+# Se evalúan sobre el texto normalizado (sin tildes, minúsculas) y con los
+# números escritos ya pasados a dígitos.
+_PUNT = re.compile(r"[¿?¡!.,;:]+")
+# Varios productos ("2 papel y 3 jabones", "2 papel, 3 jabones"). Se busca
+# antes de quitar la puntuación, que se lleva las comas.
+_VARIOS = re.compile(r"\d+\D+(\by\b|,)\s*\d+")
+
+_CHECKOUT = re.compile(
+    r"\b(pagar|checkout|finalizar( la)? compra|confirmar( el)? pedido|confirmar compra|realizar compra|hacer pago)\b"
+)
+# "no quiero pagar todavía", "¿puedo pagar con tarjeta?": mencionan el pago
+# sin pedirlo; quedan con confianza baja y los decide el LLM
+_NEGACION = re.compile(r"\b(no|nunca|todavia no|aun no|despues|luego|mas tarde)\b")
+_PREGUNTA = re.compile(
+    r"[¿?]|^(puedo|se puede|como|cuando|donde|cuanto|aceptan|reciben|con que|que|hay que)\b"
+)
+_CARRITO = re.compile(r"^(mi )?carrito$|\b(ver|mostrar|muestra|muestrame|mirar|revisar)( mi| el)? carrito\b")
+_PRODUCTOS = re.compile(
+    r"^(el )?(catalogo|productos)$"
+    r"|\b(ver|mostrar|muestra|muestrame|ensename|mira[r]?)( el| los| tu| tus)? (catalogo|productos)\b"
+    r"|\bque (productos )?(tienen|venden|hay)$"
+)
+_BUSCAR = re.compile(r"^(buscar|busca|busco|buscame|/buscar)\s+(.+)$")
+_TIENEN = re.compile(r"^(tienen|tiene|hay|venden)\s+(.+)$")
+_AGREGAR = re.compile(
+    r"^(?:por favor\s+)?(agrega|agregar|agregame|agregue|anade|anadir|anademe|pon|ponme|dame|deme|"
+    r"quiero|quisiera|necesito|compra|comprar|mete|metele|sumale|/add)\s+(.+)$"
+)
+_RELLENO = re.compile(r"\s+(por favor|porfa|porfavor|gracias)$")
+_ARTICULOS = {"de", "del", "la", "el", "los", "las", "unos", "unas", "al", "carrito", "mi", "me"}
+
+
+def _limpiar_nombre(palabras):
+    out = [w for w in palabras if w not in _ARTICULOS]
+    return " ".join(out).strip()
+
+
+def _parse_add(resto: str) -> Tuple[Optional[str], float]:
+    """'<qty> <nombre>' o '<nombre> <qty>' → /add. La confianza baja si falta cantidad."""
+    palabras = resto.split()
+    qty, conf = 1, 0.75
+    if palabras and re.fullmatch(r"x?\d+x?", palabras[0]):
+        qty, palabras, conf = to_qty(palabras[0]), palabras[1:], 0.9
+    elif palabras and re.fullmatch(r"x?\d+x?", palabras[-1]):
+        qty, palabras, conf = to_qty(palabras[-1]), palabras[:-1], 0.9
+    nombre = _limpiar_nombre(palabras)
+    if len(nombre) < 2 or any(ch.isdigit() for ch in nombre.replace(" ", "")[:1]):
+        return None, 0.2
+    # "quiero ver ...", "quiero saber ..." no son pedidos
+    if palabras and palabras[0] in {"ver", "saber", "preguntar", "mirar", "pagar", "comprar"}:
+        return None, 0.2
+    return _sanitize_command(f"/add {nombre} {qty}"), conf
+
+
+def parse_intent(text: str) -> Tuple[Optional[str], float]:
+    """
+    Interpreta el mensaje sin LLM. Devuelve (comando sanitizado, confianza 0..1)
+    o (None, 0.0) si ninguna regla aplica.
+    """
+    base = numeros_a_digitos(_norm(text))
+    t = _PUNT.sub(" ", base)
+    t = _RELLENO.sub("", " ".join(t.split()))
+    if not t:
+        return None, 0.0
+
+    if _CHECKOUT.search(t):
+        if _NEGACION.search(t) or _PREGUNTA.search(base):
+            return "/checkout", 0.4
+        return "/checkout", 0.95
+    if _CARRITO.search(t):
+        return "/carrito", 0.95
+    if _PRODUCTOS.search(t):
+        return "/productos", 0.9
+
+    m = _BUSCAR.match(t)
+    if m:
+        return _sanitize_command(f"/buscar {m.group(2)}"), 0.9
+    m = _TIENEN.match(t)
+    if m:
+        # "¿tienen jabón?" suele ser búsqueda, pero puede ser conversación
+        return _sanitize_command(f"/buscar {m.group(2)}"), 0.7
+
+    m = _AGREGAR.match(t)
+    if m:
+        # varios productos: lo resuelve el parser multi-producto o el LLM
+        if _VARIOS.search(base):
+            return None, 0.3
+        return _parse_add(m.group(2))
+
+    return None, 0.0
@@ -1,18 +1,45 @@
 import os
 
+from services import llm_client
+from domain.state import chats
+
 USE_OLLAMA = os.getenv("USE_OLLAMA", "0") == "1"
 
 if USE_OLLAMA:
     import ollama
 
-def chat(prompt):
+
+def _mensajes(prompt, chat_id):
+    # Sin prompt explícito se usa el historial del chat (audio/foto lo van llenando)
+    if prompt:
+        return [{"role": "user", "content": prompt}]
+    return list(chats[chat_id])
+
+
+async def chat(prompt=None, chat_id=None, temperature=None) -> str:
+    """
+    Respuesta de texto del LLM configurado (Ollama local o Gemini), sin bloquear
+    el event loop. Con `chat_id`, un mensaje más nuevo del mismo chat cancela la
+    llamada en curso (lanza llm_client.LLMSuperseded).
+    """
+    messages = _mensajes(prompt, chat_id)
     if USE_OLLAMA:
         # Modo local con Ollama
-        return ollama.chat(model=os.getenv("MODEL"), messages=[{"role": "user", "content": prompt}])
+        options = {"temperature": temperature} if temperature is not None else None
+        resp = await llm_client.run_blocking(
+            ollama.chat, model=os.getenv("MODEL"), messages=messages, options=options,
+            chat_id=chat_id, op="ollama",
+        )
+        return (resp["message"]["content"] or "").strip()
     else:
         # Modo remoto (Render) usando Gemini
         import google.generativeai as genai
         genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
         model = genai.GenerativeModel(os.getenv("GEMINI_MODEL", "gemini-1.5-flash"))
-        response = model.generate_content(prompt)
-        return {"message": response.text}
+        contents = [
+            {"role": "model" if m["role"] == "assistant" else "user", "parts": [m["content"]]}
+            for m in messages
+        ]
+        cfg = {"temperature": temperature} if temperature is not None else None
+        response = await llm_client.generate(model, contents, chat_id=chat_id, op="llm", generation_config=cfg)
+        return response.text.strip()
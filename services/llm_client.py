@@ -0,0 +1,237 @@
+# services/llm_client.py
+# Capa asíncrona común para todas las llamadas a LLM (gemini.py,
+# gemini_chat.py, llm.py):
+#   - generate_content_async del SDK (o un executor acotado si no existe)
+#   - plazo máximo por llamada (LLM_TIMEOUT_S)
+#   - límite de llamadas simultáneas (LLM_CONCURRENCY)
+#   - por chat: un mensaje nuevo cancela la llamada en curso del anterior
+import asyncio
+import contextvars
+import functools
+import os
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from services import metrics
+from utils.text import _SIN_MARCAS
+
+LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "20"))
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
+
+_executor = ThreadPoolExecutor(max_workers=max(1, LLM_CONCURRENCY), thread_name_prefix="llm")
+_sem = None
+_inflight = {}                     # chat_id -> Task de la llamada en curso
+_superseded = weakref.WeakSet()    # tareas canceladas por un mensaje más nuevo
+_plazo = contextvars.ContextVar("llm_plazo", default=None)   # loop.time() en que vence la llamada
+
+
+class LLMSuperseded(Exception):
+    """La llamada se canceló porque llegó un mensaje más nuevo del mismo chat."""
+
+
+def _semaphore() -> asyncio.Semaphore:
+    global _sem
+    if _sem is None:
+        _sem = asyncio.Semaphore(max(1, LLM_CONCURRENCY))
+    return _sem
+
+
+def cancel_chat(chat_id) -> bool:
+    """Cancela la llamada en curso de `chat_id` (si hay). Devuelve True si canceló algo."""
+    task = _inflight.get(chat_id)
+    if task is None or task.done():
+        return False
+    _superseded.add(task)
+    task.cancel()
+    metrics.inc("llm_superseded")
+    return True
+
+
+async def _limitado(factory, timeout, op):
+    """`await factory()` con semáforo, plazo y métricas."""
+    async def run():
+        async with _semaphore():
+            t0 = time.perf_counter()
+            try:
+                return await factory()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                metrics.inc("llm_errors", op=op, error=type(e).__name__)
+                raise
+            finally:
+                metrics.observe("llm_call_ms", (time.perf_counter() - t0) * 1000, op=op)
+
+    timeout = timeout or LLM_TIMEOUT_S
+    token = _plazo.set(asyncio.get_running_loop().time() + timeout)
+    try:
+        return await asyncio.wait_for(run(), timeout)
+    except asyncio.TimeoutError:
+        metrics.inc("llm_timeouts", op=op)
+        raise
+    finally:
+        _plazo.reset(token)
+
+
+def plazo_vencido() -> bool:
+    """Dentro de una llamada: True si ya venció su plazo (una cancelación es por timeout)."""
+    plazo = _plazo.get()
+    return plazo is not None and asyncio.get_running_loop().time() >= plazo - 0.01
+
+
+async def _por_chat(aw, chat_id):
+    """Espera `aw` registrándolo como la llamada en curso de `chat_id`."""
+    task = asyncio.ensure_future(aw)
+    if chat_id is None:
+        return await task
+    cancel_chat(chat_id)
+    _inflight[chat_id] = task
+    try:
+        return await task
+    except asyncio.CancelledError:
+        if task in _superseded:
+            raise LLMSuperseded() from None
+        raise
+    finally:
+        if _inflight.get(chat_id) is task:
+            del _inflight[chat_id]
+
+
+async def esperar_por_chat(aw, chat_id=None):
+    """
+    Espera un awaitable ya armado (p. ej. un lote compartido) como la llamada
+    en curso de `chat_id`: un mensaje más nuevo del chat lo cancela con
+    LLMSuperseded. No aplica semáforo ni plazo; eso queda a cargo de quien lo
+    arma.
+    """
+    return await _por_chat(aw, chat_id)
+
+
+async def call(factory, *, chat_id=None, timeout: float = None, op: str = "llm", clave=None):
+    """
+    Ejecuta `await factory()` con semáforo, plazo y cancelación por chat.
+    Lanza asyncio.TimeoutError si vence el plazo y LLMSuperseded si un mensaje
+    más nuevo del mismo chat la reemplazó. Con `clave`, las llamadas
+    simultáneas con la misma clave comparten una sola (single_flight).
+    """
+    if clave is not None:
+        return await single_flight(clave, factory, chat_id=chat_id, timeout=timeout, op=op)
+    return await _por_chat(_limitado(factory, timeout, op), chat_id)
+
+
+# ---------- single-flight ----------
+# Peticiones idénticas simultáneas (difusiones, promos: "pagar", "ver productos")
+# esperan la misma llamada en vuelo en lugar de lanzar una cada una. La llamada
+# compartida no pertenece a ningún chat: cancelar a un usuario solo lo saca de
+# la espera; si ya no queda nadie esperando, se cancela.
+class _Vuelo:
+    __slots__ = ("task", "esperando")
+
+    def __init__(self, task):
+        self.task = task
+        self.esperando = 0
+
+
+_vuelos = {}           # clave -> _Vuelo
+_sf = {"llamadas": 0, "compartidas": 0}
+
+
+async def single_flight(clave, factory, *, chat_id=None, timeout: float = None, op: str = "llm"):
+    vuelo = _vuelos.get(clave)
+    if vuelo is None:
+        vuelo = _vuelos[clave] = _Vuelo(asyncio.ensure_future(_limitado(factory, timeout, op)))
+
+        def _fin(t, clave=clave, vuelo=vuelo):
+            if _vuelos.get(clave) is vuelo:
+                del _vuelos[clave]
+            if not t.cancelled():
+                t.exception()   # marcada como leída aunque nadie quede esperando
+        vuelo.task.add_done_callback(_fin)
+        _sf["llamadas"] += 1
+        metrics.inc("llm_single_flight", resultado="llamada", op=op)
+    else:
+        _sf["compartidas"] += 1
+        metrics.inc("llm_single_flight", resultado="compartida", op=op)
+
+    vuelo.esperando += 1
+    try:
+        return await _por_chat(asyncio.shield(vuelo.task), chat_id)
+    finally:
+        vuelo.esperando -= 1
+        if vuelo.esperando == 0 and not vuelo.task.done():
+            vuelo.task.cancel()
+
+
+async def run_blocking(fn, *args, chat_id=None, timeout: float = None, op: str = "llm", clave=None, **kwargs):
+    """Para clientes sin API asíncrona (ollama, sondeo de modelos): corre fn en el executor acotado."""
+    loop = asyncio.get_running_loop()
+    return await call(
+        lambda: loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs)),
+        chat_id=chat_id, timeout=timeout, op=op, clave=clave,
+    )
+
+
+async def generate(model, prompt, *, chat_id=None, timeout: float = None, op: str = "gemini", clave=None, **kwargs):
+    """model.generate_content sin bloquear el event loop."""
+    agen = getattr(model, "generate_content_async", None)
+    if agen is not None:
+        return await call(lambda: agen(prompt, **kwargs), chat_id=chat_id, timeout=timeout, op=op, clave=clave)
+    return await run_blocking(model.generate_content, prompt, chat_id=chat_id, timeout=timeout, op=op,
+                              clave=clave, **kwargs)
+
+
+async def stream(model, prompt, on_texto, *, chat_id=None, timeout: float = None, op: str = "gemini", **kwargs) -> str:
+    """
+    generate_content en modo stream: llama `await on_texto(acumulado)` con cada
+    fragmento y devuelve el texto completo. Mismo plazo, semáforo y cancelación
+    por chat que generate (el plazo cubre la respuesta entera): on_texto corre
+    dentro de ambos, así que debe ser rápida (guardar el texto y que otra
+    tarea lo muestre).
+    """
+    async def consumir():
+        agen = getattr(model, "generate_content_async", None)
+        if agen is None:
+            resp = await asyncio.get_running_loop().run_in_executor(
+                _executor, functools.partial(model.generate_content, prompt, **kwargs))
+            await on_texto(resp.text)
+            return resp.text
+        t0 = time.perf_counter()
+        resp = await agen(prompt, stream=True, **kwargs)
+        partes = []
+        async for chunk in resp:
+            try:
+                t = chunk.text
+            except ValueError:   # fragmento sin partes de texto (p. ej. solo finish_reason)
+                continue
+            if not t:
+                continue
+            if not partes:
+                metrics.observe("llm_ttft_ms", (time.perf_counter() - t0) * 1000, op=op)
+            partes.append(t)
+            await on_texto("".join(partes))
+        return "".join(partes)
+
+    return await call(consumir, chat_id=chat_id, timeout=timeout, op=op)
+
+
+def clave_prompt(modelo: str, prompt: str, *extra) -> tuple:
+    """Clave de single-flight: modelo + prompt normalizado (+ lo que distinga la respuesta)."""
+    return (modelo, *extra, " ".join(str(prompt).translate(_SIN_MARCAS).lower().split()))
+
+
+def stats() -> dict:
+    total = _sf["llamadas"] + _sf["compartidas"]
+    return {
+        "en_curso": sum(1 for t in _inflight.values() if not t.done()),
+        "concurrencia_max": LLM_CONCURRENCY,
+        "timeout_s": LLM_TIMEOUT_S,
+        "single_flight": {
+            **_sf,
+            "en_vuelo": len(_vuelos),
+            "ahorro": round(_sf["compartidas"] / total, 4) if total else 0.0,
+        },
+    }
+
+
+metrics.register_collector("llm", stats)
@@ -0,0 +1,202 @@
+# services/llm_router.py
+# Enrutador en tiempo de ejecución sobre una lista de modelos (en orden de
+# preferencia):
+#   - circuit breaker por modelo: tras LLM_CB_FALLAS errores seguidos se deja de
+#     usar durante LLM_CB_RESET_S; luego pasa una sola petición de prueba
+#     (semiabierto) y, si responde, vuelve al uso normal
+#   - hedging: si el modelo principal no respondió dentro de su p90 reciente,
+#     se lanza la misma petición al siguiente modelo y gana la primera respuesta
+#   - failover: si un modelo falla se pasa de inmediato al siguiente
+# El plazo total, el semáforo y la cancelación por chat los pone llm_client.
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+
+from services import llm_client, metrics
+
+LLM_CB_FALLAS = int(os.getenv("LLM_CB_FALLAS", "3"))
+LLM_CB_RESET_S = float(os.getenv("LLM_CB_RESET_S", "30"))
+LLM_HEDGE = os.getenv("LLM_HEDGE", "1") == "1"
+LLM_HEDGE_DEFAULT_MS = float(os.getenv("LLM_HEDGE_DEFAULT_MS", "2000"))   # hasta tener muestras
+LLM_HEDGE_MIN_MS = float(os.getenv("LLM_HEDGE_MIN_MS", "250"))
+LLM_HEDGE_MUESTRAS = 20     # mínimo de latencias antes de confiar en el p90
+_VENTANA = 200              # latencias recientes por modelo
+
+
+class SinModelos(RuntimeError):
+    """Todos los modelos tienen el circuito abierto."""
+
+
+class CircuitBreaker:
+    """cerrado → (N fallos) → abierto → (reset_s) → semiabierto → cerrado | abierto."""
+
+    def __init__(self, fallas: int = LLM_CB_FALLAS, reset_s: float = LLM_CB_RESET_S):
+        self.fallas = max(1, fallas)
+        self.reset_s = reset_s
+        self._lock = threading.Lock()
+        self.estado = "cerrado"
+        self.seguidos = 0
+        self.abierto_en = 0.0
+        self._prueba = False      # hay una petición de prueba en curso (semiabierto)
+        self.aperturas = 0
+
+    def permite(self) -> bool:
+        with self._lock:
+            if self.estado == "cerrado":
+                return True
+            if self.estado == "abierto" and time.monotonic() - self.abierto_en >= self.reset_s:
+                self.estado = "semiabierto"
+            if self.estado == "semiabierto" and not self._prueba:
+                self._prueba = True
+                return True
+            return False
+
+    def exito(self):
+        with self._lock:
+            self.estado, self.seguidos, self._prueba = "cerrado", 0, False
+
+    def fallo(self):
+        with self._lock:
+            self.seguidos += 1
+            self._prueba = False
+            if self.estado == "semiabierto" or self.seguidos >= self.fallas:
+                if self.estado != "abierto":
+                    self.aperturas += 1
+                self.estado, self.abierto_en = "abierto", time.monotonic()
+
+    def liberar(self):
+        """La petición de prueba se canceló antes del plazo sin resultado: otra podrá intentarlo."""
+        with self._lock:
+            self._prueba = False
+
+
+class ModelRouter:
+    def __init__(self, nombres, build):
+        self.nombres = [n for n in dict.fromkeys(nombres) if n]
+        self._build = build
+        self._modelos = {}
+        self.breakers = {n: CircuitBreaker() for n in self.nombres}
+        self._lat = {n: deque(maxlen=_VENTANA) for n in self.nombres}
+        self.hedges = 0
+        self.hedges_ganados = 0
+        self.failovers = 0
+
+    def _modelo(self, nombre):
+        m = self._modelos.get(nombre)
+        if m is None:
+            m = self._modelos[nombre] = self._build(nombre)
+        return m
+
+    def p90_ms(self, nombre) -> float:
+        lat = sorted(self._lat[nombre])
+        if len(lat) < LLM_HEDGE_MUESTRAS:
+            return LLM_HEDGE_DEFAULT_MS
+        return max(LLM_HEDGE_MIN_MS, lat[int(len(lat) * 0.9) - 1])
+
+    def _orden(self, preferido=None):
+        if preferido in self.breakers:
+            return [preferido] + [n for n in self.nombres if n != preferido]
+        return list(self.nombres)
+
+    async def _una(self, nombre, prompt, kwargs):
+        br = self.breakers[nombre]
+        model = self._modelo(nombre)
+        t0 = time.perf_counter()
+        try:
+            agen = getattr(model, "generate_content_async", None)
+            if agen is not None:
+                resp = await agen(prompt, **kwargs)
+            else:
+                resp = await asyncio.to_thread(model.generate_content, prompt, **kwargs)
+        except asyncio.CancelledError:
+            if llm_client.plazo_vencido():
+                # Colgado hasta el plazo: cuenta como fallo del modelo
+                br.fallo()
+                metrics.inc("llm_modelo_timeouts", modelo=nombre)
+            else:
+                # Ganó la petición de cobertura (o el usuario mandó otro mensaje)
+                br.liberar()
+            raise
+        except Exception:
+            br.fallo()
+            metrics.inc("llm_modelo_errores", modelo=nombre)
+            raise
+        ms = (time.perf_counter() - t0) * 1000
+        self._lat[nombre].append(ms)
+        metrics.observe("llm_modelo_ms", ms, modelo=nombre)
+        br.exito()
+        return resp
+
+    async def _hedged(self, prompt, preferido, kwargs):
+        pendientes = self._orden(preferido)
+        tareas = {}          # Task -> nombre del modelo
+        last_err = None
+
+        def lanzar():
+            # Siguiente modelo con el circuito cerrado (o con turno de prueba)
+            while pendientes:
+                n = pendientes.pop(0)
+                if self.breakers[n].permite():
+                    tareas[asyncio.ensure_future(self._una(n, prompt, kwargs))] = n
+                    return n
+            return None
+
+        principal = lanzar()
+        if principal is None:
+            metrics.inc("llm_sin_modelos")
+            raise SinModelos("Todos los modelos tienen el circuito abierto")
+        espera = self.p90_ms(principal) / 1000 if LLM_HEDGE else None
+        cobertura = False
+        try:
+            while tareas:
+                done, _ = await asyncio.wait(tareas, timeout=espera, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # El principal va más lento que su p90: petición de cobertura
+                    espera = None
+                    if lanzar():
+                        cobertura = True
+                        self.hedges += 1
+                        metrics.inc("llm_hedge", modelo=principal)
+                    continue
+                for t in done:
+                    nombre = tareas.pop(t)
+                    if t.exception() is None:
+                        if nombre != principal and cobertura:
+                            self.hedges_ganados += 1
+                            metrics.inc("llm_hedge_ganado", modelo=nombre)
+                        return t.result(), nombre
+                    last_err = t.exception()
+                    print(f"[ROUTER] ⚠️ {nombre} falló: {last_err}")
+                if not tareas and lanzar():   # failover inmediato
+                    self.failovers += 1
+                    metrics.inc("llm_failover")
+            raise last_err or RuntimeError("Sin respuesta de ningún modelo")
+        finally:
+            for t in tareas:
+                t.cancel()
+
+    async def generate(self, prompt, *, preferido=None, chat_id=None, timeout: float = None,
+                       op: str = "gemini", clave=None, **kwargs):
+        """Devuelve (respuesta, nombre del modelo que respondió)."""
+        return await llm_client.call(
+            lambda: self._hedged(prompt, preferido, kwargs),
+            chat_id=chat_id, timeout=timeout, op=op, clave=clave,
+        )
+
+    def stats(self) -> dict:
+        return {
+            "modelos": {
+                n: {
+                    "estado": self.breakers[n].estado,
+                    "aperturas": self.breakers[n].aperturas,
+                    "p90_ms": round(self.p90_ms(n), 1),
+                    "muestras": len(self._lat[n]),
+                }
+                for n in self.nombres
+            },
+            "hedges": self.hedges,
+            "hedges_ganados": self.hedges_ganados,
+            "failovers": self.failovers,
+        }
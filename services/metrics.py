@@ -0,0 +1,153 @@
+# services/metrics.py
+# Métricas en proceso: histogramas de latencia y contadores con etiquetas.
+# Se exportan como dict (snapshot), texto estilo Prometheus (render) o JSON (dump).
+#
+#   with metrics.timer("dbx_execute_ms", op="search_products"):
+#       cur.execute(...)
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+METRICS_PATH = os.getenv("METRICS_PATH", "")          # si se define, un job vuelca ahí el JSON
+METRICS_DUMP_S = float(os.getenv("METRICS_DUMP_S", "60"))
+
+# Cubetas en ms, aprox. logarítmicas: de 1 ms a 2 min
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 120000)
+BUCKETS_ROWS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "count", "sum", "max")
+
+    def __init__(self, buckets=BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)   # la última es +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, v: float):
+        self.counts[bisect_left(self.buckets, v)] += 1
+        self.count += 1
+        self.sum += v
+        if v > self.max:
+            self.max = v
+
+    def quantile(self, q: float) -> float:
+        """Aproximación por cubetas: límite superior de la cubeta que contiene el cuantil."""
+        if not self.count:
+            return 0.0
+        rank, acc = q * self.count, 0
+        for i, n in enumerate(self.counts):
+            acc += n
+            if acc >= rank:
+                return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+        return self.max
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 3),
+            "avg": round(self.sum / (self.count or 1), 3),
+            "max": round(self.max, 3),
+            "p50": round(self.quantile(0.50), 3),
+            "p90": round(self.quantile(0.90), 3),
+            "p99": round(self.quantile(0.99), 3),
+        }
+
+
+_lock = threading.Lock()
+_hists = {}        # (nombre, etiquetas) -> Histogram
+_counters = {}     # (nombre, etiquetas) -> int
+_collectors = {}   # nombre -> fn() -> dict  (stats de pool, catálogo, outbox...)
+
+
+def _key(name: str, labels: dict):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _fmt(key) -> str:
+    name, labels = key
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+def observe(name: str, value: float, buckets=BUCKETS_MS, **labels):
+    key = _key(name, labels)
+    with _lock:
+        h = _hists.get(key)
+        if h is None:
+            h = _hists[key] = Histogram(buckets)
+        h.observe(float(value))
+
+
+def inc(name: str, n: int = 1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + n
+
+
+@contextmanager
+def timer(name: str, **labels):
+    """Mide en ms el bloque `with` (también si termina con excepción)."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, (time.perf_counter() - t0) * 1000, **labels)
+
+
+def register_collector(name: str, fn):
+    """Registra una función que devuelve un dict de stats para incluir en la exportación."""
+    _collectors[name] = fn
+
+
+def snapshot() -> dict:
+    with _lock:
+        hists = {_fmt(k): h.snapshot() for k, h in sorted(_hists.items())}
+        counters = {_fmt(k): v for k, v in sorted(_counters.items())}
+    collected = {}
+    for name, fn in list(_collectors.items()):
+        try:
+            collected[name] = fn()
+        except Exception as e:
+            collected[name] = {"error": str(e)}
+    return {"ts": time.time(), "histogramas": hists, "contadores": counters, "colectores": collected}
+
+
+def render() -> str:
+    """Exposición en texto estilo Prometheus (histogramas y contadores)."""
+    lines = []
+    with _lock:
+        for (name, labels), h in sorted(_hists.items()):
+            acc = 0
+            for bound, n in zip(list(h.buckets) + ["+Inf"], h.counts):
+                acc += n
+                lines.append(f"{_fmt((name + '_bucket', labels + (('le', str(bound)),)))} {acc}")
+            lines.append(f"{_fmt((name + '_sum', labels))} {h.sum:.3f}")
+            lines.append(f"{_fmt((name + '_count', labels))} {h.count}")
+        for key, v in sorted(_counters.items()):
+            lines.append(f"{_fmt(key)} {v}")
+    return "\n".join(lines) + "\n"
+
+
+def dump(path: str = None) -> str:
+    """Escribe el snapshot en JSON de forma atómica. Devuelve la ruta."""
+    path = path or METRICS_PATH
+    if not path:
+        return ""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(snapshot(), f, ensure_ascii=False, indent=2, default=str)
+    os.replace(tmp, path)
+    return path
+
+
+def reset():
+    with _lock:
+        _hists.clear()
+        _counters.clear()
@@ -0,0 +1,271 @@
+# services/outbox.py
+# Outbox local y durable de pedidos (SQLite en modo WAL).
+# El checkout confirma al usuario apenas el pedido queda escrito aquí; un job
+# del JobQueue lo envía después a Databricks en lotes, con reintentos.
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from services import metrics
+
+OUTBOX_PATH = os.getenv("OUTBOX_PATH", "outbox.sqlite3")
+OUTBOX_ENABLED = os.getenv("OUTBOX_ENABLED", "1") == "1"
+OUTBOX_FLUSH_S = float(os.getenv("OUTBOX_FLUSH_S", "5"))
+OUTBOX_BATCH = int(os.getenv("OUTBOX_BATCH", "50"))
+OUTBOX_MAX_INTENTOS = int(os.getenv("OUTBOX_MAX_INTENTOS", "10"))
+OUTBOX_BACKOFF_MAX_S = float(os.getenv("OUTBOX_BACKOFF_MAX_S", "600"))
+
+# pendiente → stock_ok → enviado   |   pendiente → rechazado (sin stock)
+# pendiente | stock_ok → fallido (agotó OUTBOX_MAX_INTENTOS; requiere revisión manual)
+# Tras cada intento fallido se espera un backoff exponencial (proximo_intento).
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id            INTEGER PRIMARY KEY AUTOINCREMENT,
+    idem_key      TEXT NOT NULL UNIQUE,
+    chat_id       INTEGER NOT NULL,
+    user_name     TEXT,
+    cart          TEXT NOT NULL,
+    pedido        TEXT NOT NULL,
+    estado        TEXT NOT NULL DEFAULT 'pendiente',
+    intentos      INTEGER NOT NULL DEFAULT 0,
+    ultimo_error  TEXT,
+    fallos        TEXT,
+    proximo_intento REAL,
+    created_at    REAL NOT NULL,
+    updated_at    REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_outbox_estado ON outbox (estado, id);
+"""
+
+
+class Outbox:
+    def __init__(self, path: str = OUTBOX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL")  # la confirmación al usuario debe sobrevivir un corte
+        self._db.executescript(_SCHEMA)
+        try:
+            # outbox creado antes de proximo_intento
+            self._db.execute("ALTER TABLE outbox ADD COLUMN proximo_intento REAL")
+        except sqlite3.OperationalError as e:
+            if "duplicate column" not in str(e).lower():
+                raise
+
+        self.flushes = 0
+        self.sent = 0
+        self.rejected = 0
+        self.errors = 0
+        self.dead = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._flush_total_ms = 0.0
+
+    # ---------- escritura ----------
+    def enqueue(self, chat_id: int, user_name: str, cart: dict, pedido: dict) -> str:
+        """Guarda el pedido de forma durable. Devuelve su idempotency_key."""
+        now = time.time()
+        key = pedido["idempotency_key"]
+        with self._lock:
+            self._db.execute(
+                "INSERT OR IGNORE INTO outbox (idem_key, chat_id, user_name, cart, pedido, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, int(chat_id), user_name, json.dumps({str(k): int(v) for k, v in cart.items()}),
+                 json.dumps(pedido, ensure_ascii=False), now, now),
+            )
+        return key
+
+    def mark(self, ids, estado: str, fallos=None):
+        ids = list(ids)
+        if not ids:
+            return
+        marks = ", ".join("?" for _ in ids)
+        with self._lock:
+            self._db.execute(
+                f"UPDATE outbox SET estado = ?, fallos = ?, ultimo_error = NULL, updated_at = ? WHERE id IN ({marks})",
+                (estado, json.dumps(fallos) if fallos else None, time.time(), *ids),
+            )
+
+    def fail(self, ids, error: str) -> list:
+        """
+        Registra un intento fallido: el pedido queda en su estado y se reintenta
+        tras un backoff exponencial. Devuelve los ids que agotaron
+        OUTBOX_MAX_INTENTOS y pasaron a 'fallido'.
+        """
+        ids = list(ids)
+        if not ids:
+            return []
+        marks = ", ".join("?" for _ in ids)
+        now = time.time()
+        muertos = []
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                rows = self._db.execute(f"SELECT id, intentos FROM outbox WHERE id IN ({marks})", ids).fetchall()
+                for oid, intentos in rows:
+                    intentos += 1
+                    if intentos >= OUTBOX_MAX_INTENTOS:
+                        muertos.append(oid)
+                    espera = min(OUTBOX_BACKOFF_MAX_S, OUTBOX_FLUSH_S * 2 ** (intentos - 1))
+                    self._db.execute(
+                        "UPDATE outbox SET intentos = ?, ultimo_error = ?, proximo_intento = ?, updated_at = ?, "
+                        "estado = CASE WHEN ? THEN 'fallido' ELSE estado END WHERE id = ?",
+                        (intentos, str(error)[:500], now + espera, now, oid in muertos, oid),
+                    )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return muertos
+
+    # ---------- lectura ----------
+    def pending(self, limit: int = OUTBOX_BATCH, en_espera: bool = False) -> list:
+        """
+        [(id, idem_key, chat_id, user_name, cart, pedido, estado)] en orden de
+        llegada. Con en_espera=False omite los que aún esperan su backoff.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, idem_key, chat_id, user_name, cart, pedido, estado FROM outbox "
+                "WHERE estado IN ('pendiente', 'stock_ok') "
+                "AND (? OR proximo_intento IS NULL OR proximo_intento <= ?) ORDER BY id LIMIT ?",
+                (en_espera, time.time(), int(limit)),
+            ).fetchall()
+        return [
+            (i, k, chat, name, {int(p): q for p, q in json.loads(cart).items()}, json.loads(pedido), estado)
+            for i, k, chat, name, cart, pedido, estado in rows
+        ]
+
+    def depth(self) -> int:
+        with self._lock:
+            return self._db.execute(
+                "SELECT count(*) FROM outbox WHERE estado IN ('pendiente', 'stock_ok')"
+            ).fetchone()[0]
+
+    def record_flush(self, ms: float):
+        self.flushes += 1
+        self.last_flush_ms = ms
+        self.max_flush_ms = max(self.max_flush_ms, ms)
+        self._flush_total_ms += ms
+
+    def stats(self) -> dict:
+        return {
+            "profundidad": self.depth(),
+            "flushes": self.flushes,
+            "enviados": self.sent,
+            "rechazados": self.rejected,
+            "errores": self.errors,
+            "fallidos": self.dead,
+            "flush_ultimo_ms": round(self.last_flush_ms, 2),
+            "flush_avg_ms": round(self._flush_total_ms / (self.flushes or 1), 2),
+            "flush_max_ms": round(self.max_flush_ms, 2),
+        }
+
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+
+def get_outbox() -> Outbox:
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = Outbox()
+        return _outbox
+
+
+def enqueue(chat_id: int, user_name: str, cart: dict, pedido: dict) -> str:
+    return get_outbox().enqueue(chat_id, user_name, cart, pedido)
+
+
+def flush(batch: int = OUTBOX_BATCH) -> list:
+    """
+    Envía a Databricks un lote del outbox:
+      1) descuenta stock por pedido (MERGE todo-o-nada, idempotente por
+         idempotency_key: si el proceso cae antes de marcarlo stock_ok, el
+         reintento no vuelve a descontar)
+      2) inserta todos los pedidos con stock aplicado en un solo MERGE idempotente
+
+    Un pedido que falla se reintenta con backoff exponencial; al llegar a
+    OUTBOX_MAX_INTENTOS pasa a 'fallido', se alerta y se libera su reserva.
+
+    Devuelve [(chat_id, pedido, fallos)] de los pedidos rechazados por falta de
+    stock, para avisarle al usuario.
+    """
+    from services import dbx, reservations
+
+    ob = get_outbox()
+    ledger = reservations.get_ledger()
+    rows = ob.pending(batch)
+    if not rows:
+        return []
+
+    t0 = time.perf_counter()
+    rechazados = []
+    listos = []
+    por_id = {oid: (key, cart, estado) for oid, key, _, _, cart, _, estado in rows}
+
+    def fallar(ids, error):
+        # Agotó los intentos: sale de la cola y queda para revisión manual
+        for oid in ob.fail(ids, error):
+            key, cart, estado = por_id[oid]
+            ob.dead += 1
+            metrics.inc("outbox_fallidos", estado=estado)
+            print(f"[OUTBOX] 🚨 Pedido {key} descartado tras {OUTBOX_MAX_INTENTOS} intentos "
+                  f"(estado {estado}): {error}")
+            if estado == "pendiente":
+                ledger.cancel(cart)
+
+    for oid, key, chat_id, user_name, cart, pedido, estado in rows:
+        if estado == "stock_ok":
+            listos.append((oid, pedido))
+            continue
+        try:
+            ok, fallos = dbx.apply_stock(cart, clave=key)
+        except Exception as e:
+            print(f"[OUTBOX] ❌ Error descontando stock de {key}: {e}")
+            ob.errors += 1
+            fallar([oid], e)
+            continue
+        if ok:
+            # Se persiste antes del INSERT: el reintento ya no pasa por el descuento
+            ob.mark([oid], "stock_ok")
+            ledger.settle(cart)
+            listos.append((oid, pedido))
+        elif fallos:
+            ob.mark([oid], "rechazado", fallos=fallos)
+            ledger.cancel(cart)
+            ob.rejected += 1
+            rechazados.append((chat_id, pedido, fallos))
+        else:
+            ob.errors += 1
+            fallar([oid], "MERGE de stock sin efecto")
+
+    enviados = 0
+    if listos:
+        try:
+            dbx.save_order_payloads([p for _, p in listos])
+            ob.mark([oid for oid, _ in listos], "enviado")
+            enviados = len(listos)
+            ob.sent += enviados
+        except Exception as e:
+            print(f"[OUTBOX] ❌ Error insertando {len(listos)} pedidos: {e}")
+            ob.errors += 1
+            fallar([oid for oid, _ in listos], e)
+
+    ms = (time.perf_counter() - t0) * 1000
+    ob.record_flush(ms)
+    metrics.observe("outbox_flush_ms", ms)
+    print(f"[OUTBOX] enviados={enviados} rechazados={len(rechazados)} pendientes={ob.depth()}")
+    return rechazados
+
+
+def stats() -> dict:
+    return get_outbox().stats()
+
+
+if OUTBOX_ENABLED:
+    metrics.register_collector("outbox", stats)
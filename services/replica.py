@@ -0,0 +1,288 @@
+# services/replica.py
+# Réplica local (SQLite) de v_productos para DBX_BACKEND=sqlite.
+#
+# - Con credenciales de Databricks: se sincroniza periódicamente desde el
+#   warehouse (incremental por updated_at) y el bot lee siempre de aquí, así
+#   sigue respondiendo el catálogo aunque el warehouse esté caído.
+# - Sin credenciales (modo offline): es la base completa; stock y pedidos se
+#   escriben aquí. Sirve para desarrollo local y benchmarks.
+#
+# Uso: python -m services.replica --demo     (crea la réplica con productos de ejemplo)
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+DBX_REPLICA_PATH = os.getenv("DBX_REPLICA_PATH", "catalogo_replica.sqlite3")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS v_productos (
+    inventario_id     INTEGER PRIMARY KEY,
+    nombre            TEXT NOT NULL,
+    descripcion       TEXT,
+    categoria         TEXT,
+    precio_cop        INTEGER NOT NULL,
+    stock             INTEGER NOT NULL DEFAULT 0,
+    updated_at        TEXT,
+    nombre_norm       TEXT,
+    descripcion_norm  TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_v_productos_updated ON v_productos (updated_at);
+
+CREATE TABLE IF NOT EXISTS pedidos (
+    id               INTEGER PRIMARY KEY AUTOINCREMENT,
+    cliente_id       INTEGER NOT NULL,
+    estado           TEXT,
+    total_cop        INTEGER,
+    items            TEXT,
+    notas            TEXT,
+    idempotency_key  TEXT UNIQUE,
+    created_at       TEXT
+);
+
+-- pedidos del outbox cuyo stock ya se descontó (idempotencia de apply_stock)
+CREATE TABLE IF NOT EXISTS stock_aplicado (
+    idempotency_key  TEXT PRIMARY KEY,
+    created_at       TEXT
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    clave  TEXT PRIMARY KEY,
+    valor  TEXT
+);
+"""
+
+_COLS = "inventario_id, nombre, descripcion, categoria, precio_cop, stock, updated_at, nombre_norm, descripcion_norm"
+
+_DEMO = [
+    (1, "Papel higiénico 4 rollos", "Papel doble hoja suave", "Aseo", 12000, 30),
+    (2, "Shampoo 400 ml", "Shampoo para uso diario", "Aseo personal", 18000, 25),
+    (3, "Jabón de baño 90 g", "Jabón en barra neutro", "Aseo personal", 3500, 50),
+    (4, "Toallas de mano (par)", "Toallas 100% algodón", "Hogar", 22000, 15),
+]
+
+
+def _ts(v) -> str:
+    """Timestamps como texto ISO comparable lexicográficamente."""
+    if v is None:
+        return None
+    if isinstance(v, datetime):
+        return v.strftime("%Y-%m-%d %H:%M:%S.%f")
+    return str(v)
+
+
+def _now() -> str:
+    return _ts(datetime.utcnow())
+
+
+class Replica:
+    def __init__(self, path: str = DBX_REPLICA_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        self._last_full = 0.0
+        self.syncs = 0
+        self.last_sync_ms = 0.0
+
+    # ---------- meta ----------
+    def _get_meta(self, clave: str):
+        row = self._db.execute("SELECT valor FROM meta WHERE clave = ?", (clave,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, clave: str, valor):
+        self._db.execute("INSERT OR REPLACE INTO meta (clave, valor) VALUES (?, ?)", (clave, valor))
+
+    # ---------- sincronización desde Databricks ----------
+    def sync(self, fetch_remote, full_every_s: float = 3600.0) -> int:
+        """
+        Trae de Databricks las filas modificadas desde la última marca de agua
+        (o todo, si toca recarga completa) y las guarda en un solo commit.
+        """
+        t0 = time.perf_counter()
+        with self._lock:
+            watermark = self._get_meta("watermark")
+        full = watermark is None or time.monotonic() - self._last_full >= full_every_s
+        rows = list(fetch_remote(None if full else watermark))
+
+        data = []
+        nuevo = None if full else watermark
+        for r in rows:
+            r = tuple(r) + (None,) * (9 - len(r))
+            ts = _ts(r[6])
+            data.append((int(r[0]), r[1] or "", r[2], r[3], int(r[4] or 0), int(r[5] or 0), ts, r[7], r[8]))
+            if ts is not None and (nuevo is None or ts > nuevo):
+                nuevo = ts
+
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                if full:
+                    self._db.execute("DELETE FROM v_productos")
+                self._db.executemany(
+                    f"INSERT OR REPLACE INTO v_productos ({_COLS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", data
+                )
+                self._set_meta("watermark", nuevo)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        if full:
+            self._last_full = time.monotonic()
+        self.syncs += 1
+        self.last_sync_ms = (time.perf_counter() - t0) * 1000
+        return len(rows)
+
+    # ---------- lecturas ----------
+    def fetch(self, since=None) -> list:
+        """Misma forma que dbx._fetch_catalog: alimenta el snapshot en memoria."""
+        query = f"SELECT {_COLS} FROM v_productos"
+        params = ()
+        if since is not None:
+            query += " WHERE updated_at >= ?"
+            params = (_ts(since),)
+        with self._lock:
+            return self._db.execute(query, params).fetchall()
+
+    def fetch_products(self, pids) -> dict:
+        ids = sorted({int(p) for p in pids})
+        if not ids:
+            return {}
+        marks = ", ".join("?" for _ in ids)
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT inventario_id, nombre, precio_cop, stock FROM v_productos WHERE inventario_id IN ({marks})",
+                ids,
+            ).fetchall()
+        return {int(r[0]): tuple(r) for r in rows}
+
+    # ---------- escrituras (modo offline) ----------
+    def _apply_stock_locked(self, cart: dict):
+        """Descuenta el carrito si alcanza el stock. Devuelve los fallos (vacío si descontó)."""
+        ids = sorted(cart)
+        marks = ", ".join("?" for _ in ids)
+        stock = dict(self._db.execute(
+            f"SELECT inventario_id, stock FROM v_productos WHERE inventario_id IN ({marks})", ids
+        ).fetchall())
+        fallos = [(pid, qty, int(stock.get(pid) or 0)) for pid, qty in cart.items() if int(stock.get(pid) or 0) < qty]
+        if fallos:
+            return fallos
+        now = _now()
+        self._db.executemany(
+            "UPDATE v_productos SET stock = stock - ?, updated_at = ? WHERE inventario_id = ?",
+            [(qty, now, pid) for pid, qty in cart.items()],
+        )
+        return []
+
+    def _insert_orders_locked(self, pedidos: list) -> int:
+        self._db.executemany(
+            "INSERT OR IGNORE INTO pedidos (cliente_id, estado, total_cop, items, notas, idempotency_key, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (p["cliente_id"], p["estado"], p["total_cop"], json.dumps(p["items"], ensure_ascii=False),
+                 p["notas"], p.get("idempotency_key"), p.get("created_at") or _now())
+                for p in pedidos
+            ],
+        )
+        return len(pedidos)
+
+    def _tx(self, fn, *args):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                out = fn(*args)
+                self._db.execute("COMMIT")
+                return out
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def apply_stock(self, cart: dict, clave: str = None):
+        """
+        Descuenta todo el carrito o nada. Con `clave` (idempotency_key) la
+        registra en la misma transacción y no repite un descuento ya hecho.
+        Devuelve (ok, fallos, repetido).
+        """
+        def _run():
+            if clave is not None and self._db.execute(
+                "SELECT 1 FROM stock_aplicado WHERE idempotency_key = ?", (clave,)
+            ).fetchone():
+                return None
+            fallos = self._apply_stock_locked(cart)
+            if not fallos and clave is not None:
+                self._db.execute("INSERT INTO stock_aplicado (idempotency_key, created_at) VALUES (?, ?)",
+                                 (clave, _now()))
+            return fallos
+        fallos = self._tx(_run)
+        if fallos is None:
+            return True, [], True
+        return not fallos, fallos, False
+
+    def insert_orders(self, pedidos: list) -> int:
+        if not pedidos:
+            return 0
+        return self._tx(self._insert_orders_locked, pedidos)
+
+    def checkout(self, cart: dict, pedido: dict):
+        """Stock + pedido en una sola transacción SQLite."""
+        def _run():
+            fallos = self._apply_stock_locked(cart)
+            if fallos:
+                return fallos
+            self._insert_orders_locked([pedido])
+            return []
+        fallos = self._tx(_run)
+        return not fallos, fallos
+
+    # ---------- utilidades ----------
+    def seed_demo(self):
+        from utils.text import search_columns
+
+        now = _now()
+        rows = []
+        for pid, nombre, desc, cat, precio, stock in _DEMO:
+            nombre_norm, desc_norm, _ = search_columns(nombre, desc)
+            rows.append((pid, nombre, desc, cat, precio, stock, now, nombre_norm, desc_norm))
+        with self._lock:
+            self._db.executemany(
+                f"INSERT OR REPLACE INTO v_productos ({_COLS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+        return len(rows)
+
+    def stats(self) -> dict:
+        with self._lock:
+            n = self._db.execute("SELECT count(*) FROM v_productos").fetchone()[0]
+            watermark = self._get_meta("watermark")
+        return {
+            "productos": n,
+            "syncs": self.syncs,
+            "ultimo_sync_ms": round(self.last_sync_ms, 2),
+            "watermark": watermark,
+        }
+
+
+_replica = None
+_replica_lock = threading.Lock()
+
+
+def get_replica() -> Replica:
+    global _replica
+    with _replica_lock:
+        if _replica is None:
+            _replica = Replica()
+        return _replica
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Réplica SQLite del catálogo")
+    ap.add_argument("--demo", action="store_true", help="carga productos de ejemplo (modo offline)")
+    args = ap.parse_args()
+    rep = get_replica()
+    if args.demo:
+        print(f"→ {rep.seed_demo()} productos de ejemplo en {rep.path}")
+    print(rep.stats())
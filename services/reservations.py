@@ -0,0 +1,197 @@
+# services/reservations.py
+# Libro de reservas de stock en memoria, por inventario_id.
+#
+# disponible(pid) = stock del snapshot
+#                 - unidades confirmadas en checkout que aún no se descontaron en la base
+#                 - reservas vigentes de otros carritos
+#
+# /add reserva (con TTL) sin ir a la base; el checkout convierte las reservas
+# del carrito en "pendientes" y el envío a Databricks las liquida.
+import asyncio
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+from services import metrics
+
+RESERVA_TTL_S = float(os.getenv("RESERVA_TTL_S", "1800"))
+
+
+class ReservationLedger:
+    def __init__(self, stock_of: Callable[[int], int], ttl_s: float = RESERVA_TTL_S):
+        self._stock_of = stock_of
+        self.ttl_s = float(ttl_s)
+        self._lock = threading.Lock()
+        self._res: Dict[int, Dict[int, Tuple[int, float]]] = {}   # pid -> {chat_id: (qty, expira)}
+        self._pend: Dict[int, int] = {}                            # pid -> unidades confirmadas sin aplicar
+        self.rechazos = 0
+
+    # ---------- internos (con lock tomado) ----------
+    def _vigentes(self, pid: int, now: float) -> Dict[int, Tuple[int, float]]:
+        res = self._res.get(pid)
+        if not res:
+            return {}
+        vencidas = [c for c, (_, exp) in res.items() if exp <= now]
+        for c in vencidas:
+            del res[c]
+        if not res:
+            self._res.pop(pid, None)
+        return res
+
+    def _libre(self, pid: int, chat_id: int, now: float) -> int:
+        """Unidades que este chat puede tener en total para pid."""
+        otros = sum(q for c, (q, _) in self._vigentes(pid, now).items() if c != chat_id)
+        return int(self._stock_of(pid) or 0) - self._pend.get(pid, 0) - otros
+
+    # ---------- API ----------
+    def available(self, pid: int, chat_id: int = None) -> int:
+        with self._lock:
+            return max(0, self._libre(int(pid), chat_id, time.monotonic()))
+
+    def reserve(self, chat_id: int, pid: int, qty: int):
+        """
+        Suma qty a la reserva del chat. Devuelve (ok, disponible) donde disponible
+        es lo que aún puede agregar este chat.
+        """
+        pid, qty = int(pid), int(qty)
+        now = time.monotonic()
+        with self._lock:
+            res = self._vigentes(pid, now)
+            propia = res.get(chat_id, (0, 0))[0]
+            libre = self._libre(pid, chat_id, now)
+            if propia + qty > libre:
+                self.rechazos += 1
+                return False, max(0, libre - propia)
+            self._res.setdefault(pid, {})[chat_id] = (propia + qty, now + self.ttl_s)
+            return True, libre - propia - qty
+
+    def release(self, chat_id: int, pids=None):
+        """Libera las reservas del chat (todas o solo las de `pids`)."""
+        with self._lock:
+            for pid in list(self._res) if pids is None else [int(p) for p in pids]:
+                res = self._res.get(pid)
+                if res and chat_id in res:
+                    del res[chat_id]
+                    if not res:
+                        del self._res[pid]
+
+    def commit(self, chat_id: int, cart: dict) -> List[Tuple[int, int, int]]:
+        """
+        Reconciliación en el checkout: verifica todas las líneas contra lo
+        disponible (las reservas pueden haber vencido) y, si todas alcanzan,
+        las pasa a pendientes. Devuelve fallos [(pid, pedido, disponible)];
+        si hay fallos no cambia nada.
+        """
+        now = time.monotonic()
+        with self._lock:
+            fallos = []
+            for pid, qty in cart.items():
+                libre = self._libre(int(pid), chat_id, now)
+                if int(qty) > libre:
+                    fallos.append((int(pid), int(qty), max(0, libre)))
+            if fallos:
+                self.rechazos += 1
+                return fallos
+            for pid, qty in cart.items():
+                pid = int(pid)
+                self._pend[pid] = self._pend.get(pid, 0) + int(qty)
+                res = self._res.get(pid)
+                if res:
+                    res.pop(chat_id, None)
+                    if not res:
+                        del self._res[pid]
+            return []
+
+    def _restar_pend(self, cart: dict):
+        with self._lock:
+            for pid, qty in cart.items():
+                pid = int(pid)
+                left = self._pend.get(pid, 0) - int(qty)
+                if left > 0:
+                    self._pend[pid] = left
+                else:
+                    self._pend.pop(pid, None)
+
+    def settle(self, cart: dict):
+        """El stock ya se descontó en la base (y en el snapshot): deja de contarse como pendiente."""
+        self._restar_pend(cart)
+
+    def cancel(self, cart: dict):
+        """El pedido confirmado no se pudo aplicar: devuelve las unidades."""
+        self._restar_pend(cart)
+
+    def add_pending(self, cart: dict):
+        """Registra pendientes que ya estaban en el outbox (al arrancar)."""
+        with self._lock:
+            for pid, qty in cart.items():
+                self._pend[int(pid)] = self._pend.get(int(pid), 0) + int(qty)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            activas = [q for pid in list(self._res) for (q, _) in self._vigentes(pid, now).values()]
+            return {
+                "reservas": len(activas),
+                "unidades_reservadas": sum(activas),
+                "unidades_pendientes": sum(self._pend.values()),
+                "rechazos": self.rechazos,
+            }
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_ledger() -> ReservationLedger:
+    """Libro global, sembrado desde el snapshot del catálogo y los pedidos del outbox sin enviar."""
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            from services import dbx, outbox
+
+            def stock_of(pid):
+                row = dbx.get_product(pid)
+                return row[3] if row else 0
+
+            ledger = ReservationLedger(stock_of)
+            if outbox.OUTBOX_ENABLED:
+                for _, _, _, _, cart, _, estado in outbox.get_outbox().pending(limit=1_000_000, en_espera=True):
+                    if estado == "pendiente":
+                        ledger.add_pending(cart)
+            _ledger = ledger
+        return _ledger
+
+
+# ---------- API asíncrona (handlers) ----------
+# Con el libro creado y el snapshot cargado todo es en memoria. Si no, la
+# primera llamada abre el outbox (SQLite) y stock_of puede disparar una carga
+# bloqueante del catálogo: se corre en un hilo, fuera del event loop.
+async def _en_memoria(fn):
+    from services import dbx
+    if _ledger is not None and dbx.catalog_loaded():
+        return fn()
+    return await asyncio.to_thread(fn)
+
+
+async def areserve(chat_id: int, pid: int, qty: int):
+    return await _en_memoria(lambda: get_ledger().reserve(chat_id, pid, qty))
+
+
+async def arelease(chat_id: int, pids=None):
+    return await _en_memoria(lambda: get_ledger().release(chat_id, pids))
+
+
+async def acommit(chat_id: int, cart: dict):
+    return await _en_memoria(lambda: get_ledger().commit(chat_id, cart))
+
+
+async def asettle(cart: dict):
+    return await _en_memoria(lambda: get_ledger().settle(cart))
+
+
+async def acancel(cart: dict):
+    return await _en_memoria(lambda: get_ledger().cancel(cart))
+
+
+metrics.register_collector("reservas", lambda: _ledger.stats() if _ledger else {})
@@ -0,0 +1,217 @@
+# services/search_index.py
+# Índice invertido de trigramas sobre el catálogo normalizado y singularizado.
+# Reemplaza la cascada de LIKE '%q%' de search_products / find_best_by_name.
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from utils.text import _norm, _singularize_phrase_es, _singularize_token_es
+
+_SEP = "\n"  # separa nombre y descripción para que un trigrama no cruce de campo
+
+
+def _trigrams(s: str) -> Set[str]:
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+def _sing(norm: str) -> str:
+    # el texto ya viene normalizado: solo se singulariza token a token
+    return " ".join(_singularize_token_es(t) for t in norm.split())
+
+
+class _Doc:
+    __slots__ = ("id", "nombre_len", "raw", "norm", "nombre_norm", "sing")
+
+    def __init__(self, p):
+        self.id = p.id
+        self.nombre_len = len(p.nombre)
+        self.raw = p.nombre.lower() + _SEP + p.descripcion.lower()
+        self.norm = p.nombre_norm + _SEP + p.desc_norm
+        self.nombre_norm = p.nombre_norm
+        # singularización aplicada al indexar: "luces" también indexa "luz"
+        self.sing = _sing(p.nombre_norm) + _SEP + _sing(p.desc_norm)
+
+
+class SearchIndex:
+    """
+    Índice en memoria del catálogo:
+      - trigramas sobre el texto normalizado y singularizado → candidatos de subcadena
+      - verificación exacta `q in texto` (misma semántica que LIKE '%q%')
+
+    Documentos y trigramas se publican juntos en una sola asignación
+    (copy-on-write, como CatalogSnapshot): cada consulta toma el estado una vez
+    y nunca ve un trigrama de un producto que todavía no está en los documentos.
+    """
+
+    def __init__(self):
+        # (docs, tri): id -> _Doc, trigrama -> frozenset de ids
+        self._estado = ({}, {})
+
+    # ---------- construcción ----------
+    @staticmethod
+    def _grams(d: _Doc) -> Set[str]:
+        return _trigrams(d.norm) | _trigrams(d.sing)
+
+    def rebuild(self, productos: Iterable):
+        docs, tri = {}, {}
+        for p in productos:
+            d = _Doc(p)
+            docs[d.id] = d
+            for g in self._grams(d):
+                ids = tri.get(g)
+                if ids is None:
+                    tri[g] = [d.id]
+                else:
+                    ids.append(d.id)
+        self._estado = (docs, {g: frozenset(ids) for g, ids in tri.items()})
+
+    def upsert(self, p):
+        self.upsert_many([p])
+
+    def upsert_many(self, productos: Iterable):
+        """Agrega o actualiza productos sobre copias y las publica de una vez."""
+        productos = list(productos)
+        if not productos:
+            return
+        docs, tri = self._estado
+        docs, tri = dict(docs), dict(tri)
+        for p in productos:
+            new = _Doc(p)
+            old = docs.get(new.id)
+            old_grams = self._grams(old) if old else set()
+            new_grams = self._grams(new)
+            for g in old_grams - new_grams:
+                ids = tri.get(g, frozenset()) - {new.id}
+                if ids:
+                    tri[g] = ids
+                else:
+                    tri.pop(g, None)
+            for g in new_grams - old_grams:
+                tri[g] = tri.get(g, frozenset()) | {new.id}
+            docs[new.id] = new
+        self._estado = (docs, tri)
+
+    # ---------- consulta ----------
+    @staticmethod
+    def _candidates(estado, q: str):
+        """Ids que podrían contener q (todos sus trigramas presentes). Sin verificar."""
+        docs, tri = estado
+        if len(q) < 3:
+            return docs.keys()
+        sets = []
+        for g in _trigrams(q):
+            ids = tri.get(g)
+            if not ids:
+                return ()
+            sets.append(ids)
+        sets.sort(key=len)
+        return sets[0].intersection(*sets[1:])
+
+    @staticmethod
+    def _contains(d: _Doc, q: str) -> bool:
+        return q in d.norm or q in d.sing
+
+    def _containing(self, estado, q: str) -> Set[int]:
+        """Ids cuyo texto normalizado o singularizado contiene q."""
+        docs = estado[0]
+        return {pid for pid in self._candidates(estado, q) if self._contains(docs[pid], q)}
+
+    def search(self, q: str, limit: int, available: Callable[[int], bool]) -> List[int]:
+        """
+        Resuelve en una pasada los tres niveles de la búsqueda original:
+          1) subcadena en minúsculas tal cual (con acentos)
+          2) subcadena sin acentos
+          3) frase singularizada
+        Devuelve ids ordenados por inventario_id.
+        """
+        q_lower = (q or "").lower()
+        q_norm = _norm(q)
+        q_sing = _singularize_phrase_es(q)
+        estado = self._estado
+        docs = estado[0]
+
+        # Recorre en orden de id y corta en cuanto el nivel 1 completa `limit`
+        tier1, tier2 = [], []
+        for pid in sorted(self._candidates(estado, q_norm)):
+            d = docs[pid]
+            if not (self._contains(d, q_norm) and available(pid)):
+                continue
+            if q_lower in d.raw:
+                tier1.append(pid)
+                if len(tier1) >= limit:
+                    break
+            elif len(tier2) < limit:
+                tier2.append(pid)
+        if tier1:
+            return tier1
+        if tier2:
+            return tier2
+
+        if q_sing and q_sing != q_norm:
+            out = []
+            for pid in sorted(self._candidates(estado, q_sing)):
+                if self._contains(docs[pid], q_sing) and available(pid):
+                    out.append(pid)
+                    if len(out) >= limit:
+                        break
+            return out
+        return []
+
+    def best_match(self, term: str, available: Callable[[int], bool]) -> Optional[int]:
+        return self.best_matches([term], available)[0]
+
+    def best_matches(self, terms: List[str], available: Callable[[int], bool]) -> List[Optional[int]]:
+        """
+        Mejor producto para cada nombre libre: candidatos que contienen algún
+        token (normal o singular), los 15 de nombre más corto, y gana el que
+        tenga más tokens en el nombre.
+
+        Los tokens repetidos entre términos se buscan una sola vez.
+        """
+        estado = self._estado
+        docs = estado[0]
+        memo: Dict[str, Set[int]] = {}
+
+        def containing(t: str) -> Set[int]:
+            ids = memo.get(t)
+            if ids is None:
+                ids = memo[t] = self._containing(estado, t)
+            return ids
+
+        out: List[Optional[int]] = []
+        for term in terms:
+            if not term or len(term.strip()) < 2:
+                out.append(None)
+                continue
+
+            term_norm = _norm(term)
+            term_sing = _singularize_phrase_es(term_norm)
+
+            tokens = []
+            for t in term_norm.split() + term_sing.split():
+                if len(t) > 1 and t not in tokens:
+                    tokens.append(t)
+
+            if not tokens:
+                cand = containing(term_sing or term_norm)
+            else:
+                cand = set()
+                for t in tokens:
+                    cand |= containing(t)
+
+            rows = sorted(
+                (docs[pid] for pid in cand if available(pid)),
+                key=lambda d: (d.nombre_len, d.id),
+            )[:15]
+            if not rows:
+                out.append(None)
+                continue
+            if not tokens:
+                out.append(rows[0].id)
+                continue
+
+            best, score = None, -1
+            for d in rows:
+                s = sum(1 for w in tokens if w in d.nombre_norm)
+                if s > score:
+                    best, score = d, s
+            out.append(best.id)
+        return out
@@ -0,0 +1,62 @@
+# tests/test_catalog.py
+from services.catalog import CatalogSnapshot
+
+
+def _fila(pid, stock, nombre=None, updated_at=None):
+    return (pid, nombre or f"Producto {pid}", "", "Aseo", 1000, stock, updated_at)
+
+
+class _Base:
+    """Base simulada: fetch(since) devuelve las filas y puede correr algo a mitad de la lectura."""
+
+    def __init__(self, stock):
+        self.stock = dict(stock)
+        self.durante_fetch = None
+
+    def fetch(self, since):
+        filas = [_fila(pid, s) for pid, s in self.stock.items()]
+        if self.durante_fetch:
+            accion, self.durante_fetch = self.durante_fetch, None
+            accion()
+        return filas
+
+
+def test_refresh_completo_e_incremental():
+    filas = [_fila(1, 5, updated_at=1), _fila(2, 0, updated_at=1)]
+    snap = CatalogSnapshot(lambda since: filas if since is None else [_fila(2, 4, "Jabón", updated_at=2)])
+    assert snap.refresh() == 2
+    assert [p.id for p in snap.in_stock()] == [1]
+    assert snap.refresh() == 1
+    assert snap.get(2).stock == 4 and snap.get(2).nombre_norm == "jabon"
+    assert [p.id for p in snap.in_stock()] == [1, 2]
+
+
+def test_adjust_stock_durante_refresh_no_se_pierde():
+    base = _Base({1: 10, 2: 3})
+    snap = CatalogSnapshot(base.fetch)
+    snap.refresh(full=True)
+
+    def venta():
+        # venta confirmada en la base mientras el refresco ya leyó las filas
+        base.stock[1] -= 2
+        snap.adjust_stock(1, -2)
+
+    base.durante_fetch = venta
+    snap.refresh(full=True)
+    assert snap.get(1).stock == 8
+    snap.refresh(full=True)
+    assert snap.get(1).stock == 8 == base.stock[1]
+
+
+def test_adjust_stock_no_se_reaplica_si_la_lectura_ya_lo_incluye():
+    base = _Base({1: 10})
+    snap = CatalogSnapshot(base.fetch)
+    snap.refresh(full=True)
+
+    def venta_antes_de_leer():
+        snap.adjust_stock(1, -2)
+
+    base.stock[1] = 8   # la lectura ya trae el stock descontado
+    base.durante_fetch = venta_antes_de_leer
+    snap.refresh(full=True)
+    assert snap.get(1).stock == 8
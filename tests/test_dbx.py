@@ -0,0 +1,17 @@
+# tests/test_dbx.py
+from services import dbx
+
+
+class _CursorSinUso:
+    def execute(self, *args, **kwargs):
+        raise AssertionError("no debe llegar SQL al warehouse")
+
+
+def test_checkout_sin_lineas_positivas_no_consulta(monkeypatch):
+    monkeypatch.setattr(dbx, "_query", lambda op: (_ for _ in ()).throw(AssertionError("sin conexión")))
+    assert dbx.checkout_order(1, "Ana", {1: 0, 2: -3}) == (False, [])
+    assert dbx.checkout_order(1, "Ana", {}) == (False, [])
+
+
+def test_merge_stock_con_carrito_vacio_no_arma_values():
+    assert dbx._merge_stock(_CursorSinUso(), {1: 0}, signo=-1, guard=True) == 0
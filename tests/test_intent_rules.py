@@ -0,0 +1,39 @@
+# tests/test_intent_rules.py
+import pytest
+
+from services.intent_rules import INTENT_RULES_MIN_CONF, parse_intent
+
+
+@pytest.mark.parametrize("texto, comando", [
+    ("pagar", "/checkout"),
+    ("Quiero finalizar la compra!", "/checkout"),
+    ("ver carrito", "/carrito"),
+    ("muéstrame el catálogo", "/productos"),
+    ("buscar shampoo", "/buscar shampoo"),
+    ("agrega 2 jabones", "/add jabon 2"),
+    ("dame dos jabones, por favor", "/add jabon 2"),
+    ("agrega jabón x3", "/add jabon 3"),
+])
+def test_reglas_con_confianza_alta(texto, comando):
+    cmd, conf = parse_intent(texto)
+    assert cmd == comando
+    assert conf >= INTENT_RULES_MIN_CONF
+
+
+@pytest.mark.parametrize("texto", [
+    "agrega 2 papel, 3 jabones",
+    "quiero 2 papel y 3 jabones",
+    "no quiero pagar todavía",
+    "¿puedo pagar con tarjeta?",
+    "quiero saber el horario",
+    "hola, cómo estás",
+])
+def test_casos_dudosos_van_al_llm(texto):
+    _, conf = parse_intent(texto)
+    assert conf < INTENT_RULES_MIN_CONF
+
+
+def test_sin_cantidad_baja_la_confianza():
+    cmd, conf = parse_intent("agrega jabón")
+    assert cmd == "/add jabon 1"
+    assert conf < INTENT_RULES_MIN_CONF
@@ -0,0 +1,101 @@
+# tests/test_outbox.py
+# flush() contra la réplica SQLite en modo offline (sin Databricks).
+import pytest
+
+from services import dbx, outbox, replica, reservations
+from services.outbox import Outbox
+from services.replica import Replica
+from services.reservations import ReservationLedger
+
+
+def _pedido(clave, cart):
+    return {
+        "cliente_id": 1, "estado": "confirmado", "total_cop": 1000 * sum(cart.values()),
+        "items": [{"inventario_id": pid, "cantidad": q, "precio_cop": 1000, "nombre": f"#{pid}"}
+                  for pid, q in cart.items()],
+        "notas": "", "idempotency_key": clave, "created_at": None,
+    }
+
+
+@pytest.fixture
+def base(tmp_path, monkeypatch):
+    rep = Replica(str(tmp_path / "replica.sqlite3"))
+    rep.seed_demo()
+    monkeypatch.setattr(dbx, "_OFFLINE", True)
+    monkeypatch.setattr(replica, "_replica", rep)
+    monkeypatch.setattr(outbox, "_outbox", Outbox(str(tmp_path / "outbox.sqlite3")))
+    monkeypatch.setattr(reservations, "_ledger", ReservationLedger(lambda pid: 100))
+    return rep
+
+
+def _stock(rep, pid):
+    return rep.fetch_products([pid])[pid][3]
+
+
+def _pedidos(rep):
+    return rep._db.execute("SELECT count(*) FROM pedidos").fetchone()[0]
+
+
+def test_flush_envia_y_no_repite(base):
+    inicial = _stock(base, 1)
+    outbox.enqueue(1, "Ana", {1: 2}, _pedido("k1", {1: 2}))
+    assert outbox.flush() == []
+    assert outbox.flush() == []
+    assert _stock(base, 1) == inicial - 2
+    assert _pedidos(base) == 1
+    assert outbox.get_outbox().depth() == 0
+
+
+def test_caida_entre_descuento_y_marca_no_descuenta_dos_veces(base, monkeypatch):
+    inicial = _stock(base, 1)
+    outbox.enqueue(1, "Ana", {1: 2}, _pedido("k1", {1: 2}))
+
+    mark = Outbox.mark
+
+    def caida(self, ids, estado, fallos=None):
+        if estado == "stock_ok":
+            raise RuntimeError("proceso caído")
+        return mark(self, ids, estado, fallos)
+
+    monkeypatch.setattr(Outbox, "mark", caida)
+    with pytest.raises(RuntimeError):
+        outbox.flush()
+    assert _stock(base, 1) == inicial - 2
+
+    monkeypatch.setattr(Outbox, "mark", mark)
+    assert outbox.flush() == []
+    assert _stock(base, 1) == inicial - 2
+    assert _pedidos(base) == 1
+
+
+def test_sin_stock_se_rechaza(base):
+    inicial = _stock(base, 1)
+    outbox.enqueue(7, "Ana", {1: inicial + 1}, _pedido("k2", {1: inicial + 1}))
+    rechazados = outbox.flush()
+    assert [chat for chat, _, _ in rechazados] == [7]
+    assert _stock(base, 1) == inicial
+    assert outbox.get_outbox().depth() == 0
+
+
+def test_fallo_persistente_pasa_a_fallido(base, monkeypatch):
+    monkeypatch.setattr(outbox, "OUTBOX_MAX_INTENTOS", 3)
+
+    def caido(cart, clave=None):
+        raise RuntimeError("warehouse caído")
+
+    monkeypatch.setattr(dbx, "apply_stock", caido)
+    ob = outbox.get_outbox()
+    outbox.enqueue(1, "Ana", {1: 2}, _pedido("k3", {1: 2}))
+
+    assert outbox.flush() == []
+    assert ob.pending() == []  # esperando el backoff
+    assert ob.depth() == 1
+
+    monkeypatch.setattr(outbox, "OUTBOX_FLUSH_S", 0)
+    ob._db.execute("UPDATE outbox SET proximo_intento = NULL")
+    outbox.flush()
+    outbox.flush()
+    assert ob.depth() == 0
+    assert ob.stats()["fallidos"] == 1
+    estado, intentos = ob._db.execute("SELECT estado, intentos FROM outbox").fetchone()
+    assert (estado, intentos) == ("fallido", 3)
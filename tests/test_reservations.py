@@ -0,0 +1,57 @@
+# tests/test_reservations.py
+import types
+
+import pytest
+
+from services import reservations
+from services.reservations import ReservationLedger
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    ahora = [1000.0]
+    monkeypatch.setattr(reservations, "time", types.SimpleNamespace(monotonic=lambda: ahora[0]))
+    return ahora
+
+
+def test_reserve_no_deja_llevarse_la_ultima_unidad_dos_veces(reloj):
+    ledger = ReservationLedger(lambda pid: 3, ttl_s=60)
+    assert ledger.reserve(chat_id=1, pid=7, qty=2) == (True, 1)
+    assert ledger.reserve(chat_id=2, pid=7, qty=2) == (False, 1)
+    assert ledger.reserve(chat_id=2, pid=7, qty=1) == (True, 0)
+    assert ledger.available(7) == 0
+
+
+def test_reserva_vencida_libera_el_stock(reloj):
+    ledger = ReservationLedger(lambda pid: 3, ttl_s=60)
+    ledger.reserve(1, 7, 3)
+    assert ledger.reserve(2, 7, 1) == (False, 0)
+    reloj[0] += 61
+    assert ledger.reserve(2, 7, 1) == (True, 2)
+
+
+def test_commit_pasa_a_pendiente_y_settle_cancel_lo_liberan(reloj):
+    stock = {7: 5}
+    ledger = ReservationLedger(lambda pid: stock[pid], ttl_s=60)
+    ledger.reserve(1, 7, 4)
+    assert ledger.commit(1, {7: 4}) == []
+    assert ledger.available(7) == 1
+    assert ledger.stats()["unidades_pendientes"] == 4
+
+    # el envío descontó en la base y en el snapshot
+    stock[7] = 1
+    ledger.settle({7: 4})
+    assert ledger.available(7) == 1
+
+    ledger.reserve(2, 7, 1)
+    assert ledger.commit(2, {7: 1}) == []
+    ledger.cancel({7: 1})
+    assert ledger.available(7) == 1
+
+
+def test_commit_con_fallos_no_cambia_nada(reloj):
+    ledger = ReservationLedger(lambda pid: 2, ttl_s=60)
+    ledger.reserve(1, 7, 2)
+    assert ledger.commit(2, {7: 1, 8: 1}) == [(7, 1, 0)]
+    assert ledger.stats()["unidades_pendientes"] == 0
+    assert ledger.commit(1, {7: 2}) == []
@@ -0,0 +1,56 @@
+# tests/test_search_index.py
+import threading
+
+from services.catalog import Producto
+from services.search_index import SearchIndex
+from utils.text import _norm
+
+
+def _producto(pid, nombre, descripcion=""):
+    return Producto(pid, nombre, descripcion, "", 1000, 5, None, _norm(nombre), _norm(descripcion))
+
+
+def test_search_por_subcadena_y_singular():
+    index = SearchIndex()
+    index.rebuild([_producto(1, "Jabón de baño"), _producto(2, "Papel higiénico"), _producto(3, "Luces LED")])
+    assert index.search("jabon", 10, lambda pid: True) == [1]
+    assert index.search("luz", 10, lambda pid: True) == [3]
+    assert index.search("jabón", 10, lambda pid: pid != 1) == []
+
+
+def test_upsert_reemplaza_el_texto_indexado():
+    index = SearchIndex()
+    index.rebuild([_producto(1, "Jabón de baño")])
+    index.upsert(_producto(1, "Shampoo"))
+    assert index.search("jabon", 10, lambda pid: True) == []
+    assert index.search("shampoo", 10, lambda pid: True) == [1]
+
+
+def test_upsert_concurrente_con_search():
+    index = SearchIndex()
+    index.rebuild([_producto(1, "Jabón de baño")])
+    errores = []
+    listo = threading.Event()
+
+    def escritor():
+        try:
+            for pid in range(2, 1000):
+                index.upsert(_producto(pid, f"Jabón líquido {pid}"))
+        finally:
+            listo.set()
+
+    def lector():
+        try:
+            while not listo.is_set():
+                index.search("jabon", 50, lambda pid: True)
+                index.best_matches(["jabon liquido"], lambda pid: True)
+        except Exception as e:   # KeyError si una consulta ve un trigrama sin su documento
+            errores.append(e)
+
+    hilos = [threading.Thread(target=escritor)] + [threading.Thread(target=lector) for _ in range(3)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    assert errores == []
+    assert len(index.search("jabon", 5000, lambda pid: True)) == 999
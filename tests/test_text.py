@@ -0,0 +1,14 @@
+# tests/test_text.py
+from utils.text import search_columns
+
+
+def test_search_columns_normaliza_y_singulariza():
+    nombre_norm, descripcion_norm, toks = search_columns("Jabones de Baño", "Aroma a  Limón x 3 jabones")
+    assert nombre_norm == "jabones de bano"
+    assert descripcion_norm == "aroma a limon x 3 jabones"
+    # singularizados, sin repetir, ordenados y sin tokens de una letra
+    assert toks == ["aroma", "bano", "de", "jabon", "limon"]
+
+
+def test_search_columns_textos_vacios():
+    assert search_columns("", None) == ("", "", [])
@@ -1,4 +1,5 @@
-import re, unicodedata
+import os, re, unicodedata
+from functools import lru_cache
 
 def strip_think(text: str) -> str:
     if not text: return ""
@@ -8,11 +9,87 @@ def strip_think(text: str) -> str:
     if m and m.group(1).strip(): return m.group(1).strip()
     return re.sub(r"</?think>", "", text, flags=re.IGNORECASE).strip()
 
+# ---------- normalización (única para todo el bot) ----------
+# Una sola pasada de str.translate: cada carácter se mapea a su forma sin
+# marcas (NFD sin categoría Mn). La tabla se completa sola la primera vez que
+# aparece un carácter, así unicodedata corre una vez por carácter distinto y
+# no una vez por carácter de cada mensaje.
+NORM_CACHE = int(os.getenv("NORM_CACHE", "65536"))
+
+class _TablaSinMarcas(dict):
+    def __missing__(self, cp: int):
+        ch = chr(cp)
+        base = "".join(c for c in unicodedata.normalize("NFD", ch) if unicodedata.category(c) != "Mn")
+        self[cp] = base
+        return base
+
+_SIN_MARCAS = _TablaSinMarcas({cp: chr(cp) for cp in range(128)})
+for _ch in "áàâäãåāéèêëēíìîïīóòôöõōúùûüūñçýÿ¿¡":   # precarga las del español
+    _SIN_MARCAS[ord(_ch)], _SIN_MARCAS[ord(_ch.upper())]      # (el acceso dispara __missing__)
+
+@lru_cache(maxsize=NORM_CACHE)
 def _norm(s: str) -> str:
+    """Sin acentos, minúsculas y espacios colapsados (cacheado para textos frecuentes)."""
     if not s: return ""
-    s = unicodedata.normalize("NFD", s)
-    s = "".join(ch for ch in s if unicodedata.category(ch) != "Mn")
-    return " ".join(s.lower().strip().split())
+    return " ".join(s.translate(_SIN_MARCAS).lower().split())
+
+def tokens(s: str) -> tuple:
+    """Tokenizador único: tokens del texto normalizado."""
+    return tuple(_norm(s).split())
+
+@lru_cache(maxsize=NORM_CACHE)
+def _singularize_token_es(t: str) -> str:
+    """Singulariza muy básico para español: papeles->papel, jabones->jabon, luces->luz, toallas->toalla."""
+    t = t.strip()
+    if not t:
+        return t
+
+    # luces -> luz, arroces -> arroz
+    if t.endswith("ces") and len(t) > 3:
+        return t[:-3] + "z"
+
+    # palabras acabadas en 'es' con consonante antes: papeles->papel, jabones->jabon, flores->flor
+    if t.endswith("es") and len(t) > 3:
+        # si antes de 'es' hay consonante o 'n/r/l/z', suele quitarse 'es'
+        if t[-3] not in "aeiou":
+            return t[:-2]
+
+    # acabadas en 's' (toallas->toalla, cepillos->cepillo). Evita días de la semana, etc.
+    if t.endswith("s") and len(t) > 3:
+        return t[:-1]
+
+    return t
+
+@lru_cache(maxsize=NORM_CACHE)
+def _singularize_phrase_es(s: str) -> str:
+    """Singulariza cada token de una frase normalizada (sin acentos)."""
+    return " ".join(_singularize_token_es(p) for p in tokens(s))
+
+def search_columns(nombre: str, descripcion: str):
+    """
+    Columnas de búsqueda precalculadas para descripcion_productos:
+    (nombre_norm, descripcion_norm, tokens singularizados sin repetir).
+    Es la misma normalización que usa el índice del bot.
+    """
+    nombre_norm, descripcion_norm = _norm(nombre), _norm(descripcion)
+    toks = sorted({
+        _singularize_token_es(t)
+        for t in tokens(nombre_norm + " " + descripcion_norm)
+        if len(t) > 1
+    })
+    return nombre_norm, descripcion_norm, toks
+
+# Números escritos → dígitos, con una sola expresión regular precompilada
+NUMEROS_TEXTO = {
+    'un': 1, 'uno': 1, 'una': 1, 'dos': 2, 'tres': 3, 'cuatro': 4, 'cinco': 5,
+    'seis': 6, 'siete': 7, 'ocho': 8, 'nueve': 9, 'diez': 10, 'once': 11,
+    'doce': 12, 'quince': 15, 'veinte': 20,
+}
+_NUMEROS_RE = re.compile(r"\b(" + "|".join(sorted(NUMEROS_TEXTO, key=len, reverse=True)) + r")\b")
+
+def numeros_a_digitos(text: str) -> str:
+    """Minúsculas y números escritos como dígitos ("dos jabones" → "2 jabones")."""
+    return _NUMEROS_RE.sub(lambda m: str(NUMEROS_TEXTO[m.group(1)]), text.lower())
 
 _NUM_WORDS = {"uno":1, "una":1, "un":1, "dos":2, "tres":3, "cuatro":4, "cinco":5, "seis":6,
               "siete":7, "ocho":8, "nueve":9, "diez":10, "par":2, "par de":2}